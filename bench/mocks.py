@@ -0,0 +1,297 @@
+"""
+Фейковые бэкенды для нагрузочных прогонов без GPU: Ollama, ComfyUI, Whisper, XTTS, OpenAI.
+
+Задержки и поведение стримов задаются Profile; запуск отдельного бэкенда:
+    python -m bench.mocks ollama --port 11434 --ttft 0.2 --tokens 64 --token-interval 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, fields
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from gateway.tts_cache import wav_header, write_wav
+
+MODEL = "qwen2.5:3b-instruct-q5_K_M"
+
+
+@dataclass
+class Profile:
+    latency: float = 0.05          # базовая задержка ответа, с
+    jitter: float = 0.2            # разброс задержки, доля от неё
+    ttft: float = 0.2              # время до первого токена / чанка
+    tokens: int = 64               # токенов в ответе LLM
+    token_interval: float = 0.02   # пауза между токенами (и чанками TTS)
+    error_rate: float = 0.0        # доля ответов 503
+    tail_rate: float = 0.0         # доля медленных ответов (хвост задержек)
+    tail_factor: float = 10.0      # во сколько раз медленнее обычного
+    audio_factor: float = 0.05     # Whisper: секунд обработки на секунду аудио
+    image_steps: int = 5           # ComfyUI: шагов прогресса
+    step_time: float = 0.2         # ComfyUI: секунд на шаг
+
+    def delay(self, base: float) -> float:
+        if self.tail_rate > 0 and random.random() < self.tail_rate:
+            base *= self.tail_factor
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    async def sleep(self, base: float) -> None:
+        await asyncio.sleep(self.delay(base))
+
+    def fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+def _unavailable() -> JSONResponse:
+    return JSONResponse({"error": "mock overloaded"}, status_code=503)
+
+
+def _png(size: int = 64) -> bytes:
+    raw = b"".join(b"\x00" + b"\xc8\x1e\x1e" * size for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+def ollama_app(p: Profile) -> FastAPI:
+    app = FastAPI()
+
+    def final(body: Dict[str, Any], key: str, text: Any) -> Dict[str, Any]:
+        return {"model": body.get("model", MODEL), key: text, "done": True, "done_reason": "stop",
+                "prompt_eval_count": 32, "prompt_eval_duration": int(p.ttft * 1e9),
+                "eval_count": p.tokens, "eval_duration": int(p.tokens * p.token_interval * 1e9) or 1}
+
+    async def generate(request: Request):
+        body = await request.json()
+        if p.fail():
+            return _unavailable()
+        chat = "messages" in body
+        key = "message" if chat else "response"
+
+        def piece(text: str) -> Any:
+            return {"role": "assistant", "content": text} if chat else text
+
+        if not body.get("stream", True):
+            await p.sleep(p.ttft + p.tokens * p.token_interval)
+            return final(body, key, piece(" ".join(f"t{i}" for i in range(p.tokens))))
+
+        async def chunks():
+            await p.sleep(p.ttft)
+            for i in range(p.tokens):
+                yield json.dumps({"model": body.get("model", MODEL), key: piece(f"t{i} "), "done": False}) + "\n"
+                await p.sleep(p.token_interval)
+            yield json.dumps(final(body, key, piece(""))) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    app.post("/api/chat")(generate)
+    app.post("/api/generate")(generate)
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        if p.fail():
+            return _unavailable()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await p.sleep(p.latency + len(texts) * p.token_interval)
+        # псевдослучайный, но детерминированный по тексту вектор
+        dim = body.get("dimensions") or 64
+        vectors = [[rng.uniform(-1, 1) for _ in range(dim)] for rng in map(random.Random, texts)]
+        return {"model": body.get("model", MODEL), "embeddings": vectors}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": MODEL, "model": MODEL}]}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": MODEL, "model": MODEL}]}
+
+    return app
+
+
+def whisper_app(p: Profile) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/transcribe")
+    async def transcribe(request: Request):
+        form = await request.form()
+        size = 0
+        while chunk := await form["file"].read(1 << 20):
+            size += len(chunk)
+        await form.close()
+        if p.fail():
+            return _unavailable()
+        duration = size / 32000  # как будто PCM16 16 кГц
+        await p.sleep(p.latency + duration * p.audio_factor)
+        return {"text": "тестовая расшифровка", "language": form.get("language") or "ru",
+                "duration": round(duration, 3),
+                "segments": [{"start": 0.0, "end": round(duration, 3), "text": "тестовая расшифровка"}]}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "model": "mock"}
+
+    return app
+
+
+def xtts_app(p: Profile, sample_rate: int = 24000) -> FastAPI:
+    app = FastAPI()
+    # ~50 мс тишины на чанк и по чанку на 20 символов
+    chunk = b"\x00\x00" * (sample_rate // 20)
+
+    @app.post("/tts")
+    async def tts(request: Request):
+        body = await request.json()
+        if p.fail():
+            return _unavailable()
+        count = max(1, len(body.get("text", "")) // 20)
+        if not body.get("stream"):
+            await p.sleep(p.ttft + count * p.token_interval)
+            return Response(write_wav(chunk * count, sample_rate), media_type="audio/wav")
+
+        async def chunks():
+            await p.sleep(p.ttft)
+            yield wav_header(sample_rate)
+            for _ in range(count):
+                yield chunk
+                await p.sleep(p.token_interval)
+
+        return StreamingResponse(chunks(), media_type="audio/wav")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def comfy_app(p: Profile) -> FastAPI:
+    app = FastAPI()
+    sockets: Dict[str, WebSocket] = {}
+    history: Dict[str, Dict[str, Any]] = {}
+    image = _png()
+    counter = {"n": 0}
+
+    async def send(client_id: str, message: Dict[str, Any]) -> None:
+        ws = sockets.get(client_id)
+        if ws is not None:
+            try:
+                await ws.send_text(json.dumps(message))
+            except Exception:
+                sockets.pop(client_id, None)
+
+    async def run(prompt_id: str, client_id: str) -> None:
+        await p.sleep(p.latency)
+        await send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        for step in range(1, p.image_steps + 1):
+            await p.sleep(p.step_time)
+            await send(client_id, {"type": "progress",
+                                   "data": {"value": step, "max": p.image_steps, "prompt_id": prompt_id, "node": "3"}})
+        images = [{"filename": f"{prompt_id}.png", "subfolder": "", "type": "output"}]
+        history[prompt_id] = {"outputs": {"9": {"images": images}},
+                              "status": {"status_str": "success", "completed": True}}
+        await send(client_id, {"type": "executed",
+                               "data": {"node": "9", "prompt_id": prompt_id, "output": {"images": images}}})
+        await send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    @app.post("/prompt")
+    async def prompt(request: Request):
+        body = await request.json()
+        if p.fail():
+            return _unavailable()
+        prompt_id = str(uuid.uuid4())
+        counter["n"] += 1
+        asyncio.create_task(run(prompt_id, body.get("client_id", "")))
+        return {"prompt_id": prompt_id, "number": counter["n"], "node_errors": {}}
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket, clientId: str = ""):
+        await websocket.accept()
+        sockets[clientId] = websocket
+        await websocket.send_text(json.dumps({"type": "status",
+                                              "data": {"status": {"exec_info": {"queue_remaining": 0}}}}))
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            sockets.pop(clientId, None)
+
+    @app.get("/history/{prompt_id}")
+    async def get_history(prompt_id: str):
+        entry = history.get(prompt_id)
+        return {prompt_id: entry} if entry else {}
+
+    @app.get("/view")
+    async def view(filename: str, subfolder: str = "", type: str = "output"):
+        return Response(image, media_type="image/png")
+
+    return app
+
+
+def openai_app(p: Profile) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        if p.fail():
+            return JSONResponse({"error": {"message": "mock overloaded", "type": "server_error"}}, status_code=503)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body["model"]}
+        if not body.get("stream"):
+            await p.sleep(p.ttft + p.tokens * p.token_interval)
+            return {**base, "object": "chat.completion", "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": " ".join(f"t{i}" for i in range(p.tokens))},
+            }], "usage": {"prompt_tokens": 32, "completion_tokens": p.tokens, "total_tokens": 32 + p.tokens}}
+
+        async def events():
+            await p.sleep(p.ttft)
+            for i in range(p.tokens):
+                delta = {"index": 0, "delta": {"content": f"t{i} "}, "finish_reason": None}
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [delta]})}\n\n"
+                await p.sleep(p.token_interval)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+APPS = {"ollama": ollama_app, "whisper": whisper_app, "xtts": xtts_app, "comfy": comfy_app, "openai": openai_app}
+
+
+def add_profile_args(parser, prefix: str = "") -> None:
+    for f in fields(Profile):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", dest=prefix + f.name,
+                            type=type(f.default), default=f.default)
+
+
+def profile_from_args(args: argparse.Namespace) -> Profile:
+    return Profile(**{f.name: getattr(args, f.name) for f in fields(Profile)})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковый бэкенд для бенчмарков gateway")
+    parser.add_argument("kind", choices=sorted(APPS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    add_profile_args(parser)
+    args = parser.parse_args()
+    app = APPS[args.kind](profile_from_args(args))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
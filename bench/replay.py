@@ -0,0 +1,212 @@
+"""
+Replay журнала запросов (формат — в bench/workload.py) против работающего gateway.
+
+Темп: --rps (открытая модель, запросы уходят по расписанию независимо от ответов), иначе
+по полю t записей с ускорением --speed, иначе всё сразу в пределах --concurrency.
+Каждый запрос идёт с X-Debug-Timing: 1 — из Server-Timing берётся время бэкенда и очереди,
+чтобы отделить накладные расходы gateway. С --pid снимается RSS процесса gateway.
+
+    python -m bench.replay --url http://127.0.0.1:8080 --log bench/workload.jsonl --rps 20 --pid 1234
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.report import Result, format_table, summarize
+from bench.workload import file_bytes, load, synthetic
+from gateway.comfy_jobs import FINAL
+
+
+class RssSampler:
+    """RSS процесса (КиБ) из /proc раз в interval; без /proc (не Linux) — пусто."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Tuple[float, int]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def read(self) -> Optional[int]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            return None
+        return None
+
+    async def _loop(self) -> None:
+        while True:
+            rss = self.read()
+            if rss is not None:
+                self.samples.append((time.monotonic(), rss))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.pid:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def window(self, start: float, end: float) -> Optional[Dict[str, int]]:
+        rss = [v for t, v in self.samples if start <= t <= end]
+        if not rss:
+            return None
+        return {"start": rss[0], "peak": max(rss), "end": rss[-1]}
+
+
+def route_label(record: Dict[str, Any]) -> str:
+    body = record.get("json") or {}
+    return record["path"] + (" stream" if isinstance(body, dict) and body.get("stream") else "")
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    timings = {}
+    for item in value.split(","):
+        name, _, params = item.strip().partition(";")
+        for param in params.split(";"):
+            key, _, dur = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings[name] = float(dur) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+async def _follow(client: httpx.AsyncClient, url: str) -> int:
+    """Long-poll задачи (картинки) до финального статуса."""
+    while True:
+        r = await client.get(url, params={"wait": 60})
+        if r.is_error or r.json().get("status") in FINAL:
+            return r.status_code
+
+
+async def send(client: httpx.AsyncClient, record: Dict[str, Any], files: Dict[str, bytes]) -> Result:
+    route = route_label(record)
+    kwargs: Dict[str, Any] = {"headers": {"X-Debug-Timing": "1", **record.get("headers", {})}}
+    if "json" in record:
+        kwargs["json"] = record["json"]
+    if "form" in record:
+        kwargs["data"] = record["form"]
+    if "files" in record:
+        kwargs["files"] = {}
+        for field, spec in record["files"].items():
+            cache_key = json.dumps(spec, sort_keys=True)
+            if cache_key not in files:
+                files[cache_key] = file_bytes(spec)
+            kwargs["files"][field] = (spec.get("name", "file"), files[cache_key])
+
+    started = time.monotonic()
+    try:
+        async with client.stream(record.get("method", "POST"), record["path"], **kwargs) as r:
+            ttfb = time.monotonic() - started
+            timings = parse_server_timing(r.headers.get("server-timing", ""))
+            body = bytearray()
+            async for chunk in r.aiter_bytes():
+                if record.get("follow"):
+                    body += chunk
+            status = r.status_code
+        if record.get("follow") and not r.is_error:
+            url = json.loads(bytes(body)).get("url")
+            if url:
+                status = await _follow(client, url)
+    except (httpx.HTTPError, ValueError) as e:
+        elapsed = time.monotonic() - started
+        return Result(route, 0, elapsed, elapsed, error=f"{type(e).__name__}: {e}")
+    return Result(route, status, time.monotonic() - started, ttfb, timings)
+
+
+async def replay(client: httpx.AsyncClient, records: List[Dict[str, Any]], rps: Optional[float] = None,
+                 speed: float = 1.0, concurrency: int = 256) -> Tuple[List[Result], float]:
+    """Результаты в порядке завершения и длительность прогона, с."""
+    sem = asyncio.Semaphore(concurrency)
+    files: Dict[str, bytes] = {}
+    results: List[Result] = []
+    timed = rps is None and all("t" in r for r in records)
+    started = time.monotonic()
+
+    async def one(i: int, record: Dict[str, Any]) -> None:
+        if rps:
+            delay = i / rps
+        elif timed:
+            delay = (record["t"] - records[0]["t"]) / speed
+        else:
+            delay = 0.0
+        await asyncio.sleep(max(0.0, started + delay - time.monotonic()))
+        async with sem:
+            results.append(await send(client, record, files))
+
+    await asyncio.gather(*(one(i, r) for i, r in enumerate(records)))
+    return results, time.monotonic() - started
+
+
+async def run(url: str, records: List[Dict[str, Any]], rps: Optional[float] = None, speed: float = 1.0,
+              concurrency: int = 256, by_route: bool = False, pid: Optional[int] = None,
+              timeout: float = 600.0) -> Dict[str, Any]:
+    """
+    Прогон и сводка. by_route — маршруты по очереди отдельными фазами: пропускная
+    способность и память тогда считаются на маршрут, а не на всю смесь.
+    """
+    sampler = RssSampler(pid)
+    sampler.start()
+    results: List[Result] = []
+    durations: Dict[str, float] = {}
+    memory: Dict[str, Dict[str, int]] = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        phases: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            phases.setdefault(route_label(record) if by_route else "*", []).append(record)
+        overall = time.monotonic()
+        for name, batch in phases.items():
+            phase_start = time.monotonic()
+            await asyncio.sleep(sampler.interval)  # RSS до фазы
+            got, durations[name] = await replay(client, batch, rps, speed, concurrency)
+            results += got
+            window = sampler.window(phase_start, time.monotonic())
+            if window:
+                memory[name] = window
+        durations["*"] = time.monotonic() - overall
+        memory["*"] = sampler.window(overall, time.monotonic()) or {}
+    await sampler.stop()
+    return summarize(results, durations, memory)
+
+
+def load_records(log: Optional[str], count: int) -> List[Dict[str, Any]]:
+    return list(load(log)) if log else synthetic(count)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay журнала запросов против gateway")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--log", help="журнал JSONL; без него — синтетическая смесь")
+    parser.add_argument("--count", type=int, default=200, help="запросов в синтетической смеси")
+    parser.add_argument("--rps", type=float)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--by-route", action="store_true")
+    parser.add_argument("--pid", type=int, help="PID gateway для замера памяти")
+    parser.add_argument("--json", help="куда сохранить сводку")
+    args = parser.parse_args()
+    summary = asyncio.run(run(args.url, load_records(args.log, args.count), args.rps, args.speed,
+                              args.concurrency, args.by_route, args.pid))
+    print(format_table(summary))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
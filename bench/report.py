@@ -0,0 +1,164 @@
+"""
+Сводка прогона: p50/p95/p99 полного времени, TTFB и накладных расходов gateway по маршрутам,
+пропускная способность, ошибки и память процесса gateway. Сравнение с базовым прогоном:
+
+    python -m bench.report bench_output.json --baseline baseline.json --tolerance 0.15
+"""
+import argparse
+import json
+import math
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+@dataclass
+class Result:
+    route: str
+    status: int
+    total_s: float             # до последнего байта ответа (у клиента)
+    ttfb_s: float              # до заголовков ответа (у клиента)
+    timings: Dict[str, float] = field(default_factory=dict)  # Server-Timing gateway, с
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status < 400
+
+    @property
+    def backend_s(self) -> Optional[float]:
+        """Время бэкенда до ответа gateway: целиком для обычных ответов, до заголовков для стримов."""
+        if "upstream" in self.timings:
+            return self.timings["upstream"]
+        return self.timings.get("upstream_ttfb")
+
+    @property
+    def overhead_s(self) -> Optional[float]:
+        """Время gateway до заголовков за вычетом бэкенда и очереди допуска."""
+        if "app" not in self.timings or self.backend_s is None:
+            return None
+        return max(0.0, self.timings["app"] - self.backend_s - self.timings.get("queue", 0.0))
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def _dist(values: List[float]) -> Dict[str, Optional[float]]:
+    out = {f"p{round(q * 100)}": percentile(values, q) for q in QUANTILES}
+    out["mean"] = sum(values) / len(values) if values else None
+    return out
+
+
+def _ms(values: Dict[str, Optional[float]]) -> Dict[str, Optional[float]]:
+    return {k: None if v is None else round(v * 1000, 2) for k, v in values.items()}
+
+
+def summarize(results: List[Result], durations: Dict[str, float],
+              memory: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """
+    durations и memory — по маршруту (прогон по фазам) или под ключом "*" (смешанный прогон);
+    память — RSS gateway в КиБ: start, peak, end.
+    """
+    routes: Dict[str, List[Result]] = {}
+    for r in results:
+        routes.setdefault(r.route, []).append(r)
+    routes["*"] = results
+
+    summary: Dict[str, Any] = {}
+    for route, rs in sorted(routes.items()):
+        ok = [r for r in rs if r.ok]
+        duration = durations.get(route) or durations.get("*") or 0.0
+        overhead = [r.overhead_s for r in ok if r.overhead_s is not None]
+        backend = [r.backend_s for r in ok if r.backend_s is not None]
+        summary[route] = {
+            "requests": len(rs),
+            "errors": len(rs) - len(ok),
+            "statuses": _count(str(r.status) if r.error is None else "error" for r in rs),
+            "throughput_rps": round(len(ok) / duration, 2) if duration else None,
+            "latency_ms": _ms(_dist([r.total_s for r in ok])),
+            "ttfb_ms": _ms(_dist([r.ttfb_s for r in ok])),
+            "backend_ms": _ms(_dist(backend)),
+            "overhead_ms": _ms(_dist(overhead)),
+            "memory_kib": memory.get(route) or (memory.get("*") if route == "*" else None),
+        }
+    return summary
+
+
+def _count(items) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def format_table(summary: Dict[str, Any]) -> str:
+    head = (f"{'route':<22}{'req':>6}{'err':>5}{'rps':>8}  {'latency p50/p95/p99 ms':>24}"
+            f"  {'ttfb p50/p95 ms':>17}  {'overhead p50/p95/p99 ms':>25}  {'rss peak MiB':>12}")
+    lines = [head, "-" * len(head)]
+
+    def trio(d: Dict[str, Optional[float]], keys=("p50", "p95", "p99")) -> str:
+        return "/".join("-" if d.get(k) is None else f"{d[k]:.1f}" for k in keys)
+
+    for route, s in summary.items():
+        mem = s.get("memory_kib") or {}
+        peak = f"{mem['peak'] / 1024:.1f}" if mem.get("peak") else "-"
+        rps = "-" if s["throughput_rps"] is None else f"{s['throughput_rps']:.2f}"
+        lines.append(f"{route:<22}{s['requests']:>6}{s['errors']:>5}{rps:>8}  {trio(s['latency_ms']):>24}"
+                     f"  {trio(s['ttfb_ms'], ('p50', 'p95')):>17}  {trio(s['overhead_ms']):>25}  {peak:>12}")
+    return "\n".join(lines)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.15,
+            floor_ms: float = 1.0) -> List[str]:
+    """
+    Регрессии относительно базового прогона: рост перцентилей полного времени и накладных
+    расходов больше чем на tolerance (и больше floor_ms — шум на микросекундах не в счёт),
+    падение пропускной способности, новые ошибки.
+    """
+    problems = []
+    for route, base in baseline.items():
+        cur = current.get(route)
+        if cur is None:
+            continue
+        for metric in ("latency_ms", "overhead_ms"):
+            for q in ("p50", "p95", "p99"):
+                b, c = base[metric].get(q), cur[metric].get(q)
+                if b is None or c is None:
+                    continue
+                if c > b * (1 + tolerance) and c - b > floor_ms:
+                    problems.append(f"{route}: {metric} {q} {b:.1f} -> {c:.1f}")
+        b, c = base.get("throughput_rps"), cur.get("throughput_rps")
+        if b and c is not None and c < b * (1 - tolerance):
+            problems.append(f"{route}: throughput {b:.2f} -> {c:.2f} rps")
+        if cur["errors"] > base["errors"]:
+            problems.append(f"{route}: errors {base['errors']} -> {cur['errors']}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сводка и сравнение прогонов bench")
+    parser.add_argument("result", help="JSON-сводка из bench.run/bench.replay (--json)")
+    parser.add_argument("--baseline", help="базовая сводка для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    with open(args.result, encoding="utf-8") as f:
+        current = json.load(f)
+    print(format_table(current))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(current, json.load(f), args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
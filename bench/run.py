@@ -0,0 +1,135 @@
+"""
+Полный прогон без GPU: фейковые бэкенды + gateway в отдельных процессах + replay + сводка.
+
+    python -m bench.run --rps 30 --count 600 --json bench_output.json
+    python -m bench.run --by-route --ttft 0 --tokens 1 --latency 0   # чистые накладные gateway
+    python -m bench.run --env ADMISSION_ENABLED=0 --baseline bench_output.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import httpx
+
+from bench.mocks import APPS, add_profile_args
+from bench.replay import load_records, run
+from bench.report import compare, format_table
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port: int, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"process {proc.args} exited with {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"port {port} is not ready after {timeout:g}s")
+
+
+def profile_argv(args: argparse.Namespace) -> List[str]:
+    argv = []
+    for name, value in vars(args).items():
+        if name.startswith("profile_"):
+            argv += [f"--{name[len('profile_'):].replace('_', '-')}", str(value)]
+    return argv
+
+
+@contextmanager
+def stack(args: argparse.Namespace) -> Iterator[Dict[str, int]]:
+    """Поднимает бэкенды и gateway; отдаёт {"port": ..., "pid": ...} gateway."""
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    procs: List[subprocess.Popen] = []
+    try:
+        mocks = [(kind, free_port()) for kind in APPS for _ in range(args.llm_nodes if kind == "ollama" else 1)]
+        for kind, port in mocks:
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "bench.mocks", kind, "--port", str(port), *profile_argv(args)],
+                cwd=ROOT, env=env,
+            ))
+        for proc, (_, port) in zip(procs, mocks):
+            wait_port(port, proc)
+
+        ports = dict(mocks)
+        gateway_env = {
+            **env,
+            "OLLAMA_URLS": ",".join(f"http://127.0.0.1:{port}" for kind, port in mocks if kind == "ollama"),
+            "XTTS_URL": f"http://127.0.0.1:{ports['xtts']}",
+            "WHISPER_URL": f"http://127.0.0.1:{ports['whisper']}",
+            "COMFY_URL": f"http://127.0.0.1:{ports['comfy']}",
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{ports['openai']}/v1",
+            **dict(item.split("=", 1) for item in args.env),
+        }
+        port = free_port()
+        gateway = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "gateway.app:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=ROOT, env=gateway_env,
+        )
+        procs.append(gateway)
+        wait_port(port, gateway)
+        httpx.get(f"http://127.0.0.1:{port}/health", timeout=10.0).raise_for_status()
+        yield {"port": port, "pid": gateway.pid}
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон gateway на фейковых бэкендах")
+    parser.add_argument("--log", help="журнал JSONL (формат — bench/workload.py); без него — синтетика")
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--rps", type=float)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--by-route", action="store_true")
+    parser.add_argument("--llm-nodes", type=int, default=2, help="сколько фейковых Ollama в пуле")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE для gateway, можно несколько")
+    parser.add_argument("--json", help="куда сохранить сводку")
+    parser.add_argument("--baseline", help="сводка прошлого прогона: регрессии -> код выхода 1")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    profile = parser.add_argument_group("профиль фейковых бэкендов")
+    add_profile_args(profile, prefix="profile_")
+    args = parser.parse_args()
+
+    records = load_records(args.log, args.count)
+    with stack(args) as gw:
+        summary = asyncio.run(run(f"http://127.0.0.1:{gw['port']}", records, args.rps, args.speed,
+                                  args.concurrency, args.by_route, gw["pid"]))
+    print(format_table(summary))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(summary, json.load(f), args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
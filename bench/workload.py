@@ -0,0 +1,104 @@
+"""
+Журнал запросов для replay: JSONL, по записи на строку.
+
+    {"t": 0.25, "method": "POST", "path": "/chat", "json": {...}}
+    {"t": 0.40, "method": "POST", "path": "/stt", "form": {"language": "ru"},
+     "files": {"file": {"name": "a.wav", "seconds": 12}}}
+
+t — смещение от начала записи, с (необязательно: без него или с --rps задаёт темп replay).
+Файл для multipart — либо "path" к реальному файлу, либо "seconds" тишины PCM16 16 кГц.
+"follow": true — после ответа с "url" (задачи картинок) дождаться готовности long-poll'ом.
+
+Синтетическая смесь: python -m bench.workload --count 1000 > bench/workload.jsonl
+"""
+import argparse
+import json
+import random
+import sys
+from typing import Any, Dict, Iterator, List, Optional
+
+from gateway.tts_cache import write_wav
+
+# доли маршрутов в синтетической смеси
+DEFAULT_MIX = {
+    "chat": 0.35,
+    "chat_stream": 0.2,
+    "message": 0.1,
+    "chat_complete": 0.1,
+    "tts": 0.1,
+    "stt": 0.1,
+    "image": 0.05,
+}
+
+_WORDS = "как настроить балансировку нагрузки между узлами и не потерять контекст диалога".split()
+
+
+def _prompt(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _record(kind: str, i: int, rng: random.Random) -> Dict[str, Any]:
+    text = f"{i}: {_prompt(rng, rng.randint(5, 60))}"
+    if kind in ("chat", "chat_stream"):
+        return {"method": "POST", "path": "/chat", "json": {
+            "messages": [{"role": "user", "content": text}], "stream": kind == "chat_stream"}}
+    if kind == "message":
+        return {"method": "POST", "path": "/message", "json": {"prompt": text}}
+    if kind == "chat_complete":
+        return {"method": "POST", "path": "/chat_complete", "json": {
+            "model": "gpt-4o-mini", "messages": [{"role": "user", "content": text}]}}
+    if kind == "tts":
+        return {"method": "POST", "path": "/tts", "json": {"text": f"{text}. {_prompt(rng, 10)}.",
+                                                           "stream": rng.random() < 0.5}}
+    if kind == "stt":
+        return {"method": "POST", "path": "/stt", "form": {"language": "ru"},
+                "files": {"file": {"name": f"{i}.wav", "seconds": rng.choice([5, 15, 60])}}}
+    if kind == "image":
+        return {"method": "POST", "path": "/image/jobs", "json": {"text": text}, "follow": True}
+    raise ValueError(f"unknown workload kind: {kind}")
+
+
+def synthetic(count: int, mix: Optional[Dict[str, float]] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [_record(kind, i, rng) for i, kind in enumerate(kinds)]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """«chat=0.5,tts=0.5» -> {"chat": 0.5, "tts": 0.5}"""
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def load(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def file_bytes(spec: Dict[str, Any]) -> bytes:
+    if spec.get("path"):
+        with open(spec["path"], "rb") as f:
+            return f.read()
+    return write_wav(b"\x00\x00" * int(16000 * float(spec.get("seconds", 1))), 16000)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Синтетический журнал запросов для bench.replay")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--mix", default="", help="доли маршрутов, например chat=0.7,tts=0.3")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for record in synthetic(args.count, parse_mix(args.mix) if args.mix else None, args.seed):
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from gateway.metrics import observe_queue_wait
+
+INTERACTIVE = 0
+BATCH = 1
+CLASSES = {"interactive": INTERACTIVE, "batch": BATCH}
+CLASS_NAMES = {v: k for k, v in CLASSES.items()}
+
+# класс приоритета текущего запроса: ставит PriorityMiddleware, воркер брокера — BATCH
+PRIORITY: ContextVar[int] = ContextVar("priority", default=INTERACTIVE)
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """«llm=8:32,image=2:8» -> {"llm": (8, 32), "image": (2, 8)}: параллельность и длина очереди."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        limit, _, queue = value.partition(":")
+        limits[name.strip()] = (int(limit), int(queue or 0))
+    return limits
+
+
+def parse_key_classes(spec: str) -> Dict[str, int]:
+    """«key1:batch,key2:interactive» -> класс приоритета по API-ключу."""
+    keys = {}
+    for item in spec.split(","):
+        key, _, cls = item.strip().rpartition(":")
+        if key and cls in CLASSES:
+            keys[key] = CLASSES[cls]
+    return keys
+
+
+class Ticket:
+    def __init__(self, gate: "Gate"):
+        self.gate = gate
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.gate._release(time.monotonic() - self.started)
+
+
+class Gate:
+    """
+    Допуск к одному бэкенду: не больше limit запросов в работе и queue ожидающих на класс.
+
+    Ожидающие обслуживаются по приоритету (interactive раньше batch), внутри класса — FIFO.
+    Batch может занять не больше limit - reserve слотов: остаток всегда свободен для
+    интерактивных. Полная очередь или ожидание дольше timeout — сразу 429 с Retry-After,
+    оценённым по среднему времени удержания слота.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, reserve: int = 0, timeout: float = 30.0):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue = queue
+        self.reserve = min(reserve, self.limit - 1)
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = {INTERACTIVE: 0, BATCH: 0}
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._hold = 1.0  # EWMA времени удержания слота, с
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    def _can_run(self, priority: int) -> bool:
+        cap = self.limit - self.reserve if priority == BATCH else self.limit
+        return self.active < cap
+
+    def retry_after(self) -> int:
+        backlog = sum(self.waiting.values()) + 1
+        return max(1, math.ceil(self._hold * backlog / self.limit))
+
+    def _reject(self, reason: str) -> HTTPException:
+        return HTTPException(429, f"{self.name} is overloaded: {reason}",
+                             headers={"Retry-After": str(self.retry_after())})
+
+    def _grant(self) -> Ticket:
+        self.active += 1
+        self.stats["admitted"] += 1
+        return Ticket(self)
+
+    def _release(self, held: float) -> None:
+        self.active -= 1
+        self._hold = 0.8 * self._hold + 0.2 * held
+        while self._heap:
+            priority, _, fut = self._heap[0]
+            if fut.done():
+                heapq.heappop(self._heap)
+                continue
+            if not self._can_run(priority):
+                break
+            heapq.heappop(self._heap)
+            self.waiting[priority] -= 1
+            fut.set_result(self._grant())
+
+    def try_acquire(self, priority: Optional[int] = None) -> Ticket:
+        """Без ожидания: слот сейчас или 429 (для бэкендов со своей очередью, как ComfyUI)."""
+        priority = PRIORITY.get() if priority is None else priority
+        if any(not f.done() for _, _, f in self._heap) or not self._can_run(priority):
+            self.stats["rejected"] += 1
+            raise self._reject("no free slots")
+        observe_queue_wait(self.name, CLASS_NAMES[priority], 0.0)
+        return self._grant()
+
+    async def acquire(self, priority: Optional[int] = None) -> Ticket:
+        priority = PRIORITY.get() if priority is None else priority
+        ahead = any(not f.done() and p <= priority for p, _, f in self._heap)
+        if not ahead and self._can_run(priority):
+            observe_queue_wait(self.name, CLASS_NAMES[priority], 0.0)
+            return self._grant()
+        if self.waiting[priority] >= self.queue:
+            self.stats["rejected"] += 1
+            raise self._reject("queue is full")
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        self.waiting[priority] += 1
+        self.stats["queued"] += 1
+        started = time.monotonic()
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+            observe_queue_wait(self.name, CLASS_NAMES[priority], time.monotonic() - started)
+            return ticket
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # слот выдали в момент отмены или таймаута — возвращаем
+                fut.result().release()
+            else:
+                fut.cancel()
+                self.waiting[priority] -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+                raise self._reject(f"queued for more than {self.timeout:g}s") from None
+            raise
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "queue": self.queue, "reserve": self.reserve, "active": self.active,
+                "waiting": {"interactive": self.waiting[INTERACTIVE], "batch": self.waiting[BATCH]},
+                "avg_hold_s": round(self._hold, 3), **self.stats}
+
+
+class Admission:
+    def __init__(self, limits: Dict[str, Tuple[int, int]], reserve: float = 0.25, timeout: float = 30.0):
+        self.gates = {
+            name: Gate(name, limit, queue, reserve=math.ceil(limit * reserve), timeout=timeout)
+            for name, (limit, queue) in limits.items()
+        }
+
+    def gate(self, name: str) -> Optional[Gate]:
+        return self.gates.get(name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: g.snapshot() for name, g in self.gates.items()}
+
+
+def gate_for(admission: Optional[Admission], name: str) -> Optional[Gate]:
+    return admission.gate(name) if admission else None
+
+
+async def take(gate: Optional[Gate]) -> Optional[Ticket]:
+    """Слот на время стрима: освобождать через release_all при закрытии."""
+    return await gate.acquire() if gate else None
+
+
+def release_all(*items) -> None:
+    for item in items:
+        if item is not None:
+            item.release()
+
+
+@asynccontextmanager
+async def admit(gate: Optional[Gate]):
+    """Слот бэкенда на время блока; без gate (контроль выключен) — ничего не делает."""
+    if gate is None:
+        yield None
+        return
+    ticket = await gate.acquire()
+    try:
+        yield ticket
+    finally:
+        ticket.release()
+
+
+class PriorityMiddleware:
+    """ASGI-middleware: класс приоритета по API-ключу (Authorization: Bearer / X-API-Key) или заголовку."""
+
+    def __init__(self, app, header: str = "x-priority", api_keys: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.header = header.lower().encode("latin-1")
+        self.api_keys = api_keys or {}
+
+    def _priority(self, scope) -> int:
+        headers = dict(scope.get("headers") or ())
+        auth = headers.get(b"authorization", b"").decode("latin-1")
+        key = headers.get(b"x-api-key", b"").decode("latin-1") or auth.removeprefix("Bearer ").strip()
+        if key in self.api_keys:
+            return self.api_keys[key]
+        cls = headers.get(self.header, b"").decode("latin-1").strip().lower()
+        return CLASSES.get(cls, INTERACTIVE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = PRIORITY.set(self._priority(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            PRIORITY.reset(token)
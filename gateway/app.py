@@ -1,25 +1,182 @@
 from contextlib import asynccontextmanager
 import httpx
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 
-from gateway.servises import ollama, comfy, llm_openai #xtts, wisper
+from gateway.admission import Admission, PriorityMiddleware, gate_for, parse_key_classes, parse_limits
+from gateway.balancer import LLMPool
+from gateway.cache import ResponseCache
+from gateway.image_cache import ImageCache
+from gateway.metrics import (
+    InstrumentedTransport, MetricsMiddleware, backend_map, register_state, render, unregister_state,
+)
+from gateway.comfy_jobs import ComfyJobRegistry
+from gateway.resilience import (
+    BackendUnavailable, Breakers, HedgePolicy, PooledTransport, ResilientTransport, parse_pool_limits,
+)
+from gateway.embeddings import EmbeddingCache
+from gateway.singleflight import SingleFlight
+from gateway.tts_cache import TTSCache
+from gateway.vectors import VectorStore
+from gateway.warmup import WarmupManager
+from gateway.worker import make_worker
+from openaiGPT.servises import OPENAI_API_KEY, OpenAiAPIServise
+from gateway.servises import ollama, comfy, llm_openai, xtts, wisper, sessions, embed
+from gateway.sessions import SessionStore
+from gateway.settings import (
+    OLLAMA_URLS, OLLAMA_HEAVY_URLS, LLM_HEALTH_INTERVAL, LLM_EJECT_AFTER, LLM_READMIT_AFTER, LLM_WARM_SLACK,
+    CACHE_ENABLED, CACHE_MAX_ENTRIES, CACHE_MAX_MB, CACHE_TTL, CACHE_DIR, CACHE_DISK_MAX_MB,
+    ADMISSION_ENABLED, ADMISSION_LIMITS, ADMISSION_RESERVE, ADMISSION_QUEUE_TIMEOUT,
+    PRIORITY_HEADER, PRIORITY_API_KEYS, METRICS_TIMING_SAMPLE, XTTS, WHISPER, COMFY, COMFY_JOB_TTL, SINGLEFLIGHT_ROUTES, TTS_CACHE_DIR, TTS_CACHE_MAX_MB,
+    SINGLEFLIGHT_STREAM_BUFFER, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB, SESSION_MAX, SESSION_IDLE_TTL, SESSION_SUMMARIZE,
+    WARMUP_MODELS, OLLAMA_KEEP_ALIVE, WARMUP_INTERVAL, WARMUP_TIMEOUT, EMBED_CACHE_MB, VECTOR_DIR,
+    VECTOR_MAX_COLLECTIONS, BREAKER_FAILURES, BREAKER_COOLDOWN, RETRY_ATTEMPTS, RETRY_BACKOFF, HEDGE_QUANTILE,
+    HEDGE_MIN_SAMPLES, HEDGE_BUDGET, BACKEND_POOL_LIMITS,
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.http = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0, read=120.0))
+    backends = backend_map([("llm", OLLAMA_URLS), ("llm_heavy", OLLAMA_HEAVY_URLS),
+                            ("tts", [XTTS]), ("stt", [WHISPER]), ("image", [COMFY])])
+    # автоматы и повторы снаружи, чтобы каждая попытка попадала в метрики; под ними — пул на адрес
+    breakers = app.state.breakers = Breakers(BREAKER_FAILURES, BREAKER_COOLDOWN)
+    pooled = PooledTransport(backends, parse_pool_limits(BACKEND_POOL_LIMITS))
+    app.state.transport = ResilientTransport(InstrumentedTransport(backends, pooled), breakers, backends,
+                                             retries=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF)
+    app.state.http = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0, read=120.0),
+                                       transport=app.state.transport)
+    admission = app.state.admission = Admission(
+        parse_limits(ADMISSION_LIMITS), reserve=ADMISSION_RESERVE, timeout=ADMISSION_QUEUE_TIMEOUT,
+    ) if ADMISSION_ENABLED else None
+    pool_args = dict(interval=LLM_HEALTH_INTERVAL, eject_after=LLM_EJECT_AFTER,
+                     readmit_after=LLM_READMIT_AFTER, warm_slack=LLM_WARM_SLACK, breakers=breakers)
+    hedge_args = dict(quantile=HEDGE_QUANTILE, min_samples=HEDGE_MIN_SAMPLES, budget=HEDGE_BUDGET)
+    app.state.llm_pool = LLMPool(OLLAMA_URLS, app.state.http, gate=gate_for(admission, "llm"),
+                                 hedge=HedgePolicy(**hedge_args), **pool_args)
+    app.state.llm_pool.start()
+    app.state.llm_heavy_pool = LLMPool(
+        OLLAMA_HEAVY_URLS, app.state.http, gate=gate_for(admission, "llm_heavy"),
+        hedge=HedgePolicy(**hedge_args), **pool_args
+    ) if OLLAMA_HEAVY_URLS else None
+    if app.state.llm_heavy_pool:
+        app.state.llm_heavy_pool.start()
+    pools = [("light", app.state.llm_pool)] + ([("heavy", app.state.llm_heavy_pool)] if app.state.llm_heavy_pool else [])
+    app.state.warmup = WarmupManager(pools, WARMUP_MODELS, keep_alive=OLLAMA_KEEP_ALIVE,
+                                     interval=WARMUP_INTERVAL, timeout=WARMUP_TIMEOUT)
+    app.state.warmup.start()
+    app.state.cache = ResponseCache(
+        max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_MB * 1024 * 1024, ttl=CACHE_TTL,
+        disk_dir=CACHE_DIR or None, disk_max_bytes=CACHE_DISK_MAX_MB * 1024 * 1024,
+    ) if CACHE_ENABLED else None
+    app.state.sessions = SessionStore(SESSION_MAX, SESSION_IDLE_TTL, summarize=SESSION_SUMMARIZE)
+    app.state.embed_cache = EmbeddingCache(EMBED_CACHE_MB * 1024 * 1024)
+    app.state.vectors = VectorStore(VECTOR_DIR or None, VECTOR_MAX_COLLECTIONS)
+    app.state.tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024) if TTS_CACHE_DIR else None
+    app.state.image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024) if IMAGE_CACHE_DIR else None
+    app.state.openai = OpenAiAPIServise() if OPENAI_API_KEY else None
+    app.state.comfy = ComfyJobRegistry(COMFY, app.state.http, ttl=COMFY_JOB_TTL, gate=gate_for(admission, "image"))
+    app.state.comfy.start()
+    app.state.singleflight = SingleFlight(SINGLEFLIGHT_ROUTES, SINGLEFLIGHT_STREAM_BUFFER)
+    collector = register_state(app.state)
+    app.state.worker = make_worker(app.state)
+    if app.state.worker:
+        await app.state.worker.start()
     try:
         yield
     finally:
+        if app.state.worker:
+            await app.state.worker.stop()
+        await app.state.comfy.stop()
+        await app.state.warmup.stop()
+        if app.state.openai:
+            await app.state.openai.aclose()
+        if app.state.llm_heavy_pool:
+            await app.state.llm_heavy_pool.stop()
+        await app.state.llm_pool.stop()
+        unregister_state(collector)
         await app.state.http.aclose()
 
 app = FastAPI(title="Local AI Gateway", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, timing_sample=METRICS_TIMING_SAMPLE)
+app.add_middleware(PriorityMiddleware, header=PRIORITY_HEADER, api_keys=parse_key_classes(PRIORITY_API_KEYS))
 
-# app.include_router(xtts.router)
-# app.include_router(wisper.router)
+@app.exception_handler(BackendUnavailable)
+async def backend_unavailable(request: Request, exc: BackendUnavailable):
+    # автомат бэкенда разомкнут — отвечаем сразу, не дожидаясь таймаута
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(max(1, round(exc.retry_after)))})
+
+@app.exception_handler(httpx.TransportError)
+async def backend_failed(request: Request, exc: httpx.TransportError):
+    # сетевая ошибка бэкенда после всех повторов — 502, а не необработанный 500
+    return JSONResponse({"detail": f"Backend request failed: {exc!r}"}, status_code=502)
+
+app.include_router(xtts.router)
+app.include_router(wisper.router)
 app.include_router(ollama.router)
+app.include_router(sessions.router)
+app.include_router(embed.router)
 app.include_router(comfy.router)
 app.include_router(llm_openai.router)
 
 @app.get("/health")
 async def health():
     return {"ok": True}
+
+@app.get("/ready", summary="Готовность: модели прогреты хотя бы на одном узле каждого пула (иначе 503)")
+async def ready():
+    warmup = app.state.warmup
+    return JSONResponse({"ready": warmup.ready, "warmup_s": warmup.warmup_s}, status_code=200 if warmup.ready else 503)
+
+@app.get("/warmup/stats", summary="Прогрев: модели в памяти узлов, время загрузки, keep-alive")
+async def warmup_stats():
+    return await app.state.warmup.report()
+
+@app.get("/metrics", summary="Метрики Prometheus", include_in_schema=False)
+async def metrics():
+    data, media = render()
+    return Response(content=data, media_type=media)
+
+@app.get("/llm/nodes", summary="Состояние пула LLM-бэкендов")
+async def llm_nodes():
+    heavy = app.state.llm_heavy_pool
+    return {"light": app.state.llm_pool.snapshot(), "heavy": heavy.snapshot() if heavy else []}
+
+@app.get("/resilience/stats", summary="Автоматы бэкендов, повторы и дубли LLM-запросов на второй узел")
+async def resilience_stats():
+    heavy = app.state.llm_heavy_pool
+    return {"breakers": app.state.breakers.snapshot(), "transport": app.state.transport.stats,
+            "hedge": {"light": app.state.llm_pool.hedge.snapshot(), "heavy": heavy.hedge.snapshot() if heavy else None}}
+
+@app.get("/admission/stats", summary="Допуск к бэкендам: слоты, очереди по классам, отказы")
+async def admission_stats():
+    admission = app.state.admission
+    return admission.snapshot() if admission else {"enabled": False}
+
+@app.get("/cache/stats", summary="Счётчики кэша LLM-ответов")
+async def cache_stats():
+    cache = app.state.cache
+    return cache.snapshot() if cache else {"enabled": False}
+
+@app.get("/singleflight/stats", summary="Сколько запросов склеено с уже летящими")
+async def singleflight_stats():
+    return app.state.singleflight.snapshot()
+
+@app.get("/tts/cache/stats", summary="Попадания в кэш TTS и сэкономленное время синтеза")
+async def tts_cache_stats():
+    cache = app.state.tts_cache
+    return cache.snapshot() if cache else {"enabled": False}
+
+@app.get("/image/cache/stats", summary="Кэш картинок: попадания, скачивания из ComfyUI, перекодирования")
+async def image_cache_stats():
+    cache = app.state.image_cache
+    return cache.snapshot() if cache else {"enabled": False}
+
+@app.get("/embed/stats", summary="Кэш эмбеддингов: попадания, вызовы /api/embed")
+async def embed_stats():
+    return app.state.embed_cache.snapshot()
+
+@app.get("/worker/stats", summary="Воркер брокера: топики и счётчики обработки")
+async def worker_stats():
+    worker = app.state.worker
+    return worker.snapshot() if worker else {"enabled": False}
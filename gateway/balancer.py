@@ -0,0 +1,310 @@
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import httpx
+from fastapi import HTTPException
+
+from gateway.admission import Gate, Ticket
+from gateway.metrics import observe_hedge
+from gateway.resilience import FAILURE_STATUSES, IDEMPOTENT, BackendUnavailable, Breakers, HedgePolicy
+from gateway.settings import HEAVY_NUM_CTX, HEAVY_PROMPT_TOKENS
+from gateway.streaming import json_content
+
+log = logging.getLogger("gateway.balancer")
+
+
+def normalize_model(name: str) -> str:
+    # Ollama хранит модели без тега как name:latest
+    return name if ":" in name else f"{name}:latest"
+
+
+def estimate_tokens(body: Dict) -> int:
+    # грубо: ~3 символа на токен для смеси кириллицы и латиницы, токенизатор не нужен
+    chars = len(body.get("prompt") or "") + len(body.get("system") or "")
+    chars += sum(len(m.get("content") or "") for m in body.get("messages") or ())
+    return chars // 3
+
+
+@dataclass
+class LLMNode:
+    url: str
+    inflight: int = 0
+    healthy: bool = True
+    ready: bool = True    # прогрев моделей завершён (см. gateway/warmup.py)
+    fails: int = 0
+    oks: int = 0
+    models: Set[str] = field(default_factory=set)
+
+    def snapshot(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ready": self.ready,
+            "inflight": self.inflight,
+            "models": sorted(self.models),
+        }
+
+
+class Lease:
+    """Занятый слот на узле; release() идемпотентен, его можно звать из нескольких finally."""
+
+    def __init__(self, node: LLMNode):
+        self.node = node
+        self._released = False
+
+    @property
+    def url(self) -> str:
+        return self.node.url
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.node.inflight -= 1
+
+    def move(self, node: LLMNode) -> None:
+        """Ответ пришёл с другого узла (дубль или переключение): слот переезжает туда."""
+        self.node.inflight -= 1
+        node.inflight += 1
+        self.node = node
+
+
+class LLMPool:
+    """
+    Пул Ollama-инстансов с маршрутизацией least-outstanding-requests.
+
+    Узел выбирается по минимальному числу запросов в работе; узлы, у которых нужная модель
+    уже загружена (по /api/ps), предпочтительнее, пока их очередь не длиннее холодных больше
+    чем на warm_slack; узлы, ещё не прошедшие прогрев, получают трафик, только если прогретых
+    нет. Активная проверка здоровья выводит узел из ротации после eject_after
+    неудач подряд и возвращает после readmit_after успешных; узлы с разомкнутым автоматом
+    (breakers) не выбираются, пока не придёт время пробы. С hedge медленный запрос
+    дублируется на другой узел (см. _send).
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        http: httpx.AsyncClient,
+        interval: float = 10.0,
+        eject_after: int = 3,
+        readmit_after: int = 2,
+        warm_slack: int = 4,
+        gate: Optional[Gate] = None,
+        breakers: Optional[Breakers] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        if not urls:
+            raise ValueError("LLM pool requires at least one backend URL")
+        self.nodes = [LLMNode(u.rstrip("/")) for u in urls]
+        self.http = http
+        self.interval = interval
+        self.eject_after = eject_after
+        self.readmit_after = readmit_after
+        self.warm_slack = warm_slack
+        self.gate = gate
+        self.breakers = breakers
+        self.hedge = hedge
+        self._rr = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def admit(self) -> Optional[Ticket]:
+        """Слот допуска к пулу (очередь по приоритету, 429 при переполнении); None — контроль выключен."""
+        return await self.gate.acquire() if self.gate else None
+
+    # ---------- выбор узла ----------
+    def pick(self, model: Optional[str] = None, prefer: Optional[str] = None) -> LLMNode:
+        """prefer — URL узла, к которому привязана сессия: берём его, пока он не перегружен сильнее warm_slack."""
+        healthy = [n for n in self.nodes if n.healthy and not self.tripped(n)]
+        candidates = [n for n in healthy if n.ready] or healthy or self.nodes
+        # ротация стартовой позиции, чтобы при равенстве нагрузка расходилась по узлам
+        shift = next(self._rr) % len(candidates)
+        candidates = candidates[shift:] + candidates[:shift]
+        best = min(candidates, key=lambda n: n.inflight)
+        if model:
+            wanted = normalize_model(model)
+            warm = [n for n in candidates if wanted in n.models]
+            if warm:
+                best_warm = min(warm, key=lambda n: n.inflight)
+                if best_warm.inflight - best.inflight <= self.warm_slack:
+                    best = best_warm
+        if prefer:
+            pinned = next((n for n in candidates if n.url == prefer), None)
+            if pinned is not None and pinned.inflight - best.inflight <= self.warm_slack:
+                best = pinned
+        return best
+
+    def tripped(self, node: LLMNode) -> bool:
+        return self.breakers is not None and self.breakers.is_open(node.url)
+
+    def spare(self, busy: LLMNode, model: Optional[str] = None) -> Optional[LLMNode]:
+        """Второй узел для дубля или переключения: здоровый, прогретый, с моделью в памяти — если такой есть."""
+        others = [n for n in self.nodes if n is not busy and n.healthy and n.ready and not self.tripped(n)]
+        if not others:
+            return None
+        wanted = normalize_model(model) if model else None
+        return min(others, key=lambda n: (wanted is not None and wanted not in n.models, n.inflight))
+
+    def acquire(self, model: Optional[str] = None, prefer: Optional[str] = None) -> Lease:
+        node = self.pick(model, prefer)
+        node.inflight += 1
+        if model:
+            # после запроса модель окажется в памяти узла — учитываем это до следующей проверки
+            node.models.add(normalize_model(model))
+        return Lease(node)
+
+    # ---------- здоровье ----------
+    def mark_failure(self, node: LLMNode) -> None:
+        node.oks = 0
+        node.fails += 1
+        if node.healthy and node.fails >= self.eject_after:
+            node.healthy = False
+            log.warning("LLM node %s ejected after %d failures", node.url, node.fails)
+
+    def mark_success(self, node: LLMNode) -> None:
+        node.fails = 0
+        node.oks += 1
+        if not node.healthy and node.oks >= self.readmit_after:
+            node.healthy = True
+            log.info("LLM node %s readmitted", node.url)
+
+    async def check(self, node: LLMNode) -> None:
+        try:
+            r = await self.http.get(f"{node.url}/api/ps", timeout=5.0)
+            r.raise_for_status()
+            node.models = {normalize_model(m.get("model") or m.get("name", ""))
+                           for m in r.json().get("models", [])}
+        except (httpx.HTTPError, ValueError) as e:
+            log.debug("LLM node %s health check failed: %s", node.url, e)
+            self.mark_failure(node)
+        else:
+            self.mark_success(node)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check(n) for n in self.nodes))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def snapshot(self) -> List[Dict]:
+        return [n.snapshot() for n in self.nodes]
+
+
+def route_pool(light: LLMPool, heavy: Optional[LLMPool], body: Dict) -> LLMPool:
+    """Запросы с большим контекстом (num_ctx или оценка промпта) уходят в тяжёлый пул, если он задан."""
+    if heavy is None:
+        return light
+    num_ctx = (body.get("options") or {}).get("num_ctx") or 0
+    if num_ctx >= HEAVY_NUM_CTX or estimate_tokens(body) >= HEAVY_PROMPT_TOKENS:
+        return heavy
+    return light
+
+
+async def _attempt(pool: LLMPool, node: LLMNode, path: str, body: Dict, stream: bool) -> httpx.Response:
+    request = pool.http.build_request("POST", f"{node.url}{path}", extensions=IDEMPOTENT, **json_content(body))
+    try:
+        return await pool.http.send(request, stream=stream)
+    except httpx.TransportError:
+        pool.mark_failure(node)
+        raise
+
+
+def _ok(task: asyncio.Task) -> bool:
+    # 500 — ошибка самого запроса (модель, промпт): на другом узле будет то же, повтор бессмыслен
+    return not task.cancelled() and task.exception() is None and task.result().status_code not in FAILURE_STATUSES
+
+
+async def _send(pool: LLMPool, lease: Lease, path: str, body: Dict, stream: bool,
+                hedge: bool = True) -> httpx.Response:
+    """
+    Запрос на узел аренды. Если ответа (для стрима — заголовков) нет дольше p95 похожих
+    запросов, тот же запрос уходит на второй узел и берётся первый успешный ответ; узел,
+    ответивший ошибкой или недоступный, сразу заменяется вторым. Проигравший запрос
+    отменяется — Ollama бросает генерацию, когда клиент отключился. Слот аренды
+    переезжает на узел победителя. С hedge=False дублей нет, остаётся только замена узла после ошибки.
+    """
+    policy = pool.hedge
+    key = f"{path}:{'stream' if stream else 'full'}:{body.get('model')}"
+    delay = policy.delay(key) if hedge and policy and len(pool.nodes) > 1 else None
+    started = time.monotonic()
+    first = asyncio.create_task(_attempt(pool, lease.node, path, body, stream))
+    nodes = {first: lease.node}
+    pending = {first}
+    winner: Optional[asyncio.Task] = None
+    kind: Optional[str] = None
+    finished = False
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, timeout=delay if kind is None else None,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in done if _ok(t)), None)
+            if winner is not None or kind is not None or policy is None:
+                continue
+            # первый узел медлит дольше p95 или уже ответил ошибкой — пробуем второй
+            other = pool.spare(lease.node, body.get("model"))
+            if other is None:
+                continue
+            kind = "hedged" if pending else "failover"
+            policy.stats["hedged" if pending else "failovers"] += 1
+            observe_hedge(kind)
+            other.inflight += 1
+            second = asyncio.create_task(_attempt(pool, other, path, body, stream))
+            nodes[second] = other
+            pending.add(second)
+        finished = True
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        # без успеха отдаём исход последней попытки (502/503/504 как есть, сетевую ошибку — как 502/503)
+        keep = (winner or list(nodes)[-1]) if finished else None
+        for task, node in nodes.items():
+            if node is not lease.node:
+                node.inflight -= 1
+            if task is not keep and task.done() and not task.cancelled() and task.exception() is None:
+                await task.result().aclose()
+
+    result = winner or keep
+    try:
+        response = result.result()
+    except BackendUnavailable as e:
+        raise HTTPException(503, f"LLM backend unavailable: {e}",
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))}) from e
+    except httpx.TransportError as e:
+        raise HTTPException(502, f"LLM backend {nodes[result].url} unavailable: {e}") from e
+    if winner is not None and policy is not None:
+        policy.observe(key, time.monotonic() - started)
+    if nodes[result] is not lease.node:
+        lease.move(nodes[result])
+        if winner is not None and kind == "hedged":
+            policy.stats["hedge_wins"] += 1
+            observe_hedge("won")
+    return response
+
+
+async def post_json(pool: LLMPool, lease: Lease, path: str, body: Dict, hedge: bool = True) -> httpx.Response:
+    """POST на выбранный узел (с дублем на второй, см. _send); сетевые ошибки засчитываются узлу и отдаются как 502."""
+    return await _send(pool, lease, path, body, stream=False, hedge=hedge)
+
+
+async def open_node_stream(pool: LLMPool, lease: Lease, path: str, body: Dict,
+                           hedge: bool = True) -> httpx.Response:
+    resp = await _send(pool, lease, path, body, stream=True, hedge=hedge)
+    if resp.is_error:
+        text = await resp.aread()
+        await resp.aclose()
+        raise HTTPException(resp.status_code, text.decode("utf-8", errors="ignore"))
+    return resp
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:  # Kafka нужна только воркеру с WORKER_BROKER=kafka
+    from aiokafka import AIOKafkaConsumer, AIOKafkaProducer, TopicPartition
+    from aiokafka.errors import CommitFailedError, IllegalStateError
+except ImportError:
+    AIOKafkaConsumer = None
+
+log = logging.getLogger("gateway.broker")
+
+
+@dataclass
+class Message:
+    topic: str
+    value: bytes
+    key: Optional[bytes] = None
+    partition: int = 0
+    offset: int = 0
+    headers: Dict[str, bytes] = field(default_factory=dict)
+
+
+class Broker(ABC):
+    """
+    Минимальный интерфейс брокера для воркера.
+
+    Оффсеты коммитятся явно и только воркером (после успешной обработки); rewind
+    возвращает чтение партиции к оффсету, чтобы необработанное пришло повторно.
+    """
+
+    @abstractmethod
+    async def start(self, topics: List[str]) -> None: ...
+
+    @abstractmethod
+    async def stop(self) -> None: ...
+
+    @abstractmethod
+    async def fetch(self, topic: str, max_records: int, timeout: float) -> List[Message]: ...
+
+    @abstractmethod
+    async def commit(self, topic: str, partition: int, offset: int) -> None:
+        """offset — следующий к чтению, как в Kafka."""
+
+    @abstractmethod
+    async def rewind(self, topic: str, partition: int, offset: int) -> None: ...
+
+    @abstractmethod
+    async def publish(self, topic: str, value: bytes, key: Optional[bytes] = None) -> None: ...
+
+
+class MemoryBroker(Broker):
+    """Брокер в памяти процесса: одна партиция на топик. Для тестов и локального запуска."""
+
+    def __init__(self):
+        self.logs: Dict[str, List[Message]] = defaultdict(list)
+        self.positions: Dict[str, int] = defaultdict(int)
+        self.committed: Dict[str, int] = defaultdict(int)
+        self._cond = asyncio.Condition()
+
+    async def start(self, topics: List[str]) -> None:
+        return None
+
+    async def stop(self) -> None:
+        return None
+
+    async def fetch(self, topic: str, max_records: int, timeout: float) -> List[Message]:
+        async with self._cond:
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.positions[topic] < len(self.logs[topic])), timeout
+                )
+            except asyncio.TimeoutError:
+                return []
+            start = self.positions[topic]
+            batch = self.logs[topic][start:start + max_records]
+            self.positions[topic] = start + len(batch)
+            return batch
+
+    async def commit(self, topic: str, partition: int, offset: int) -> None:
+        self.committed[topic] = max(self.committed[topic], offset)
+
+    async def rewind(self, topic: str, partition: int, offset: int) -> None:
+        async with self._cond:
+            self.positions[topic] = offset
+            self._cond.notify_all()
+
+    async def publish(self, topic: str, value: bytes, key: Optional[bytes] = None) -> None:
+        async with self._cond:
+            entries = self.logs[topic]
+            entries.append(Message(topic, value, key, 0, len(entries)))
+            self._cond.notify_all()
+
+
+class KafkaBroker(Broker):
+    """
+    Kafka через aiokafka (опциональная зависимость): по консьюмеру на топик в общей группе,
+    автокоммит выключен, один общий продюсер.
+    """
+
+    def __init__(self, bootstrap_servers: str, group_id: str, security_protocol: str = "PLAINTEXT",
+                 sasl_mechanism: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None, max_poll_interval_ms: int = 900_000):
+        if AIOKafkaConsumer is None:
+            raise RuntimeError("WORKER_BROKER=kafka requires the aiokafka package")
+        self.group_id = group_id
+        self.max_poll_interval_ms = max_poll_interval_ms
+        self.common = {"bootstrap_servers": bootstrap_servers, "security_protocol": security_protocol}
+        if sasl_mechanism:
+            self.common.update(sasl_mechanism=sasl_mechanism, sasl_plain_username=username,
+                               sasl_plain_password=password)
+        self.consumers: Dict[str, "AIOKafkaConsumer"] = {}
+        self.producer = None
+
+    async def start(self, topics: List[str]) -> None:
+        self.producer = AIOKafkaProducer(acks="all", **self.common)
+        await self.producer.start()
+        for topic in topics:
+            consumer = AIOKafkaConsumer(
+                topic, group_id=self.group_id, enable_auto_commit=False, auto_offset_reset="earliest",
+                max_poll_interval_ms=self.max_poll_interval_ms, **self.common,
+            )
+            await consumer.start()
+            self.consumers[topic] = consumer
+
+    async def stop(self) -> None:
+        for consumer in self.consumers.values():
+            await consumer.stop()
+        if self.producer:
+            await self.producer.stop()
+
+    async def fetch(self, topic: str, max_records: int, timeout: float) -> List[Message]:
+        records = await self.consumers[topic].getmany(timeout_ms=int(timeout * 1000), max_records=max_records)
+        return [
+            Message(r.topic, r.value, r.key, r.partition, r.offset, dict(r.headers or ()))
+            for batch in records.values() for r in batch
+        ]
+
+    async def commit(self, topic: str, partition: int, offset: int) -> None:
+        tp = TopicPartition(topic, partition)
+        try:
+            await self.consumers[topic].commit({tp: offset})
+        except CommitFailedError as e:
+            # партицию забрали при ребалансе — сообщения придут другому воркеру повторно
+            log.warning("commit %s[%d]@%d failed: %s", topic, partition, offset, e)
+
+    async def rewind(self, topic: str, partition: int, offset: int) -> None:
+        tp = TopicPartition(topic, partition)
+        try:
+            self.consumers[topic].seek(tp, offset)
+        except (AssertionError, IllegalStateError) as e:
+            log.warning("rewind %s[%d]@%d failed: %s", topic, partition, offset, e)
+
+    async def publish(self, topic: str, value: bytes, key: Optional[bytes] = None) -> None:
+        await self.producer.send_and_wait(topic, value, key=key)
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+log = logging.getLogger("gateway.cache")
+
+
+def cache_key(path: str, body: Dict[str, Any]) -> str:
+    """Канонический ключ: эндпоинт + тело запроса к Ollama без флага stream."""
+    canon = {k: v for k, v in body.items() if k != "stream"}
+    raw = json.dumps([path, canon], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(opt_in: Optional[bool], options: Dict[str, Any]) -> bool:
+    # явный флаг клиента важнее; иначе кэшируем только детерминированные запросы
+    if opt_in is not None:
+        return opt_in
+    return options.get("temperature") == 0 or options.get("seed") is not None
+
+
+class ResponseCache:
+    """
+    Двухуровневый кэш готовых JSON-ответов LLM.
+
+    Память — LRU с лимитом по числу записей и суммарному размеру, у каждой записи TTL.
+    Диск (если задан disk_dir) — по файлу на ключ, переживает рестарт; возраст считается
+    по mtime, при превышении disk_max_bytes удаляются самые старые файлы.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600.0,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._mem: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._mem_bytes = 0
+        self.stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "bypass": 0,
+                      "evictions": 0, "disk_evictions": 0}
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = self._disk_scan()
+
+    # ---------- память ----------
+    def _mem_get(self, key: str) -> Optional[bytes]:
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        expires, data = item
+        if expires < time.monotonic():
+            self._mem_drop(key)
+            return None
+        self._mem.move_to_end(key)
+        return data
+
+    def _mem_drop(self, key: str) -> None:
+        _, data = self._mem.pop(key)
+        self._mem_bytes -= len(data)
+
+    def _mem_put(self, key: str, data: bytes, ttl: float) -> None:
+        if len(data) > self.max_bytes:
+            return
+        if key in self._mem:
+            self._mem_drop(key)
+        self._mem[key] = (time.monotonic() + ttl, data)
+        self._mem_bytes += len(data)
+        while len(self._mem) > self.max_entries or self._mem_bytes > self.max_bytes:
+            self._mem_drop(next(iter(self._mem)))
+            self.stats["evictions"] += 1
+
+    # ---------- диск ----------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_scan(self) -> int:
+        total = 0
+        with os.scandir(self.disk_dir) as it:
+            for e in it:
+                if e.name.endswith(".json"):
+                    total += e.stat().st_size
+        return total
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, bytes]]:
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            age = time.time() - st.st_mtime
+            if age > self.ttl:
+                os.remove(path)
+                self._disk_bytes -= st.st_size
+                return None
+            with open(path, "rb") as f:
+                return self.ttl - age, f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        try:
+            old = os.path.getsize(path)
+        except OSError:
+            old = 0
+        # свой временный файл на каждую запись: одновременные записи одного ключа не пишут в общий .tmp
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        # счётчик байтов ведётся на ходу; каталог обходится, только когда лимит превышен
+        self._disk_bytes += len(data) - old
+        if self._disk_bytes > self.disk_max_bytes:
+            self._disk_prune()
+
+    def _disk_prune(self) -> None:
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for e in it:
+                if e.name.endswith(".json"):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        # чистим с запасом в 10%, чтобы у лимита не обходить каталог на каждой записи
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.stats["disk_evictions"] += 1
+            self._disk_bytes -= size
+
+    # ---------- API ----------
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self._mem_get(key)
+        if data is not None:
+            self.stats["hits_memory"] += 1
+            return data
+        if self.disk_dir:
+            found = await asyncio.to_thread(self._disk_get, key)
+            if found is not None:
+                ttl_left, data = found
+                self._mem_put(key, data, ttl_left)
+                self.stats["hits_disk"] += 1
+                return data
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        """value — готовый JSON в байтах (ответ бэкенда как есть) или объект для сериализации."""
+        data = value if isinstance(value, bytes) else orjson.dumps(value)
+        self._mem_put(key, data, self.ttl)
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._disk_put, key, data)
+            except OSError as e:
+                log.warning("cache disk write failed: %s", e)
+
+    def bypass(self) -> None:
+        self.stats["bypass"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "entries": len(self._mem), "bytes": self._mem_bytes,
+                "disk": bool(self.disk_dir), "disk_bytes": self._disk_bytes}
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+import websockets
+from fastapi import HTTPException
+
+from gateway.admission import Gate, Ticket, release_all
+
+log = logging.getLogger("gateway.comfy")
+
+HTTP_TIMEOUT = httpx.Timeout(connect=5.0, read=600.0, write=30.0, pool=5.0)
+FINAL = ("done", "error")
+
+
+@dataclass
+class ImageJob:
+    id: str
+    number: int
+    client_id: Optional[str] = None
+    key: Optional[str] = None
+    status: str = "queued"          # queued | running | done | error
+    step: int = 0
+    steps: int = 0
+    node: Optional[str] = None
+    images: List[Dict[str, str]] = field(default_factory=list)
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    ticket: Optional[Ticket] = field(default=None, repr=False)
+
+    @property
+    def progress(self) -> float:
+        if self.status == "done":
+            return 1.0
+        return round(self.step / self.steps, 4) if self.steps else 0.0
+
+    def touch(self) -> None:
+        # будим всех ожидающих и заводим новое событие для следующего изменения
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class ComfyJobRegistry:
+    """
+    Реестр задач генерации изображений на стороне gateway.
+
+    Все задачи отправляются в ComfyUI с client_id реестра, поэтому события прогресса и
+    завершения приходят в одно постоянное websocket-соединение. Клиенты спрашивают статус
+    у gateway, а не опрашивают /history. После переподключения незавершённые задачи
+    сверяются с /history и /queue один раз: задача, которой нет ни там, ни там, потеряна.
+    Незавершённая задача старше ttl считается зависшей и завершается ошибкой — её слот
+    допуска освобождается.
+    """
+
+    def __init__(self, base_url: str, http: httpx.AsyncClient, ttl: float = 3600.0, max_jobs: int = 10000,
+                 gate: Optional[Gate] = None):
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = self.base_url.replace("http", "ws", 1)
+        self.http = http
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        # допуск: незавершённых задач в ComfyUI не больше лимита, сверх — сразу 429
+        self.gate = gate
+        self.client_id = uuid.uuid4().hex
+        self.jobs: "OrderedDict[str, ImageJob]" = OrderedDict()
+        self.queue_remaining: Optional[int] = None
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+        # события, пришедшие по websocket раньше, чем POST /prompt вернул prompt_id
+        self._early: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+
+    # ---------- задачи ----------
+    async def submit(self, payload: Dict[str, Any], key: Optional[str] = None) -> ImageJob:
+        client_id = payload.get("client_id")
+        self._prune()  # зависшие задачи отдают слоты до проверки допуска
+        ticket = self.gate.try_acquire() if self.gate else None
+        try:
+            r = await self.http.post(
+                f"{self.base_url}/prompt", json={**payload, "client_id": self.client_id}, timeout=HTTP_TIMEOUT
+            )
+            if r.is_error:
+                ct = r.headers.get("content-type", "")
+                detail = r.json() if "application/json" in ct else r.text
+                raise HTTPException(status_code=r.status_code, detail=detail)
+            data = r.json()
+        except BaseException:
+            release_all(ticket)
+            raise
+        job = ImageJob(id=data["prompt_id"], number=data.get("number", 0), client_id=client_id, key=key,
+                       ticket=ticket)
+        self.jobs[job.id] = job
+        for msg in self._early.pop(job.id, []):
+            self.handle(msg)
+        return job
+
+    def get(self, job_id: str) -> ImageJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(404, f"Image job {job_id} not found")
+        return job
+
+    def find_active(self, key: str) -> Optional[ImageJob]:
+        for job in self.jobs.values():
+            if job.key == key and job.status not in FINAL:
+                return job
+        return None
+
+    def position(self, job: ImageJob) -> Optional[int]:
+        """Сколько задач этого gateway стоит перед job в очереди ComfyUI (0 — следующая)."""
+        if job.status != "queued":
+            return None
+        return sum(
+            1 for j in self.jobs.values()
+            if j.status in ("queued", "running") and j.number < job.number
+        )
+
+    def snapshot(self, job: ImageJob) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "client_id": job.client_id,
+            "status": job.status,
+            "progress": job.progress,
+            "step": job.step,
+            "steps": job.steps,
+            "queue_position": self.position(job),
+            "queue_remaining": self.queue_remaining,
+            "images": [
+                {"url": f"/image/jobs/{job.id}/images/{i}", **img} for i, img in enumerate(job.images)
+            ],
+            "error": job.error,
+            "created": job.created,
+            "finished": job.finished,
+        }
+
+    def _prune(self) -> None:
+        now = time.time()
+        for job in [j for j in self.jobs.values() if j.status not in FINAL and now - j.created > self.ttl]:
+            self._finish(job, "error", "timed out")
+        for job_id in [j.id for j in self.jobs.values() if j.finished and now - j.finished > self.ttl]:
+            del self.jobs[job_id]
+        while len(self.jobs) > self.max_jobs:
+            _, job = self.jobs.popitem(last=False)
+            release_all(job.ticket)
+
+    def _finish(self, job: ImageJob, status: str, error: Optional[str] = None) -> None:
+        if job.status in FINAL:
+            return
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        release_all(job.ticket)
+        job.touch()
+
+    # ---------- события ComfyUI ----------
+    def handle(self, msg: Dict[str, Any]) -> None:
+        kind = msg.get("type")
+        data = msg.get("data") or {}
+        if kind == "status":
+            self.queue_remaining = data.get("status", {}).get("exec_info", {}).get("queue_remaining")
+            return
+        prompt_id = data.get("prompt_id")
+        job = self.jobs.get(prompt_id)
+        if job is None:
+            if prompt_id:
+                self._early.setdefault(prompt_id, []).append(msg)
+                while len(self._early) > 256:
+                    self._early.popitem(last=False)
+            return
+        if kind == "execution_start":
+            job.status = "running"
+        elif kind == "executing":
+            if data.get("node") is None:
+                self._finish(job, "done")
+                return
+            job.status = "running"
+            job.node = data.get("node")
+        elif kind == "progress":
+            job.step, job.steps = data.get("value", 0), data.get("max", 0)
+        elif kind == "executed":
+            job.images.extend((data.get("output") or {}).get("images", []))
+        elif kind == "execution_success":
+            self._finish(job, "done")
+            return
+        elif kind == "execution_error":
+            self._finish(job, "error", data.get("exception_message") or "execution error")
+            return
+        elif kind == "execution_interrupted":
+            self._finish(job, "error", "interrupted")
+            return
+        else:
+            return
+        job.touch()
+
+    async def _queued(self) -> Optional[set]:
+        """prompt_id задач в очереди ComfyUI (ждут и выполняются); None — узнать не удалось."""
+        try:
+            r = await self.http.get(f"{self.base_url}/queue", timeout=10.0)
+            r.raise_for_status()
+            data = r.json()
+        except (httpx.HTTPError, ValueError):
+            return None
+        return {item[1] for name in ("queue_running", "queue_pending") for item in data.get(name, [])}
+
+    async def _reconcile(self) -> None:
+        self._prune()
+        pending = [j for j in self.jobs.values() if j.status not in FINAL]
+        queued = await self._queued() if pending else None
+        for job in pending:
+            try:
+                r = await self.http.get(f"{self.base_url}/history/{job.id}", timeout=10.0)
+                r.raise_for_status()
+                entry = r.json().get(job.id)
+            except (httpx.HTTPError, ValueError):
+                continue
+            if not entry:
+                # ни в истории, ни в очереди — ComfyUI перезапускали, задача пропала
+                if queued is not None and job.id not in queued:
+                    self._finish(job, "error", "lost by ComfyUI")
+                continue
+            job.images = [img for out in entry.get("outputs", {}).values() for img in out.get("images", [])]
+            status = entry.get("status", {})
+            if status.get("status_str") == "error":
+                self._finish(job, "error", "execution error")
+            elif status.get("completed", True):
+                self._finish(job, "done")
+
+    async def _ws_loop(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                async with websockets.connect(f"{self.ws_url}/ws?clientId={self.client_id}", max_size=None) as ws:
+                    self.connected = True
+                    delay = 1.0
+                    log.info("ComfyUI websocket connected")
+                    await self._reconcile()
+                    async for raw in ws:
+                        if isinstance(raw, bytes):
+                            continue  # бинарные кадры — превью, не нужны
+                        try:
+                            self.handle(json.loads(raw))
+                        except (ValueError, AttributeError):
+                            continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("ComfyUI websocket error: %s; reconnect in %.0fs", e, delay)
+            finally:
+                self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._ws_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
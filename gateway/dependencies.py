@@ -1,8 +1,79 @@
 from typing import Annotated
-from fastapi import Depends, Request
+from fastapi import Depends, HTTPException, Request
 import httpx
 
+from gateway.admission import Admission, Gate, gate_for
+from gateway.balancer import LLMPool
+from gateway.cache import ResponseCache
+from gateway.comfy_jobs import ComfyJobRegistry
+from gateway.embeddings import EmbeddingCache
+from gateway.image_cache import ImageCache
+from gateway.sessions import SessionStore
+from gateway.singleflight import SingleFlight
+from gateway.tts_cache import TTSCache
+from gateway.vectors import VectorStore
+from openaiGPT.servises import OpenAiAPIServise
+
 def get_http(request: Request) -> httpx.AsyncClient:
     return request.app.state.http
 
-HttpDep = Annotated[httpx.AsyncClient, Depends(get_http)]
\ No newline at end of file
+def get_llm_pool(request: Request) -> LLMPool:
+    return request.app.state.llm_pool
+
+def get_heavy_pool(request: Request) -> LLMPool | None:
+    return request.app.state.llm_heavy_pool
+
+def get_admission(request: Request) -> Admission | None:
+    return request.app.state.admission
+
+def backend_gate(name: str):
+    def get_gate(request: Request) -> Gate | None:
+        return gate_for(request.app.state.admission, name)
+    return get_gate
+
+def get_cache(request: Request) -> ResponseCache | None:
+    return request.app.state.cache
+
+def get_openai(request: Request) -> OpenAiAPIServise:
+    servise = request.app.state.openai
+    if servise is None:
+        raise HTTPException(503, "OpenAI backend is not configured (OPENAI_API_KEY is empty)")
+    return servise
+
+def get_comfy(request: Request) -> ComfyJobRegistry:
+    return request.app.state.comfy
+
+def get_singleflight(request: Request) -> SingleFlight:
+    return request.app.state.singleflight
+
+def get_tts_cache(request: Request) -> TTSCache | None:
+    return request.app.state.tts_cache
+
+def get_sessions(request: Request) -> SessionStore:
+    return request.app.state.sessions
+
+def get_image_cache(request: Request) -> ImageCache | None:
+    return request.app.state.image_cache
+
+def get_embed_cache(request: Request) -> EmbeddingCache:
+    return request.app.state.embed_cache
+
+def get_vectors(request: Request) -> VectorStore:
+    return request.app.state.vectors
+
+HttpDep = Annotated[httpx.AsyncClient, Depends(get_http)]
+LLMPoolDep = Annotated[LLMPool, Depends(get_llm_pool)]
+HeavyPoolDep = Annotated[LLMPool | None, Depends(get_heavy_pool)]
+AdmissionDep = Annotated[Admission | None, Depends(get_admission)]
+CacheDep = Annotated[ResponseCache | None, Depends(get_cache)]
+OpenAIDep = Annotated[OpenAiAPIServise, Depends(get_openai)]
+ComfyDep = Annotated[ComfyJobRegistry, Depends(get_comfy)]
+SingleFlightDep = Annotated[SingleFlight, Depends(get_singleflight)]
+TTSCacheDep = Annotated[TTSCache | None, Depends(get_tts_cache)]
+SessionStoreDep = Annotated[SessionStore, Depends(get_sessions)]
+ImageCacheDep = Annotated[ImageCache | None, Depends(get_image_cache)]
+EmbeddingCacheDep = Annotated[EmbeddingCache, Depends(get_embed_cache)]
+VectorStoreDep = Annotated[VectorStore, Depends(get_vectors)]
+TTSGateDep = Annotated[Gate | None, Depends(backend_gate("tts"))]
+STTGateDep = Annotated[Gate | None, Depends(backend_gate("stt"))]
+ImageGateDep = Annotated[Gate | None, Depends(backend_gate("image"))]
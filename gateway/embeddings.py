@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+from fastapi import HTTPException
+
+from gateway.admission import release_all
+from gateway.balancer import LLMPool, post_json
+
+
+def embedding_key(model: str, text: str, dimensions: Optional[int] = None) -> str:
+    raw = f"{model}\0{dimensions or ''}\0{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingCache:
+    """LRU векторов по хэшу (модель, текст); лимит по байтам, вектор хранится как float32."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "computed": 0, "calls": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._items.get(key)
+        if vector is None:
+            self.stats["misses"] += 1
+            return None
+        self._items.move_to_end(key)
+        self.stats["hits"] += 1
+        return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        if key in self._items or vector.nbytes > self.max_bytes:
+            return
+        # копия строки, а не view: иначе вектор держал бы в памяти весь ответ батча
+        self._items[key] = vector.copy()
+        self.bytes += vector.nbytes
+        while self.bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self.bytes -= old.nbytes
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = self.stats
+        lookups = s["hits"] + s["misses"]
+        return {**s, "hit_rate": round(s["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._items), "bytes": self.bytes}
+
+
+async def _embed_call(pool: LLMPool, model: str, texts: List[str], dimensions: Optional[int],
+                      truncate: bool) -> np.ndarray:
+    body: Dict[str, Any] = {"model": model, "input": texts, "truncate": truncate}
+    if dimensions:
+        body["dimensions"] = dimensions
+    ticket = await pool.admit()
+    lease = pool.acquire(model)
+    try:
+        r = await post_json(pool, lease, "/api/embed", body)
+    finally:
+        release_all(lease, ticket)
+    if r.is_error:
+        raise HTTPException(r.status_code, r.text)
+    vectors = np.asarray(orjson.loads(r.content).get("embeddings") or [], dtype=np.float32)
+    if vectors.ndim != 2 or len(vectors) != len(texts):
+        raise HTTPException(502, f"Ollama /api/embed returned {len(vectors)} vectors for {len(texts)} texts")
+    return vectors
+
+
+async def embed_texts(pool: LLMPool, cache: Optional[EmbeddingCache], model: str, texts: List[str],
+                      batch: int = 64, concurrency: int = 4, dimensions: Optional[int] = None,
+                      truncate: bool = True) -> Tuple[np.ndarray, int]:
+    """
+    Матрица (len(texts), dim) float32 в порядке texts и сколько векторов взято из кэша.
+
+    Повторы внутри запроса считаются один раз; промахи кэша режутся на вызовы /api/embed
+    по batch текстов, до concurrency вызовов одновременно. Ошибка любого вызова отменяет остальные.
+    """
+    keys = [embedding_key(model, t, dimensions) for t in texts]
+    found: Dict[str, np.ndarray] = {}
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key in found or key in missing:
+            continue
+        vector = cache.get(key) if cache else None
+        if vector is None:
+            missing[key] = text
+        else:
+            found[key] = vector
+    hits = sum(1 for k in keys if k in found)
+
+    todo = list(missing.items())
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(chunk: List[Tuple[str, str]]) -> None:
+        async with sem:
+            vectors = await _embed_call(pool, model, [t for _, t in chunk], dimensions, truncate)
+        for (key, _), vector in zip(chunk, vectors):
+            found[key] = vector
+            if cache:
+                cache.put(key, vector)
+        if cache:
+            cache.stats["calls"] += 1
+            cache.stats["computed"] += len(chunk)
+
+    tasks = [asyncio.create_task(run(todo[i:i + batch])) for i in range(0, len(todo), batch)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    dims = {found[k].shape[0] for k in keys}
+    if len(dims) > 1:
+        raise HTTPException(502, f"Embeddings of different sizes for one model: {sorted(dims)}")
+    return np.stack([found[k] for k in keys]), hits
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+log = logging.getLogger("gateway.image_cache")
+
+# формат запроса -> (формат Pillow, content-type, расширение файла)
+FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+
+def origin_key(base_url: str, filename: str, subfolder: str, kind: str) -> str:
+    raw = json.dumps([base_url, filename, subfolder, kind], separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def variant_key(origin: str, fmt: Optional[str], size: Optional[int], quality: int) -> str:
+    """Без преобразований вариант — сам оригинал."""
+    if fmt is None and size is None:
+        return origin
+    raw = json.dumps([origin, fmt, size, quality], separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def negotiate(fmt: Optional[str], accept: str) -> Optional[str]:
+    """format=auto: WebP, если клиент его принимает, иначе JPEG."""
+    if fmt != "auto":
+        return fmt
+    return "webp" if "image/webp" in accept else "jpeg"
+
+
+def transcode(data: bytes, fmt: str, size: Optional[int], quality: int) -> bytes:
+    """Перекодирование и уменьшение (size — длинная сторона; меньше исходника не растягивается)."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        if size:
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        if fmt == "png":
+            img.save(out, "PNG", optimize=True)
+        elif fmt == "webp":
+            img.save(out, "WEBP", quality=quality, method=4)
+        else:
+            img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class ImageCache:
+    """
+    Дисковый кэш результатов ComfyUI: оригиналы (скачиваются из /view один раз) и их
+    перекодированные варианты. Файлы адресуются ключом, содержимое по ключу не меняется,
+    поэтому ключ служит и ETag. Вытеснение по суммарному размеру, по mtime (LRU).
+    """
+
+    def __init__(self, disk_dir: str, max_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "fetches": 0, "transcodes": 0, "evictions": 0,
+                      "fetched_bytes": 0}
+        os.makedirs(disk_dir, exist_ok=True)
+        self.entries, self.bytes = self._scan()
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.{ext}")
+
+    def _files(self):
+        with os.scandir(self.disk_dir) as it:
+            for e in it:
+                if e.is_file() and not e.name.endswith(".tmp"):
+                    yield e
+
+    def _scan(self) -> Tuple[int, int]:
+        sizes = [e.stat().st_size for e in self._files()]
+        return len(sizes), sum(sizes)
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)  # LRU по mtime
+            return True
+        except OSError:
+            return False
+
+    def _put(self, path: str, data: bytes) -> None:
+        existed = os.path.exists(path)
+        # свой временный файл на каждую запись: одновременные записи одного ключа не пишут в общий .tmp
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if not existed:
+            self.entries += 1
+            self.bytes += len(data)
+        if self.bytes > self.max_bytes:
+            self._prune(keep=path)
+
+    def _prune(self, keep: str) -> None:
+        files = [(st.st_mtime, st.st_size, e.path) for e in self._files() for st in (e.stat(),)]
+        self.entries, self.bytes = len(files), sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if self.bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.entries -= 1
+            self.bytes -= size
+            self.stats["evictions"] += 1
+
+    async def get(self, key: str, ext: str) -> Optional[str]:
+        """Путь к файлу в кэше или None."""
+        path = self.path(key, ext)
+        if await asyncio.to_thread(self._touch, path):
+            self.stats["hits"] += 1
+            return path
+        self.stats["misses"] += 1
+        return None
+
+    async def read(self, key: str, ext: str) -> Optional[bytes]:
+        def read() -> Optional[bytes]:
+            try:
+                with open(self.path(key, ext), "rb") as f:
+                    return f.read()
+            except OSError:
+                return None
+        return await asyncio.to_thread(read)
+
+    async def put(self, key: str, ext: str, data: bytes) -> str:
+        path = self.path(key, ext)
+        await asyncio.to_thread(self._put, path, data)
+        return path
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = self.stats
+        lookups = s["hits"] + s["misses"]
+        return {**s, "hit_rate": round(s["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": self.entries, "bytes": self.bytes}
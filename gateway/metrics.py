@@ -0,0 +1,270 @@
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+import orjson
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+# модулем, а не именем: resilience сам импортирует metrics
+from gateway import resilience
+
+# длинные хвосты: генерация LLM и картинок идёт десятки секунд
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+REQUESTS = Counter("gateway_requests_total", "HTTP-запросы к gateway", ["route", "method", "status"])
+REQUEST_SECONDS = Histogram("gateway_request_seconds", "Полное время запроса (до последнего байта ответа)",
+                            ["route"], buckets=BUCKETS)
+INFLIGHT = Gauge("gateway_inflight_requests", "Запросы в работе", ["route"])
+
+QUEUE_WAIT = Histogram("gateway_queue_wait_seconds", "Ожидание слота допуска к бэкенду",
+                       ["backend", "priority"], buckets=BUCKETS)
+UPSTREAM_TTFB = Histogram("gateway_upstream_ttfb_seconds", "Время до заголовков ответа бэкенда",
+                          ["backend"], buckets=BUCKETS)
+UPSTREAM_SECONDS = Histogram("gateway_upstream_seconds", "Полное время запроса к бэкенду (до конца тела)",
+                             ["backend"], buckets=BUCKETS)
+UPSTREAM_RESPONSES = Counter("gateway_upstream_responses_total", "Ответы бэкендов по статусу",
+                             ["backend", "status"])
+UPSTREAM_INFLIGHT = Gauge("gateway_upstream_inflight", "Открытые запросы к бэкенду", ["backend"])
+UPSTREAM_RETRIES = Counter("gateway_upstream_retries_total", "Повторы запросов к бэкенду", ["backend"])
+LLM_HEDGES = Counter("gateway_llm_hedges_total", "Дубли запросов на второй узел LLM", ["outcome"])
+
+LLM_TOKENS_PER_SECOND = Histogram("gateway_llm_tokens_per_second", "Скорость генерации (eval_count / eval_duration)",
+                                  ["model"], buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500))
+LLM_PROMPT_EVAL = Histogram("gateway_llm_prompt_eval_seconds", "Обработка промпта (prompt_eval_duration)",
+                            ["model"], buckets=BUCKETS)
+LLM_TOKENS = Counter("gateway_llm_tokens_total", "Токены по данным Ollama", ["model", "kind"])
+
+# тайминги стадий текущего запроса для Server-Timing; None — запрос не в выборке
+TIMINGS: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+
+
+def mark(stage: str, seconds: float) -> None:
+    timings = TIMINGS.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def observe_queue_wait(backend: str, priority: str, seconds: float) -> None:
+    QUEUE_WAIT.labels(backend, priority).observe(seconds)
+    mark("queue", seconds)
+
+
+def observe_retry(backend: str) -> None:
+    UPSTREAM_RETRIES.labels(backend).inc()
+
+
+def observe_hedge(outcome: str) -> None:
+    """outcome: hedged — дубль отправлен, won — он ответил первым, failover — первый узел упал."""
+    LLM_HEDGES.labels(outcome).inc()
+
+
+def observe_llm(done: Dict[str, Any]) -> None:
+    """Статистика из финального объекта Ollama (done=true); длительности там в наносекундах."""
+    model = done.get("model") or "unknown"
+    eval_count = done.get("eval_count") or 0
+    eval_ns = done.get("eval_duration") or 0
+    if eval_count and eval_ns:
+        LLM_TOKENS_PER_SECOND.labels(model).observe(eval_count / (eval_ns / 1e9))
+        LLM_TOKENS.labels(model, "generated").inc(eval_count)
+    if done.get("prompt_eval_count"):
+        LLM_TOKENS.labels(model, "prompt").inc(done["prompt_eval_count"])
+    if done.get("prompt_eval_duration"):
+        LLM_PROMPT_EVAL.labels(model).observe(done["prompt_eval_duration"] / 1e9)
+
+
+async def tap_llm_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Пропускает NDJSON-стрим Ollama как есть и снимает статистику с последней строки."""
+    tail = b""
+    try:
+        async for chunk in chunks:
+            tail = (tail + chunk)[-8192:]
+            yield chunk
+    finally:
+        await chunks.aclose()
+    for line in reversed(tail.strip().split(b"\n")):
+        try:
+            obj = orjson.loads(line)
+        except ValueError:
+            continue
+        if isinstance(obj, dict) and obj.get("done"):
+            observe_llm(obj)
+        break
+
+
+class _TimedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self.stream = stream
+        self.on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self.on_close()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx с метриками бэкендов: TTFB — когда пришли заголовки, полное время —
+    когда тело дочитано или стрим закрыт; статусы и сетевые ошибки считаются по бэкенду.
+    Бэкенд определяется по адресу (scheme://host:port) из настроек.
+    """
+
+    def __init__(self, backends: Dict[str, str], transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.backends = {resilience.origin(url): name for url, name in backends.items()}
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    def backend(self, url: httpx.URL) -> str:
+        return self.backends.get(resilience.origin(url), "other")
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        backend = self.backend(request.url)
+        started = time.monotonic()
+        UPSTREAM_INFLIGHT.labels(backend).inc()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException as e:
+            # отмена (CancelledError) тоже должна вернуть gauge, иначе он уплывает вверх
+            UPSTREAM_INFLIGHT.labels(backend).dec()
+            if isinstance(e, httpx.TransportError):
+                UPSTREAM_RESPONSES.labels(backend, "transport_error").inc()
+            raise
+        ttfb = time.monotonic() - started
+        UPSTREAM_TTFB.labels(backend).observe(ttfb)
+        UPSTREAM_RESPONSES.labels(backend, str(response.status_code)).inc()
+        mark("upstream_ttfb", ttfb)
+
+        def done() -> None:
+            UPSTREAM_INFLIGHT.labels(backend).dec()
+            total = time.monotonic() - started
+            UPSTREAM_SECONDS.labels(backend).observe(total)
+            mark("upstream", total)
+
+        response.stream = _TimedStream(response.stream, done)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: счётчики, гистограмма полного времени и in-flight по шаблону маршрута.
+
+    Для доли запросов timing_sample (или с заголовком X-Debug-Timing: 1) в ответ добавляется
+    Server-Timing со стадиями, известными к моменту отправки заголовков: queue, upstream_ttfb,
+    upstream и app (время gateway до заголовков).
+    """
+
+    def __init__(self, app, timing_sample: float = 0.0, skip: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.timing_sample = timing_sample
+        self.skip = set(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            return await self.app(scope, receive, send)
+        started = time.monotonic()
+        headers = dict(scope.get("headers") or ())
+        sampled = headers.get(b"x-debug-timing") == b"1" or (
+            self.timing_sample > 0 and random.random() < self.timing_sample
+        )
+        timings: Optional[Dict[str, float]] = {} if sampled else None
+        token = TIMINGS.set(timings)
+        status = "500"
+        route = "unmatched"
+        counted = False
+
+        def route_label() -> str:
+            r = scope.get("route")
+            return getattr(r, "path", None) or "unmatched"
+
+        async def send_wrapper(message):
+            nonlocal status, route, counted
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                route = route_label()
+                if not counted:
+                    counted = True
+                    INFLIGHT.labels(route).inc()
+                if timings is not None:
+                    timings["app"] = time.monotonic() - started
+                    value = ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in timings.items())
+                    message = {**message, "headers": list(message.get("headers", [])) +
+                               [(b"server-timing", value.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            TIMINGS.reset(token)
+            if not counted:
+                route = route_label()
+            else:
+                INFLIGHT.labels(route).dec()
+            REQUESTS.labels(route, scope["method"], status).inc()
+            REQUEST_SECONDS.labels(route).observe(time.monotonic() - started)
+
+
+class StateCollector:
+    """Снимает состояние пулов и допуска в момент скрейпа, без отдельных апдейтов в коде."""
+
+    def __init__(self, state: Any):
+        self.state = state
+
+    def collect(self):
+        nodes = GaugeMetricFamily("gateway_llm_node_inflight", "Запросы в работе на узле LLM", labels=["pool", "url"])
+        healthy = GaugeMetricFamily("gateway_llm_node_healthy", "Узел LLM в ротации", labels=["pool", "url"])
+        ready = GaugeMetricFamily("gateway_llm_node_ready", "Модели на узле LLM прогреты", labels=["pool", "url"])
+        for name, pool in (("light", self.state.llm_pool), ("heavy", self.state.llm_heavy_pool)):
+            for n in pool.nodes if pool else ():
+                nodes.add_metric([name, n.url], n.inflight)
+                healthy.add_metric([name, n.url], 1 if n.healthy else 0)
+                ready.add_metric([name, n.url], 1 if n.ready else 0)
+        yield nodes
+        yield healthy
+        yield ready
+
+        admission = self.state.admission
+        active = GaugeMetricFamily("gateway_admission_active", "Занятые слоты допуска", labels=["backend"])
+        waiting = GaugeMetricFamily("gateway_admission_waiting", "Ожидающие слот", labels=["backend", "priority"])
+        for name, gate in (admission.gates.items() if admission else ()):
+            snap = gate.snapshot()
+            active.add_metric([name], snap["active"])
+            for cls, count in snap["waiting"].items():
+                waiting.add_metric([name, cls], count)
+        yield active
+        yield waiting
+
+        breakers = GaugeMetricFamily("gateway_breaker_open", "Автомат адреса бэкенда разомкнут", labels=["origin"])
+        for key, breaker in self.state.breakers.items.items():
+            breakers.add_metric([key], 0 if breaker.state == "closed" else 1)
+        yield breakers
+
+
+def register_state(state: Any) -> StateCollector:
+    collector = StateCollector(state)
+    REGISTRY.register(collector)
+    return collector
+
+
+def unregister_state(collector: StateCollector) -> None:
+    REGISTRY.unregister(collector)
+
+
+def render() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def backend_map(groups: List[Tuple[str, Iterable[str]]]) -> Dict[str, str]:
+    return {url: name for name, urls in groups for url in urls}
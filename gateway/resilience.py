@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+# модулем, а не именем: metrics сам импортирует resilience
+from gateway import metrics
+
+log = logging.getLogger("gateway.resilience")
+
+# ответы, после которых адрес считается больным (500 Ollama отдаёт и на ошибки запроса), и те, что имеет смысл повторить
+FAILURE_STATUSES = {502, 503, 504}
+RETRY_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# до сервера запрос не дошёл — повторять безопасно при любом методе
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+# оборвалось посреди обмена — повторяем только идемпотентные
+EXCHANGE_ERRORS = (httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)
+
+# пометка для POST без побочных эффектов: client.post(..., extensions=IDEMPOTENT)
+IDEMPOTENT = {"idempotent": True}
+
+
+def origin(url: Any) -> str:
+    parts = urlsplit(str(url))
+    port = parts.port or (443 if parts.scheme in ("https", "wss") else 80)
+    return f"{parts.hostname}:{port}"
+
+
+def parse_pool_limits(spec: str) -> Dict[str, httpx.Limits]:
+    """«llm=32:16,image=8:4» -> лимиты соединений на адрес бэкенда: всего и keep-alive."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        total, _, keepalive = value.partition(":")
+        limits[name.strip()] = httpx.Limits(max_connections=int(total),
+                                            max_keepalive_connections=int(keepalive or total))
+    return limits
+
+
+class BackendUnavailable(httpx.TransportError):
+    """Автомат адреса разомкнут: запрос не отправлялся."""
+
+    def __init__(self, message: str, request: httpx.Request, retry_after: float):
+        super().__init__(message, request=request)
+        self.retry_after = retry_after
+
+
+class Breaker:
+    """
+    Автомат одного адреса: после failures неудач подряд (сетевая ошибка, таймаут, 502/503/504)
+    размыкается на cooldown секунд, и запросы отклоняются сразу. Затем пропускается один
+    пробный запрос: успех замыкает автомат, неудача размыкает снова.
+    """
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.fails = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def is_open(self) -> bool:
+        """Разомкнут и время пробы не пришло — узел не стоит выбирать."""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.cooldown
+
+    def retry_after(self) -> float:
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if self.is_open():
+                self.stats["rejected"] += 1
+                return False
+            self.state = "half_open"
+            self.probing = False
+        if self.probing:
+            self.stats["rejected"] += 1
+            return False
+        self.probing = True
+        return True
+
+    def success(self) -> None:
+        self.fails = 0
+        self.probing = False
+        self.state = "closed"
+
+    def failure(self) -> bool:
+        """Учитывает неудачу; True, если автомат только что разомкнулся."""
+        self.fails += 1
+        self.probing = False
+        if self.state == "open" or (self.state == "closed" and self.fails < self.failures):
+            return False
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.stats["opened"] += 1
+        return True
+
+    def abandon(self) -> None:
+        # проба отменена, не дождавшись ответа: следующий запрос снова может стать пробой
+        self.probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self.state, "fails": self.fails, "retry_after": round(self.retry_after(), 1)
+                if self.state == "open" else 0.0, **self.stats}
+
+
+class Breakers:
+    """Автоматы по адресам (host:port); создаются при первом запросе."""
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.items: Dict[str, Breaker] = {}
+
+    def get(self, url: Any) -> Breaker:
+        key = origin(url)
+        breaker = self.items.get(key)
+        if breaker is None:
+            breaker = self.items[key] = Breaker(self.failures, self.cooldown)
+        return breaker
+
+    def is_open(self, url: Any) -> bool:
+        breaker = self.items.get(origin(url))
+        return breaker is not None and breaker.is_open()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {key: b.snapshot() for key, b in self.items.items()}
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    """Свой пул соединений на каждый адрес бэкенда: лимиты по имени бэкенда, остальным — httpx по умолчанию."""
+
+    def __init__(self, backends: Dict[str, str], limits: Dict[str, httpx.Limits]):
+        self.limits = {origin(url): limits[name] for url, name in backends.items() if name in limits}
+        self.pools: Dict[str, httpx.AsyncHTTPTransport] = {}
+        self.default = httpx.AsyncHTTPTransport()
+
+    def transport(self, url: httpx.URL) -> httpx.AsyncBaseTransport:
+        key = origin(url)
+        limits = self.limits.get(key)
+        if limits is None:
+            return self.default
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = httpx.AsyncHTTPTransport(limits=limits)
+        return pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.transport(request.url).handle_async_request(request)
+
+    async def aclose(self) -> None:
+        for pool in [*self.pools.values(), self.default]:
+            await pool.aclose()
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """
+    Автоматы и повторы для всех запросов общего клиента.
+
+    Разомкнутый автомат адреса сразу даёт BackendUnavailable. Сетевая ошибка до отправки
+    повторяется для любого метода, обрыв посреди обмена и 502/503/504 — только для
+    идемпотентных (GET и запросы с extensions=IDEMPOTENT). Пауза перед повтором — full jitter:
+    случайная в [0, backoff * 2^попытка], не больше backoff_cap.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breakers: Breakers, backends: Dict[str, str],
+                 retries: int = 2, backoff: float = 0.2, backoff_cap: float = 2.0):
+        self.transport = transport
+        self.breakers = breakers
+        self.backends = {origin(url): name for url, name in backends.items()}
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.stats = {"retries": 0, "rejected": 0}
+
+    def _retryable(self, e: Exception, idempotent: bool) -> bool:
+        return isinstance(e, CONNECT_ERRORS) or (idempotent and isinstance(e, EXCHANGE_ERRORS))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        breaker = self.breakers.get(request.url)
+        idempotent = request.method in IDEMPOTENT_METHODS or bool(request.extensions.get("idempotent"))
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.stats["rejected"] += 1
+                raise BackendUnavailable(f"{origin(request.url)} is failing, circuit is open", request,
+                                         breaker.retry_after())
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.PoolTimeout:
+                breaker.abandon()  # свой пул соединений переполнен — бэкенд тут ни при чём
+                raise
+            except httpx.TransportError as e:
+                if breaker.failure():
+                    log.warning("circuit for %s opened: %s", origin(request.url), e)
+                if attempt >= self.retries or not self._retryable(e, idempotent):
+                    raise
+            except BaseException:
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code in FAILURE_STATUSES:
+                    if breaker.failure():
+                        log.warning("circuit for %s opened: HTTP %d", origin(request.url), response.status_code)
+                else:
+                    breaker.success()
+                if attempt >= self.retries or not idempotent or response.status_code not in RETRY_STATUSES:
+                    return response
+                await response.aclose()
+            attempt += 1
+            self.stats["retries"] += 1
+            metrics.observe_retry(self.backends.get(origin(request.url), "other"))
+            await asyncio.sleep(random.uniform(0, min(self.backoff_cap, self.backoff * 2 ** attempt)))
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class HedgePolicy:
+    """
+    Когда дублировать запрос на второй узел пула: если ответа нет дольше квантиля quantile
+    задержек последних window успешных ответов того же вида (путь, стрим, модель). Пока
+    замеров меньше min_samples, дублей нет; всего дублей — не больше доли budget от запросов.
+    """
+
+    def __init__(self, quantile: float = 0.95, min_samples: int = 20, window: int = 200,
+                 min_delay: float = 0.05, budget: float = 0.1):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.budget = budget
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0}
+
+    def delay_of(self, key: str) -> Optional[float]:
+        samples = self.latencies.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return max(self.min_delay, ordered[int(self.quantile * (len(ordered) - 1))])
+
+    def delay(self, key: str) -> Optional[float]:
+        """Через сколько секунд дублировать очередной запрос; None — не дублировать."""
+        self.stats["requests"] += 1
+        if self.stats["hedged"] >= self.budget * self.stats["requests"]:
+            return None
+        return self.delay_of(key)
+
+    def observe(self, key: str, seconds: float) -> None:
+        samples = self.latencies.get(key)
+        if samples is None:
+            samples = self.latencies[key] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        delays = {k: self.delay_of(k) for k in self.latencies}
+        return {**self.stats, "quantile": self.quantile, "budget": self.budget,
+                "delays": {k: round(v, 3) if v is not None else None for k, v in delays.items()}}
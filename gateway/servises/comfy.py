@@ -1,22 +1,174 @@
-from fastapi import APIRouter, Body, HTTPException
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from typing import Dict, Literal, Optional
 
-import httpx
+from fastapi import APIRouter, Body, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
-from gateway.settings import COMFY, SERVER_URL
+from gateway.comfy_jobs import FINAL, HTTP_TIMEOUT
+from gateway.dependencies import ComfyDep, ImageCacheDep, SingleFlightDep
+from gateway.image_cache import FORMATS, negotiate, origin_key, transcode, variant_key
+from gateway.settings import IMAGE_MAX_SIZE, IMAGE_QUALITY
+from gateway.singleflight import request_key
+from gateway.streaming import SSE_MEDIA, ClosingStreamingResponse, open_stream
 from gateway.swagger_models import build_simple_comfy_payload, SimpleTxtRequest
 
-HTTP_TIMEOUT=httpx.Timeout(connect=5.0, read=600.0, write=30.0, pool=5.0)
 router = APIRouter(tags=["Image Jobs"])
 
+
 @router.post("/image/jobs", summary="Создать задачу генерации (txt only)", status_code=202)
-async def create_image_job(body: SimpleTxtRequest = Body(...)):
-    payload = build_simple_comfy_payload(body.text, body.client_id)
-
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
-        r = await client.post(f"{COMFY}/prompt", json=payload)
-        if r.is_error:
-            ct = r.headers.get("content-type", "")
-            detail = r.json() if "application/json" in ct else r.text
-            raise HTTPException(status_code=r.status_code, detail=detail)
-        responce = r.json()
-        return {"url": f'{SERVER_URL}/history/{responce["prompt_id"]}'}
+async def create_image_job(registry: ComfyDep, sf: SingleFlightDep, body: SimpleTxtRequest = Body(...)):
+    key = request_key(body.model_dump())
+    # одинаковый запрос, пока его задача ещё не готова, получает ту же задачу
+    job = registry.find_active(key) if sf.enabled("image") else None
+    if job is not None:
+        sf.record("image", coalesced=True)
+    else:
+        job = await sf.do("image", key, lambda: registry.submit(
+            build_simple_comfy_payload(body.text, body.client_id), key=key
+        ))
+    return {"id": job.id, "url": f"/image/jobs/{job.id}", **registry.snapshot(job)}
+
+
+@router.get(
+    "/image/jobs/{job_id}",
+    summary="Статус задачи генерации",
+    description="Статус, прогресс и позиция в очереди из реестра gateway. "
+                "С wait>0 — long-poll: ответ придёт при завершении задачи или по таймауту.",
+)
+async def get_image_job(registry: ComfyDep, job_id: str, wait: float = Query(0, ge=0, le=300)):
+    job = registry.get(job_id)
+    deadline = time.monotonic() + wait
+    while job.status not in FINAL:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        await job.wait_change(left)
+    return registry.snapshot(job)
+
+
+@router.get(
+    "/image/jobs/{job_id}/events",
+    summary="SSE-поток статуса задачи",
+    description="Отдаёт снимок статуса при каждом изменении; завершается событием done.",
+)
+async def image_job_events(registry: ComfyDep, job_id: str):
+    job = registry.get(job_id)
+
+    async def events():
+        while True:
+            final = job.status in FINAL
+            data = json.dumps(registry.snapshot(job), ensure_ascii=False)
+            yield f"event: {'done' if final else 'status'}\ndata: {data}\n\n".encode("utf-8")
+            if final:
+                return
+            if not await job.wait_change(15.0):
+                yield b": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(), media_type=SSE_MEDIA, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _fetch(registry, params: Dict[str, str]) -> bytes:
+    r = await registry.http.get(f"{registry.base_url}/view", params=params, timeout=HTTP_TIMEOUT)
+    if r.is_error:
+        raise HTTPException(r.status_code, r.text)
+    return r.content
+
+
+async def _stream_original(registry, params: Dict[str, str], headers: Dict[str, str]) -> StreamingResponse:
+    resp = await open_stream(registry.http, "GET", f"{registry.base_url}/view", params=params, timeout=HTTP_TIMEOUT)
+
+    async def body():
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        finally:
+            await resp.aclose()
+
+    if "content-length" in resp.headers:
+        headers = {**headers, "Content-Length": resp.headers["content-length"]}
+    # ответ ComfyUI уже открыт: закрывает его ответ клиенту, даже если тело так и не начали читать
+    return ClosingStreamingResponse(body(), media_type=resp.headers.get("content-type", "image/png"),
+                                    headers=headers, close=resp.aclose)
+
+
+@router.get(
+    "/image/jobs/{job_id}/images/{index}",
+    summary="Картинка результата (из ComfyUI /view через кэш gateway)",
+    description="format=webp|jpeg|png|auto и size (длинная сторона, px) — перекодированная копия; auto выбирает "
+                "WebP по заголовку Accept. С IMAGE_CACHE_DIR оригинал скачивается из ComfyUI один раз, "
+                "варианты тоже кэшируются на диске; поддерживаются ETag/If-None-Match и Range.",
+)
+async def image_job_result(
+    request: Request, registry: ComfyDep, sf: SingleFlightDep, cache: ImageCacheDep, job_id: str, index: int,
+    format: Optional[Literal["png", "webp", "jpeg", "auto"]] = Query(None),
+    size: Optional[int] = Query(None, ge=16, le=IMAGE_MAX_SIZE),
+    quality: int = Query(IMAGE_QUALITY, ge=1, le=100),
+):
+    job = registry.get(job_id)
+    if job.status != "done":
+        raise HTTPException(409, f"Image job {job_id} is {job.status}")
+    if not 0 <= index < len(job.images):
+        raise HTTPException(404, f"Image {index} not found in job {job_id}")
+    img = job.images[index]
+    params = {"filename": img["filename"], "subfolder": img.get("subfolder", ""), "type": img.get("type", "output")}
+    fmt = negotiate(format, request.headers.get("accept", ""))
+    stem, _, origin_ext = img["filename"].rpartition(".")
+    origin_ext = origin_ext.lower() if stem else "png"
+    if fmt is None and size is not None:
+        # только уменьшение: формат оригинала, если Pillow умеет его писать, иначе PNG
+        fmt = {"jpg": "jpeg", "jpeg": "jpeg", "webp": "webp"}.get(origin_ext, "png")
+    ext = FORMATS[fmt][2] if fmt else origin_ext
+    media = FORMATS[fmt][1] if fmt else (mimetypes.guess_type(img["filename"])[0] or "image/png")
+    headers = {"Content-Disposition": f'inline; filename="{stem or img["filename"]}.{ext}"'}
+    if cache is None and fmt is None and size is None:
+        return await _stream_original(registry, params, headers)
+
+    origin = origin_key(registry.base_url, params["filename"], params["subfolder"], params["type"])
+    key = variant_key(origin, fmt, size, quality)
+    etag = f'"{key}"'
+    # имя файла в ComfyUI уникально, содержимое по нему не меняется
+    headers.update({"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept"})
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    if cache is not None:
+        async def build():
+            data = await cache.read(origin, origin_ext)
+            if data is None:
+                data = await _fetch(registry, params)
+                cache.stats["fetches"] += 1
+                cache.stats["fetched_bytes"] += len(data)
+                await cache.put(origin, origin_ext, data)
+            if key == origin:
+                return cache.path(origin, origin_ext)
+            cache.stats["transcodes"] += 1
+            out = await asyncio.to_thread(transcode, data, fmt, size, quality)
+            return await cache.put(key, ext, out)
+
+        # файл могут вытеснить между поиском в кэше и отдачей — тогда собираем его ещё раз
+        for _ in range(2):
+            path = await cache.get(key, ext)
+            if path is None:
+                try:
+                    path = await sf.do("image", request_key("view", key), build)
+                except OSError as e:
+                    raise HTTPException(507, f"Image cache write failed: {e}") from e
+            try:
+                stat = await asyncio.to_thread(os.stat, path)
+            except FileNotFoundError:
+                continue
+            return FileResponse(path, stat_result=stat, media_type=media, headers=headers)
+        raise HTTPException(503, "Image cache is evicting faster than it is filled", headers={"Retry-After": "1"})
+
+    async def build_in_memory():
+        data = await _fetch(registry, params)
+        return await asyncio.to_thread(transcode, data, fmt, size, quality)
+
+    content = await sf.do("image", request_key("view", key), build_in_memory)
+    return Response(content=content, media_type=media, headers=headers)
@@ -0,0 +1,85 @@
+import asyncio
+
+import numpy as np
+import orjson
+from fastapi import APIRouter, Body
+from fastapi.responses import Response
+
+from gateway.dependencies import EmbeddingCacheDep, LLMPoolDep, VectorStoreDep
+from gateway.embeddings import embed_texts, normalize
+from gateway.settings import EMBED_BATCH, EMBED_CONCURRENCY
+from gateway.streaming import JSON_MEDIA
+from gateway.swagger_models import (
+    CollectionAddRequest, CollectionCreateRequest, CollectionSearchRequest, EmbedRequest,
+)
+
+router = APIRouter(tags=["EMBED"])
+
+
+@router.post(
+    "/embed",
+    summary="Эмбеддинги пачки текстов (Ollama /api/embed)",
+    description="Тексты режутся на вызовы /api/embed по EMBED_BATCH штук, до EMBED_CONCURRENCY вызовов "
+                "параллельно. Векторы кэшируются по хэшу текста, повторы в запросе считаются один раз.",
+)
+async def embed(pool: LLMPoolDep, cache: EmbeddingCacheDep, payload: EmbedRequest = Body(...)):
+    vectors, hits = await embed_texts(pool, cache, payload.model, payload.texts, EMBED_BATCH, EMBED_CONCURRENCY,
+                                      payload.dimensions, payload.truncate)
+    if payload.normalize:
+        vectors = normalize(vectors)
+    # матрица сериализуется orjson напрямую из numpy, без списка float в Python
+    body = {"model": payload.model, "dim": vectors.shape[1], "count": len(vectors), "cached": hits,
+            "embeddings": vectors}
+    return Response(orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY), media_type=JSON_MEDIA)
+
+
+@router.get("/collections", summary="Коллекции векторов: размер, размерность, поиски")
+async def list_collections(store: VectorStoreDep):
+    return store.snapshot()
+
+
+@router.post("/collections", summary="Создать коллекцию векторов", status_code=201)
+async def create_collection(store: VectorStoreDep, payload: CollectionCreateRequest = Body(...)):
+    return store.create(payload.name, payload.model).snapshot()
+
+
+@router.get("/collections/{name}", summary="Состояние коллекции")
+async def get_collection(store: VectorStoreDep, name: str):
+    return store.get(name).snapshot()
+
+
+@router.delete("/collections/{name}", summary="Удалить коллекцию вместе с файлами", status_code=204)
+async def delete_collection(store: VectorStoreDep, name: str):
+    store.delete(name)
+
+
+@router.post(
+    "/collections/{name}/add",
+    summary="Добавить тексты в коллекцию",
+    description="Тексты превращаются в эмбеддинги моделью коллекции (через тот же кэш, что /embed) и "
+                "дописываются в матрицу; запись с существующим id заменяется.",
+)
+async def add_to_collection(pool: LLMPoolDep, cache: EmbeddingCacheDep, store: VectorStoreDep, name: str,
+                            payload: CollectionAddRequest = Body(...)):
+    col = store.get(name)
+    items = payload.items
+    vectors, hits = await embed_texts(pool, cache, col.model, [i.text for i in items], EMBED_BATCH, EMBED_CONCURRENCY)
+    async with col.lock:
+        ids, fresh = await asyncio.to_thread(col.add, [i.id for i in items], vectors,
+                                             [i.text for i in items], [i.metadata for i in items])
+    return {"ids": ids, "added": fresh, "replaced": len(ids) - fresh, "cached": hits, "count": col.count}
+
+
+@router.post(
+    "/collections/{name}/search",
+    summary="Поиск top-k по косинусной близости",
+    description="Запросы превращаются в эмбеддинги и сравниваются со всей матрицей коллекции одним умножением.",
+)
+async def search_collection(pool: LLMPoolDep, cache: EmbeddingCacheDep, store: VectorStoreDep, name: str,
+                            payload: CollectionSearchRequest = Body(...)):
+    col = store.get(name)
+    if not col.count:
+        return {"results": [[] for _ in payload.queries]}
+    queries, _ = await embed_texts(pool, cache, col.model, payload.queries, EMBED_BATCH, EMBED_CONCURRENCY)
+    results = await asyncio.to_thread(col.search, np.ascontiguousarray(queries), payload.k)
+    return {"results": results}
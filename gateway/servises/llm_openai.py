@@ -1,19 +1,29 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+import openai
+import orjson
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
 
-from openaiGPT.servises import OpenAiAPIServise
+from gateway.dependencies import OpenAIDep
+from gateway.streaming import JSON_MEDIA, NDJSON_MEDIA, SSE_MEDIA, ClosingStreamingResponse, wants_sse
 from gateway.swagger_models import OpenAIChatRequest
 
 router = APIRouter(tags=["OPENAI"])
 
+
+def _upstream_error(e: openai.OpenAIError) -> HTTPException:
+    if isinstance(e, openai.APIStatusError):
+        return HTTPException(e.status_code, e.message)
+    return HTTPException(502, f"OpenAI unavailable: {e}")
+
+
 @router.post(
     "/chat_complete",
     summary="Диалог с LLM (OpenAI /chat/completions)",
-    description="Передай массив сообщений (developer/user/assistant). Возвращает ответ OpenAI в форме chat.",
+    description="Передай массив сообщений (developer/user/assistant). Возвращает ответ OpenAI в форме chat. "
+                "При stream=true дельты отдаются по мере генерации: SSE (Accept: text/event-stream) или NDJSON.",
 )
-async def chat_complete(payload: OpenAIChatRequest):
-    openai_api_servise = OpenAiAPIServise()
-    response = openai_api_servise.chat_complete(
+async def chat_complete(request: Request, openai_api_servise: OpenAIDep, payload: OpenAIChatRequest):
+    kwargs = dict(
         model=payload.model,
         messages=[m.model_dump() for m in payload.messages],
         temperature=payload.temperature,
@@ -21,4 +31,48 @@ async def chat_complete(payload: OpenAIChatRequest):
         max_tokens=payload.max_tokens,
         **(payload.extra or {}),
     )
-    return JSONResponse(content=response)
\ No newline at end of file
+    if not payload.stream:
+        try:
+            response = await openai_api_servise.chat_complete(**kwargs)
+        except openai.OpenAIError as e:
+            raise _upstream_error(e) from e
+        return Response(orjson.dumps(response), media_type=JSON_MEDIA)
+
+    chunks = openai_api_servise.chat_complete_stream(**kwargs)
+    # первый чанк читаем до ответа клиенту, чтобы ошибки апстрима пришли обычным HTTP-статусом
+    try:
+        first = await anext(chunks)
+    except StopAsyncIteration:
+        first = None
+    except openai.OpenAIError as e:
+        raise _upstream_error(e) from e
+    sse = wants_sse(request)
+
+    async def relay():
+        try:
+            if first is not None:
+                yield _frame(first, sse)
+            async for chunk in chunks:
+                yield _frame(chunk, sse)
+        except openai.OpenAIError as e:
+            err = orjson.dumps({"error": str(e)})
+            yield b"event: error\ndata: " + err + b"\n\n" if sse else err + b"\n"
+        else:
+            # [DONE] — только у успешно завершённого стрима, после ошибки клиент его не ждёт
+            if sse:
+                yield b"data: [DONE]\n\n"
+        finally:
+            await chunks.aclose()
+
+    # стрим OpenAI уже открыт: закрывает его ответ, даже если клиент ушёл до первого чанка
+    return ClosingStreamingResponse(
+        relay(),
+        media_type=SSE_MEDIA if sse else NDJSON_MEDIA,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        close=chunks.aclose,
+    )
+
+
+def _frame(chunk, sse: bool) -> bytes:
+    data = orjson.dumps(chunk)
+    return b"data: " + data + b"\n\n" if sse else data + b"\n"
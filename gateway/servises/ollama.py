@@ -1,109 +1,361 @@
-from typing import Any, Dict
-import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+import asyncio
+import time
 
-from fastapi import Body, HTTPException, APIRouter
-from gateway.settings import OLLAMA
-from gateway.dependencies import HttpDep
+import httpx
+import orjson
+from fastapi import Body, HTTPException, APIRouter, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
+from gateway.admission import BATCH, PRIORITY, release_all
+from gateway.balancer import LLMPool, open_node_stream, post_json, route_pool
+from gateway.cache import ResponseCache, cache_key, is_cacheable
+from gateway.metrics import observe_llm, tap_llm_stream
+from gateway.dependencies import CacheDep, HeavyPoolDep, LLMPoolDep, SingleFlightDep
+from gateway.singleflight import SingleFlight
+from gateway.settings import BATCH_CONCURRENCY, PASSTHROUGH
+from gateway.streaming import JSON_MEDIA, NDJSON_MEDIA, closer, stream_response, upstream_chunks, wants_sse
 from gateway.swagger_models import (
-    ChatGatewayResponse, ChatRequest, ChatOptions,
-    GenerateGatewayResponse, MessageRequest, MessageOptions,
+    ChatBatchRequest, ChatGatewayResponse, DEFAULT_MODEL, ChatRequest, ChatOptions,
+    GenerateGatewayResponse, MessageBatchRequest, MessageRequest, MessageOptions,
 )
 
 router = APIRouter(tags=["OLLAMA"])
 
+SYSTEM_DEFAULT = "Ты — русскоязычный ассистент. Всегда отвечай по-русски, кратко и грамотно."
+# опции по умолчанию считаются один раз, а не собираются моделью на каждый запрос
+CHAT_DEFAULTS = ChatOptions().model_dump(exclude_none=True)
+MESSAGE_DEFAULTS = MessageOptions().model_dump(exclude_none=True)
+
+
+async def _stream(pool: LLMPool, sf: SingleFlight, route: str, request: Request,
+                  path: str, body: Dict[str, Any]) -> StreamingResponse:
+    async def open_source():
+        # слоты допуска и узла держатся до конца стрима и освобождаются при его закрытии
+        ticket = await pool.admit()
+        lease = pool.acquire(body["model"])
+
+        def release():
+            release_all(lease, ticket)
+
+        try:
+            resp = await open_node_stream(pool, lease, path, body)
+        except BaseException:
+            release()
+            raise
+        return tap_llm_stream(upstream_chunks(resp, closer(resp, release)))
+
+    chunks = await sf.stream(route, cache_key(path, body), open_source)
+    return stream_response(chunks, wants_sse(request))
+
+
+async def _post(pool: LLMPool, path: str, body: Dict[str, Any]):
+    ticket = await pool.admit()
+    lease = pool.acquire(body["model"])
+    try:
+        r = await post_json(pool, lease, path, body)
+    finally:
+        release_all(lease, ticket)
+    if r.is_error:
+        raise HTTPException(r.status_code, r.text)
+    return r
+
+
+def _parse_generate(txt: str, model: str) -> Dict[str, Any]:
+    # 1) нормальный JSON
+    try:
+        return orjson.loads(txt)
+    except orjson.JSONDecodeError:
+        pass
+    # 2) редкий случай: несколько JSON-строк подряд
+    response_text = ""
+    done_obj: Dict[str, Any] = {}
+    for line in txt.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = orjson.loads(line)
+            response_text += obj.get("response", "")
+            if obj.get("done"):
+                done_obj = obj
+        except Exception:
+            continue
+    if not response_text and not done_obj:
+        return {"raw": txt}
+    merged = {"model": model, "response": response_text, "done": True}
+    if done_obj:
+        merged.update({k: v for k, v in done_obj.items() if k not in merged})
+    return merged
+
+
+def chat_body(payload: ChatRequest) -> Dict[str, Any]:
+    # один model_dump на весь запрос вместо отдельного на каждое сообщение и опции
+    data = payload.model_dump(include={"messages", "options"}, exclude_none=True)
+    return {
+        "model": payload.model or DEFAULT_MODEL,
+        "messages": data["messages"],
+        "stream": bool(payload.stream),
+        "options": data.get("options", CHAT_DEFAULTS.copy()),
+    }
+
+
+def message_body(payload: MessageRequest) -> Dict[str, Any]:
+    if not payload.prompt:
+        raise HTTPException(400, "Field 'prompt' is required")
+    return {
+        "model": payload.model or DEFAULT_MODEL,
+        "prompt": payload.prompt,
+        "system": payload.system or SYSTEM_DEFAULT,
+        "options": (payload.options.model_dump(exclude_none=True)
+                    if payload.options else MESSAGE_DEFAULTS.copy()),
+        "stream": bool(payload.stream),
+    }
+
+
+async def complete_chat(pool: LLMPool, body: Dict[str, Any]) -> Dict[str, Any]:
+    r = await _post(pool, "/api/chat", body)
+    result = orjson.loads(r.content)
+    observe_llm(result)
+    return result
+
+
+async def complete_message(pool: LLMPool, body: Dict[str, Any]) -> Dict[str, Any]:
+    r = await _post(pool, "/api/generate", body)
+    result = _parse_generate(r.text.strip(), body["model"])
+    observe_llm(result)
+    return result
+
+
+async def forward_chat(pool: LLMPool, body: Dict[str, Any]) -> bytes:
+    """Ответ Ollama байтами как есть: без pydantic-модели ответа и повторной сериализации."""
+    r = await _post(pool, "/api/chat", body)
+    observe_llm(orjson.loads(r.content))
+    return r.content
+
+
+async def forward_message(pool: LLMPool, body: Dict[str, Any]) -> bytes:
+    r = await _post(pool, "/api/generate", body)
+    try:
+        result = orjson.loads(r.content)
+    except orjson.JSONDecodeError:
+        # несколько JSON-строк подряд — склеиваем, пробросить как есть нельзя
+        result = _parse_generate(r.text.strip(), body["model"])
+        observe_llm(result)
+        return orjson.dumps(result)
+    observe_llm(result)
+    return r.content
+
+
+def as_result(value: Any) -> Any:
+    """Результат склеенного запроса в виде dict: ведущим мог быть запрос в режиме passthrough."""
+    return orjson.loads(value) if isinstance(value, bytes) else value
+
+
+async def complete_cached(cache: ResponseCache | None, sf: SingleFlight, route: str, opt_in: bool | None,
+                          path: str, body: Dict[str, Any], call) -> Any:
+    """То же, что _run, но без HTTP-ответа: для воркера брокера и батчей."""
+    key = cache_key(path, body)
+    if cache is None or not is_cacheable(opt_in, body["options"]):
+        if cache is not None:
+            cache.bypass()
+        return as_result(await sf.do(route, key, call))
+    data = await cache.get(key)
+    if data is not None:
+        return orjson.loads(data)
+
+    async def call_and_store():
+        result = await call()
+        await cache.set(key, result)
+        return result
+
+    return as_result(await sf.do(route, key, call_and_store))
+
+
+async def _run(cache: ResponseCache | None, sf: SingleFlight, route: str, opt_in: bool | None,
+               response: Response, path: str, body: Dict[str, Any], call) -> Any:
+    """
+    Кэш (X-Cache: HIT/MISS/BYPASS) и склейка одинаковых запросов в полёте вокруг call().
+    В кэш результат кладёт только ведущий запрос. Байты (passthrough) уходят клиенту
+    готовым JSON, dict — через модель ответа FastAPI.
+    """
+    key = cache_key(path, body)
+    if cache is None or not is_cacheable(opt_in, body["options"]):
+        if cache is not None:
+            cache.bypass()
+        return _reply(response, await sf.do(route, key, call), "BYPASS")
+    data = await cache.get(key)
+    if data is not None:
+        return Response(content=data, media_type=JSON_MEDIA, headers={"X-Cache": "HIT"})
+
+    async def call_and_store():
+        result = await call()
+        await cache.set(key, result)
+        return result
+
+    return _reply(response, await sf.do(route, key, call_and_store), "MISS")
+
+
+def _reply(response: Response, result: Any, state: str) -> Any:
+    if isinstance(result, bytes):
+        return Response(content=result, media_type=JSON_MEDIA, headers={"X-Cache": state})
+    response.headers["X-Cache"] = state
+    return result
+
 
 @router.post(
     "/chat",
     summary="Диалог с LLM (Ollama /api/chat)",
-    description="Передай массив сообщений (system/user/assistant). Возвращает ответ Ollama в форме chat.",
+    description="Передай массив сообщений (system/user/assistant). Возвращает ответ Ollama в форме chat. "
+                "При stream=true чанки отдаются по мере генерации: SSE (Accept: text/event-stream) или NDJSON.",
     tags=["OLLAMA"],
     response_model=ChatGatewayResponse,
 )
-async def chat(http: HttpDep, payload: ChatRequest = Body(...)):
-    body = {
-        "model": payload.model or "qwen2.5:3b-instruct-q4_K_M",
-        "messages": [m.model_dump(exclude_none=True) for m in payload.messages],
-        "stream": bool(payload.stream),
-        "options": (payload.options.model_dump(exclude_none=True)
-                    if payload.options else ChatOptions().model_dump(exclude_none=True)),
-    }
-    r = await http.post(f"{OLLAMA}/api/chat", json=body)
-    if r.is_error:
-        raise HTTPException(r.status_code, r.text)
-    # FastAPI сам вернёт JSON
-    return r.json()
+async def chat(request: Request, response: Response, pool: LLMPoolDep, heavy: HeavyPoolDep,
+               cache: CacheDep, sf: SingleFlightDep, payload: ChatRequest = Body(...)):
+    body = chat_body(payload)
+    pool = route_pool(pool, heavy, body)
+    if body["stream"]:
+        return await _stream(pool, sf, "chat", request, "/api/chat", body)
+
+    async def call():
+        return await (forward_chat if PASSTHROUGH else complete_chat)(pool, body)
+
+    # байты Ollama уходят как есть; dict (PASSTHROUGH=0) FastAPI проверит моделью и сериализует
+    return await _run(cache, sf, "chat", payload.cache, response, "/api/chat", body, call)
 
 
 @router.post(
     "/message",
     summary="Один запрос (prompt) к LLM (Ollama /api/generate)",
-    description="Удобно для простых одношаговых запросов. Под капотом вызывает /api/generate.",
+    description="Удобно для простых одношаговых запросов. Под капотом вызывает /api/generate. "
+                "При stream=true чанки отдаются по мере генерации: SSE (Accept: text/event-stream) или NDJSON.",
     tags=["OLLAMA"],
     response_model=GenerateGatewayResponse,
 )
-async def message(http: HttpDep, payload: MessageRequest = Body(...)):
-    if not payload.prompt:
-        raise HTTPException(400, "Field 'prompt' is required")
+async def message(request: Request, response: Response, pool: LLMPoolDep, heavy: HeavyPoolDep,
+                  cache: CacheDep, sf: SingleFlightDep, payload: MessageRequest = Body(...)):
+    req = message_body(payload)
+    pool = route_pool(pool, heavy, req)
+
+    # non-stream: обычный JSON-ответ
+    if not req["stream"]:
+        async def call():
+            return await (forward_message if PASSTHROUGH else complete_message)(pool, req)
 
-    model = payload.model or "qwen2.5:3b-instruct-q4_K_M"
-    system = payload.system or "Ты — русскоязычный ассистент. Всегда отвечай по-русски, кратко и грамотно."
-    options = (payload.options.model_dump(exclude_none=True)
-               if payload.options else MessageOptions().model_dump(exclude_none=True))
-    stream = bool(payload.stream)
+        return await _run(cache, sf, "message", payload.cache, response, "/api/generate", req, call)
 
-    req = {"model": model, "prompt": payload.prompt, "system": system, "options": options, "stream": stream}
+    # stream=true: пробрасываем чанки клиенту по мере генерации
+    return await _stream(pool, sf, "message", request, "/api/generate", req)
 
-    # non-stream: обычный JSON-ответ
-    if not stream:
-        r = await http.post(f"{OLLAMA}/api/generate", json=req)
-        if r.is_error:
-            raise HTTPException(r.status_code, r.text)
 
-        txt = r.text.strip()
-        # 1) нормальный JSON
-        try:
-            return json.loads(txt)
-        except json.JSONDecodeError:
-            # 2) редкий случай: несколько JSON-строк подряд
-            response_text = ""
-            done_obj: Dict[str, Any] = {}
-            for line in txt.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    response_text += obj.get("response", "")
-                    if obj.get("done"):
-                        done_obj = obj
-                except Exception:
-                    continue
-            if not response_text and not done_obj:
-                return {"raw": txt}
-            merged = {"model": model, "response": response_text, "done": True}
-            if done_obj:
-                merged.update({k: v for k, v in done_obj.items() if k not in merged})
-            return merged
-
-    # stream=true: читаем построчно и собираем итог
-    # (опц.) можно дать бесконечный таймаут на стрим: timeout=None
-    async with http.stream("POST", f"{OLLAMA}/api/generate", json=req) as resp:
-        if resp.is_error:
-            text = await resp.aread()
-            raise HTTPException(resp.status_code, text.decode("utf-8", errors="ignore"))
-        response_text = ""
-        done_obj: Dict[str, Any] = {}
-        async for chunk in resp.aiter_lines():
-            if not chunk:
-                continue
+def _item_error(e: Exception) -> Dict[str, Any]:
+    if isinstance(e, HTTPException):
+        return {"status": e.status_code, "detail": e.detail}
+    if isinstance(e, ValidationError):
+        return {"status": 422, "detail": e.errors(include_url=False, include_context=False)}
+    if isinstance(e, httpx.HTTPError):
+        return {"status": 502, "detail": f"LLM backend unavailable: {e}"}
+    return {"status": 500, "detail": f"{type(e).__name__}: {e}"}
+
+
+def _line(obj: Dict[str, Any]) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+
+async def _batch_lines(calls: List[Callable[[], Awaitable[Any]]], concurrency: int) -> AsyncIterator[bytes]:
+    """
+    Элементы батча идут через concurrency обработчиков; строка NDJSON с index уходит, как
+    только элемент готов, поэтому порядок строк — порядок завершения. Ошибка элемента —
+    строка с ok=false, батч продолжается. Последняя строка — итог с done=true.
+    При обрыве соединения незавершённые элементы отменяются.
+    """
+    started = time.monotonic()
+    results: asyncio.Queue = asyncio.Queue()
+    pending = iter(range(len(calls)))
+
+    async def worker():
+        for i in pending:
+            t = time.monotonic()
             try:
-                obj = json.loads(chunk)
-                response_text += obj.get("response", "")
-                if obj.get("done"):
-                    done_obj = obj
-            except Exception:
-                continue
-        merged = {"model": model, "response": response_text, "done": True}
-        if done_obj:
-            merged.update({k: v for k, v in done_obj.items() if k not in merged})
-        return merged
+                item = {"index": i, "ok": True, "result": await calls[i]()}
+            except Exception as e:
+                item = {"index": i, "ok": False, "error": _item_error(e)}
+            item["elapsed_s"] = round(time.monotonic() - t, 3)
+            await results.put(item)
+
+    # батчи — фоновая нагрузка: в допуске к бэкендам уступают интерактивным запросам
+    token = PRIORITY.set(BATCH)
+    try:
+        tasks = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(calls)))]
+    finally:
+        PRIORITY.reset(token)
+    failed = 0
+    try:
+        for _ in calls:
+            item = await results.get()
+            failed += not item["ok"]
+            yield _line(item)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    yield _line({"done": True, "total": len(calls), "failed": failed,
+                 "elapsed_s": round(time.monotonic() - started, 3)})
+
+
+def _batch_response(calls: List[Callable[[], Awaitable[Any]]], concurrency: int | None) -> StreamingResponse:
+    return StreamingResponse(_batch_lines(calls, concurrency or BATCH_CONCURRENCY), media_type=NDJSON_MEDIA,
+                             headers={"X-Accel-Buffering": "no"})
+
+
+def _merge_options(defaults, override):
+    if override is None:
+        return defaults
+    return type(defaults)(**{**defaults.model_dump(), **override.model_dump(exclude_unset=True)})
+
+
+@router.post(
+    "/message/batch",
+    summary="Пакет запросов к LLM (Ollama /api/generate)",
+    description="Много prompt в одном запросе: элементы обрабатываются параллельно (concurrency) и "
+                "отдаются NDJSON по мере готовности — строка {index, ok, result|error, elapsed_s} на элемент, "
+                "в конце {done, total, failed}. Ошибка элемента не прерывает батч.",
+    tags=["OLLAMA"],
+)
+async def message_batch(pool: LLMPoolDep, heavy: HeavyPoolDep, cache: CacheDep, sf: SingleFlightDep,
+                        payload: MessageBatchRequest = Body(...)):
+    def call(item):
+        async def run():
+            body = message_body(MessageRequest(
+                prompt=item.prompt, model=payload.model, system=item.system or payload.system,
+                options=_merge_options(payload.options, item.options), cache=payload.cache, stream=False,
+            ))
+            target = route_pool(pool, heavy, body)
+            return await complete_cached(cache, sf, "message", payload.cache, "/api/generate", body,
+                                         lambda: complete_message(target, body))
+        return run
+
+    return _batch_response([call(item) for item in payload.items], payload.concurrency)
+
+
+@router.post(
+    "/chat/batch",
+    summary="Пакет диалогов с LLM (Ollama /api/chat)",
+    description="Много независимых диалогов в одном запросе; формат ответа — как у /message/batch.",
+    tags=["OLLAMA"],
+)
+async def chat_batch(pool: LLMPoolDep, heavy: HeavyPoolDep, cache: CacheDep, sf: SingleFlightDep,
+                     payload: ChatBatchRequest = Body(...)):
+    def call(item):
+        async def run():
+            body = chat_body(ChatRequest(
+                model=payload.model, messages=item.messages,
+                options=_merge_options(payload.options, item.options), cache=payload.cache, stream=False,
+            ))
+            target = route_pool(pool, heavy, body)
+            return await complete_cached(cache, sf, "chat", payload.cache, "/api/chat", body,
+                                         lambda: complete_chat(target, body))
+        return run
+
+    return _batch_response([call(item) for item in payload.items], payload.concurrency)
@@ -0,0 +1,281 @@
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+import orjson
+from fastapi import APIRouter, Body, HTTPException, Request
+from fastapi.responses import Response
+
+from gateway.admission import release_all
+from gateway.balancer import LLMPool, estimate_tokens, open_node_stream, post_json, route_pool
+from gateway.dependencies import HeavyPoolDep, LLMPoolDep, SessionStoreDep
+from gateway.metrics import observe_llm, tap_llm_stream
+from gateway.sessions import SUMMARY_PREFIX, ChatSession, SessionStore
+from gateway.settings import PASSTHROUGH
+from gateway.streaming import JSON_MEDIA, closer, stream_response, upstream_chunks, wants_sse
+from gateway.swagger_models import (
+    DEFAULT_MODEL, SessionChatRequest, SessionCreateRequest, SessionMessageRequest,
+)
+
+router = APIRouter(tags=["SESSIONS"])
+
+log = logging.getLogger("gateway.sessions")
+
+SUMMARIZE_SYSTEM = ("Сожми диалог в краткий конспект (до 150 слов): факты о пользователе, договорённости, "
+                    "открытые вопросы. Отвечай только конспектом.")
+
+
+def _pin(store: SessionStore, session: ChatSession, url: str) -> None:
+    if session.node != url:
+        store.stats["repinned" if session.node else "pinned"] += 1
+        session.node = url
+
+
+async def _post(store: SessionStore, pool: LLMPool, session: ChatSession, path: str,
+                body: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+    # узел сессии предпочтительнее: там уже лежит KV-кэш её префикса. Дубль на второй узел
+    # этот кэш бы потерял, поэтому без hedge — только замена узла после ошибки
+    ticket = await pool.admit()
+    lease = pool.acquire(body["model"], prefer=session.node)
+    try:
+        r = await post_json(pool, lease, path, body, hedge=False)
+    finally:
+        release_all(lease, ticket)
+    if r.is_error:
+        raise HTTPException(r.status_code, r.text)
+    # после замены узла аренда указывает туда, где ход реально выполнен
+    _pin(store, session, lease.url)
+    result = orjson.loads(r.content)
+    observe_llm(result)
+    return result, r.content
+
+
+async def _open(store: SessionStore, pool: LLMPool, session: ChatSession, path: str,
+                body: Dict[str, Any]) -> Tuple[AsyncIterator[bytes], Callable[[], Awaitable[None]]]:
+    ticket = await pool.admit()
+    lease = pool.acquire(body["model"], prefer=session.node)
+
+    def release():
+        release_all(lease, ticket)
+
+    try:
+        resp = await open_node_stream(pool, lease, path, body, hedge=False)
+    except BaseException:
+        release()
+        raise
+    _pin(store, session, lease.url)
+    close = closer(resp, release)
+    return tap_llm_stream(upstream_chunks(resp, close)), close
+
+
+async def _collect(chunks: AsyncIterator[bytes],
+                   on_done: Callable[[str, Dict[str, Any]], None]) -> AsyncIterator[bytes]:
+    """Пропускает стрим Ollama и собирает ответ; ход записывается в сессию, только если стрим дошёл до done."""
+    buf = b""
+    text: List[str] = []
+    try:
+        async for chunk in chunks:
+            yield chunk
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                try:
+                    obj = orjson.loads(line)
+                except ValueError:
+                    continue
+                text.append((obj.get("message") or {}).get("content") or obj.get("response") or "")
+                if obj.get("done"):
+                    on_done("".join(text), obj)
+    finally:
+        await chunks.aclose()
+
+
+async def _summarize(pool: LLMPool, session: ChatSession, dropped: List[Dict[str, str]]) -> str:
+    text = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+    if session.summary:
+        text = f"{SUMMARY_PREFIX}{session.summary}\n{text}"
+    body = {
+        "model": session.model,
+        "messages": [{"role": "system", "content": SUMMARIZE_SYSTEM},
+                     {"role": "user", "content": text[-session.budget * 3:]}],
+        "stream": False,
+        "options": {"temperature": 0.2, "num_predict": 256, "num_ctx": session.options.get("num_ctx", 2048)},
+    }
+    ticket = await pool.admit()
+    lease = pool.acquire(body["model"], prefer=session.node)
+    try:
+        r = await post_json(pool, lease, "/api/chat", body, hedge=False)
+    finally:
+        release_all(lease, ticket)
+    if r.is_error:
+        raise HTTPException(r.status_code, r.text)
+    return orjson.loads(r.content)["message"]["content"].strip()
+
+
+async def _trim(store: SessionStore, pool: LLMPool, session: ChatSession, summarize: bool) -> None:
+    """Старые ходы, не влезающие в бюджет num_ctx, уходят из истории (со сводкой, если включена)."""
+    kept, dropped = session.fit()
+    if not dropped:
+        return
+    old = session.messages[:dropped]
+    session.messages = kept
+    session.trimmed += dropped
+    store.stats["trimmed_messages"] += dropped
+    if not (summarize and store.summarize):
+        return
+    try:
+        session.summary = await _summarize(pool, session, old)
+        store.stats["summaries"] += 1
+    except HTTPException as e:
+        log.warning("session %s: summary failed, old turns dropped: %s", session.id, e.detail)
+    # сводка сама занимает место — добираем бюджет без повторного сжатия
+    session.messages, more = session.fit()
+    session.trimmed += more
+    store.stats["trimmed_messages"] += more
+
+
+def _chat_done(store: SessionStore, session: ChatSession) -> Callable[[str, Dict[str, Any]], None]:
+    def done(text: str, result: Dict[str, Any]) -> None:
+        session.messages.append({"role": "assistant", "content": text})
+        session.context = None  # /api/chat контекст не возвращает: следующий /message начнёт заново
+        session.turns += 1
+        store.stats["turns"] += 1
+    return done
+
+
+def _message_done(store: SessionStore, session: ChatSession) -> Callable[[str, Dict[str, Any]], None]:
+    def done(text: str, result: Dict[str, Any]) -> None:
+        session.messages.append({"role": "assistant", "content": text})
+        session.context = result.get("context")
+        session.turns += 1
+        store.stats["turns"] += 1
+    return done
+
+
+def _rollback(session: ChatSession, question: Dict[str, str]) -> None:
+    # ход не состоялся — вопрос без ответа в истории не оставляем
+    if session.messages and session.messages[-1] is question:
+        session.messages.pop()
+
+
+async def _turn(request: Request, store: SessionStore, pool: LLMPool, session: ChatSession, path: str,
+                body: Dict[str, Any], done: Callable[[str, Dict[str, Any]], None], key: str):
+    """Ход под замком сессии (ходы одной сессии идут строго по очереди); замок взят вызывающим."""
+    question = session.messages[-1]
+    if not body["stream"]:
+        try:
+            result, raw = await _post(store, pool, session, path, body)
+            text = (result.get("message") or {}).get("content") if key == "message" else result.get(key)
+            done(text or "", result)
+            # ответ Ollama уже JSON: отдаём его байты, без повторной сериализации dict
+            return Response(raw, media_type=JSON_MEDIA) if PASSTHROUGH else result
+        except BaseException:
+            _rollback(session, question)
+            raise
+        finally:
+            session.lock.release()
+
+    try:
+        chunks, close_upstream = await _open(store, pool, session, path, body)
+    except BaseException:
+        _rollback(session, question)
+        session.lock.release()
+        raise
+
+    released = False
+
+    async def release() -> None:
+        # зовётся ответом при любом исходе, в том числе если клиент ушёл до первого чанка
+        nonlocal released
+        if released:
+            return
+        released = True
+        try:
+            await close_upstream()
+        finally:
+            _rollback(session, question)
+            session.lock.release()
+
+    return stream_response(_collect(chunks, done), wants_sse(request), close=release)
+
+
+@router.post("/sessions", summary="Создать сессию диалога", status_code=201)
+async def create_session(store: SessionStoreDep, payload: SessionCreateRequest = Body(...)):
+    session = store.create(payload.model or DEFAULT_MODEL, payload.system, payload.options.model_dump(exclude_none=True))
+    return session.snapshot()
+
+
+@router.get("/sessions", summary="Сессии: число, вытеснения, переиспользование контекста")
+async def sessions_stats(store: SessionStoreDep):
+    return store.snapshot()
+
+
+@router.get("/sessions/{session_id}", summary="Состояние сессии")
+async def get_session(store: SessionStoreDep, session_id: str):
+    return store.get(session_id).snapshot()
+
+
+@router.delete("/sessions/{session_id}", summary="Удалить сессию", status_code=204)
+async def delete_session(store: SessionStoreDep, session_id: str):
+    store.delete(session_id)
+
+
+@router.post(
+    "/sessions/{session_id}/chat",
+    summary="Ход диалога в сессии (Ollama /api/chat)",
+    description="Клиент присылает только новое сообщение; история хранится в gateway и обрезается "
+                "под бюджет num_ctx (старые ходы сжимаются в сводку при SESSION_SUMMARIZE=1). "
+                "Сессия привязана к узлу Ollama, чтобы переиспользовать его KV-кэш.",
+)
+async def session_chat(request: Request, store: SessionStoreDep, pool: LLMPoolDep, heavy: HeavyPoolDep,
+                       session_id: str, payload: SessionChatRequest = Body(...)):
+    session = store.get(session_id)
+    await session.lock.acquire()
+    session.messages.append({"role": "user", "content": payload.content})
+    try:
+        await _trim(store, pool, session, summarize=True)
+    except BaseException:
+        session.messages.pop()
+        session.lock.release()
+        raise
+    body = {"model": session.model, "messages": session.head() + session.messages,
+            "stream": bool(payload.stream), "options": session.options}
+    target = route_pool(pool, heavy, body)
+    return await _turn(request, store, target, session, "/api/chat", body, _chat_done(store, session), "message")
+
+
+@router.post(
+    "/sessions/{session_id}/message",
+    summary="Ход в сессии через /api/generate с переиспользованием context",
+    description="Токены context из прошлого ответа Ollama передаются обратно, поэтому prefill идёт только "
+                "по новому запросу. Если context не влезает в num_ctx, он сбрасывается, а свежие ходы "
+                "(и сводка) уходят в system.",
+)
+async def session_message(request: Request, store: SessionStoreDep, pool: LLMPoolDep, heavy: HeavyPoolDep,
+                          session_id: str, payload: SessionMessageRequest = Body(...)):
+    session = store.get(session_id)
+    await session.lock.acquire()
+    session.messages.append({"role": "user", "content": payload.prompt})
+    body: Dict[str, Any] = {"model": session.model, "prompt": payload.prompt,
+                            "stream": bool(payload.stream), "options": session.options}
+    try:
+        needed = estimate_tokens({"prompt": payload.prompt}) + 8
+        if session.context and len(session.context) + needed <= session.budget:
+            body["context"] = session.context
+            store.stats["context_reused"] += 1
+            await _trim(store, pool, session, summarize=False)
+        else:
+            if session.context:
+                store.stats["context_resets"] += 1
+            session.context = None
+            await _trim(store, pool, session, summarize=True)
+            history = session.transcript(session.budget // 2)
+            parts = [session.system, SUMMARY_PREFIX + session.summary if session.summary else None,
+                     "Предыдущий диалог:\n" + history if history else None]
+            body["system"] = "\n\n".join(p for p in parts if p)
+    except BaseException:
+        session.messages.pop()
+        session.lock.release()
+        raise
+    target = route_pool(pool, heavy, body)
+    return await _turn(request, store, target, session, "/api/generate", body,
+                       _message_done(store, session), "response")
@@ -1,24 +1,172 @@
-from fastapi import UploadFile, File, Form, HTTPException, APIRouter
-from fastapi.responses import JSONResponse
-from typing import Optional
+from fastapi import HTTPException, APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import UploadFile
+from typing import Any, AsyncIterator, BinaryIO, Optional
+import hashlib
+import os
 
-from gateway.settings import WHISPER
-from gateway.dependencies import HttpDep
+import httpx
+
+from gateway.settings import WHISPER, STT_MAX_BYTES, STT_ALLOWED_EXT, STT_TIMEOUT, PASSTHROUGH
+from gateway.admission import Gate, admit, release_all, take
+from gateway.dependencies import HttpDep, SingleFlightDep, STTGateDep
+from gateway.resilience import IDEMPOTENT
+from gateway.singleflight import SingleFlight, request_key
+from gateway.streaming import JSON_MEDIA, closer, open_stream, stream_response, upstream_chunks, wants_sse
 from gateway.swagger_models import STTResponse
 
 router = APIRouter(tags=["WHISPER"])
 
+CHUNK = 1024 * 1024
+# длинный файл Whisper распознаёт минутами: ответа (или следующего сегмента) ждём дольше обычного
+TIMEOUT = httpx.Timeout(STT_TIMEOUT, connect=10.0)
+
+# схема multipart для Swagger: тело разбираем сами, чтобы отсечь большой файл до чтения
+STT_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "language": {"type": "string"},
+                        "task": {"type": "string", "enum": ["transcribe", "translate"]},
+                        "stream": {"type": "boolean", "description": "Сегменты NDJSON/SSE по мере готовности"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+def limit_body(request: Request, max_bytes: int) -> Request:
+    """Request, который обрывает чтение тела с 413, как только пришло больше max_bytes."""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise HTTPException(413, f"Upload exceeds {max_bytes} bytes")
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise HTTPException(413, f"Upload exceeds {max_bytes} bytes")
+        return message
+
+    return Request(request.scope, receive)
+
+
+def check_audio(file: UploadFile) -> None:
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    ctype = (file.content_type or "").split(";")[0]
+    if ext in STT_ALLOWED_EXT or ctype.startswith(("audio/", "video/")):
+        return
+    raise HTTPException(415, f"Unsupported file type: {file.filename} ({ctype or 'unknown'})")
+
+
+async def file_digest(file: UploadFile) -> str:
+    h = hashlib.sha256()
+    while chunk := await file.read(CHUNK):
+        h.update(chunk)
+    await file.seek(0)
+    return h.hexdigest()
+
+
+def own_file(file: UploadFile) -> BinaryIO:
+    """
+    Свой дескриптор загрузки для общего запроса: если клиент, чей файл ушёл в Whisper, отключится
+    и закроет форму, отправка для остальных не оборвётся. Маленький файл при этом сбрасывается на диск.
+    """
+    src = os.fdopen(os.dup(file.file.fileno()), "rb")
+    src.seek(0)
+    return src
+
+
+async def transcribe(http: httpx.AsyncClient, sf: SingleFlight, gate: Optional[Gate], file: UploadFile,
+                     language: Optional[str] = None, task: Optional[str] = None, raw: bool = False) -> Any:
+    """Ответ Whisper: dict или, с raw=True, тело JSON байтами как есть (без разбора и повторной сериализации)."""
+    data = {k: v for k, v in (("language", language), ("task", task)) if v}
+
+    async def post(src: BinaryIO):
+        try:
+            # httpx читает файловый объект кусками — в память целиком не загружается
+            files = {"file": (file.filename, src, file.content_type or "application/octet-stream")}
+            async with admit(gate):
+                r = await http.post(f"{WHISPER}/transcribe", files=files, data=data, timeout=TIMEOUT,
+                                    extensions=IDEMPOTENT)
+        finally:
+            src.close()
+        if r.is_error:
+            raise HTTPException(r.status_code, r.text)
+        return r.content if raw else r.json()
+
+    def call():
+        # вызывается синхронно только у первого клиента — пока его форма открыта
+        return post(own_file(file))
+
+    # одинаковый файл с тем же языком распознаём один раз
+    key = request_key(await file_digest(file), language, task, raw)
+    return await sf.do("stt", key, call)
+
+
+async def transcribe_stream(http: httpx.AsyncClient, sf: SingleFlight, gate: Optional[Gate], file: UploadFile,
+                            language: Optional[str] = None, task: Optional[str] = None) -> AsyncIterator[bytes]:
+    """NDJSON-события Whisper (segment … done) как есть; слот gate держится до конца стрима."""
+    data = {k: v for k, v in (("language", language), ("task", task), ("stream", "true")) if v}
+
+    async def open_upstream(src: BinaryIO):
+        ticket = await take(gate)
+        try:
+            files = {"file": (file.filename, src, file.content_type or "application/octet-stream")}
+            # заголовки Whisper шлёт, только дочитав и декодировав файл, — загрузку после этого можно закрывать
+            resp = await open_stream(http, "POST", f"{WHISPER}/transcribe", files=files, data=data, timeout=TIMEOUT,
+                                     extensions=IDEMPOTENT)
+        except BaseException:
+            release_all(ticket)
+            raise
+        finally:
+            src.close()
+        return upstream_chunks(resp, closer(resp, lambda: release_all(ticket)))
+
+    def open_source():
+        return open_upstream(own_file(file))
+
+    key = request_key("stream", await file_digest(file), language, task)
+    return await sf.stream("stt", key, open_source)
+
+
 @router.post(
     "/stt",
     summary="Распознавание речи (Faster-Whisper)",
-    description="Загрузи аудиофайл (multipart/form-data). Опционально укажи язык (например, ru).",
+    description="Загрузи аудиофайл (multipart/form-data). Опционально укажи язык (например, ru). "
+                "Файл не держится в памяти целиком: он спулится на диск и уходит в Whisper потоком. "
+                "Длинное аудио Whisper режет по паузам и распознаёт кусками параллельно; со stream=true "
+                "сегменты приходят NDJSON (или SSE по Accept) по мере готовности, последним — событие done.",
     tags=["WHISPER"],
     response_model=STTResponse,
+    openapi_extra=STT_BODY,
 )
-async def stt(http: HttpDep, file: UploadFile = File(...), language: Optional[str] = Form(None)):
-    files = {"file": (file.filename, await file.read(), file.content_type or "application/octet-stream")}
-    data = {"language": language} if language else {}
-    r = await http.post(f"{WHISPER}/transcribe", files=files, data=data)
-    if r.is_error:
-        raise HTTPException(r.status_code, r.text)
-    return JSONResponse(r.json())
\ No newline at end of file
+async def stt(request: Request, http: HttpDep, sf: SingleFlightDep, gate: STTGateDep):
+    form = await limit_body(request, STT_MAX_BYTES).form(max_files=1, max_fields=8)
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(422, "Field 'file' is required")
+        check_audio(file)
+        language: Optional[str] = form.get("language") or None
+        task: Optional[str] = form.get("task") or None
+        if (form.get("stream") or "").lower() in ("1", "true", "yes"):
+            chunks = await transcribe_stream(http, sf, gate, file, language, task)
+            return stream_response(chunks, wants_sse(request))
+        if PASSTHROUGH:
+            return Response(await transcribe(http, sf, gate, file, language, task, raw=True),
+                            media_type=JSON_MEDIA)
+        return JSONResponse(await transcribe(http, sf, gate, file, language, task))
+    finally:
+        await form.close()
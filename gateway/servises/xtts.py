@@ -1,18 +1,167 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
 from fastapi import Body, HTTPException, APIRouter
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
+import httpx
 
-from gateway.settings import XTTS
-from gateway.dependencies import HttpDep
+from gateway.admission import Gate, admit, release_all, take
+from gateway.settings import PASSTHROUGH, TTS_SENTENCE_CONCURRENCY, XTTS
+from gateway.dependencies import HttpDep, SingleFlightDep, TTSCacheDep, TTSGateDep
+from gateway.singleflight import SingleFlight, request_key
+from gateway.resilience import IDEMPOTENT
+from gateway.streaming import ClosingStreamingResponse, closer, json_content, open_stream, upstream_chunks
 from gateway.swagger_models import TTSRequest
+from gateway.tts_cache import (
+    WAV_HEADER_SIZE, TTSCache, header_rate, read_wav, sentence_key, split_sentences, wav_header, write_wav,
+)
 
 router = APIRouter(tags=["TTS"])
 
-@router.post("/tts", summary="Синтез речи (XTTS v2)")
-async def tts(http: HttpDep, body: TTSRequest = Body(...)):
-    r = await http.post(f"{XTTS}/tts", json=body.model_dump())
+HEADERS = {"Content-Disposition": 'inline; filename="speech.wav"'}
+
+
+async def _synthesize(http: httpx.AsyncClient, gate: Optional[Gate], payload: Dict[str, Any]) -> Tuple[int, bytes]:
+    async with admit(gate):
+        r = await http.post(f"{XTTS}/tts", extensions=IDEMPOTENT, **json_content({**payload, "stream": False}))
     if r.is_error:
         raise HTTPException(r.status_code, r.text)
-    media = r.headers.get("content-type", "audio/wav")
-    return Response(content=r.content, media_type=media, headers={
-        "Content-Disposition": 'inline; filename="speech.wav"'
-    })
+    return read_wav(r.content)
+
+
+async def _sentence(http: httpx.AsyncClient, sf: SingleFlight, cache: TTSCache, gate: Optional[Gate],
+                    payload: Dict[str, Any], sentence: str) -> Tuple[int, bytes, bool]:
+    """(sample_rate, pcm, из кэша ли) одного предложения; одинаковые промахи синтезируются один раз."""
+    key = sentence_key(sentence, payload["speaker"], payload["speaker_wav"], payload["language"])
+    cached = await cache.get(key)
+    if cached is not None:
+        return (*cached, True)
+
+    async def call():
+        started = time.monotonic()
+        rate, pcm = await _synthesize(http, gate, {**payload, "text": sentence})
+        await cache.set(key, rate, pcm, time.monotonic() - started)
+        return rate, pcm
+
+    return (*await sf.do("tts", key, call), False)
+
+
+async def _stream_sentences(http: httpx.AsyncClient, sf: SingleFlight, cache: TTSCache, gate: Optional[Gate],
+                            payload: Dict[str, Any], sentences: List[str]) -> AsyncIterator[bytes]:
+    """
+    Предложения по порядку: из кэша — сразу, новые — стримом из XTTS с записью в кэш.
+    Заголовок WAV берётся от первого предложения, у остальных отрезается.
+    """
+    header_sent = False
+    for sentence in sentences:
+        key = sentence_key(sentence, payload["speaker"], payload["speaker_wav"], payload["language"])
+        cached = await cache.get(key)
+        if cached is not None:
+            rate, pcm = cached
+            if not header_sent:
+                yield wav_header(rate)
+                header_sent = True
+            yield pcm
+            continue
+
+        async def open_source(text=sentence):
+            return await _open_upstream(http, gate, {**payload, "text": text, "stream": True})
+
+        started = time.monotonic()
+        chunks = await sf.stream("tts", request_key("stream", key), open_source)
+        head = b""
+        pcm = bytearray()
+        try:
+            async for chunk in chunks:
+                if len(head) < WAV_HEADER_SIZE:
+                    need = WAV_HEADER_SIZE - len(head)
+                    head, chunk = head + chunk[:need], chunk[need:]
+                    if len(head) == WAV_HEADER_SIZE and not header_sent:
+                        yield head
+                        header_sent = True
+                if chunk:
+                    pcm += chunk
+                    yield chunk
+        finally:
+            await chunks.aclose()
+        # в кэш попадает только целиком полученное предложение
+        if len(head) == WAV_HEADER_SIZE:
+            await cache.set(key, header_rate(head), bytes(pcm[:len(pcm) // 2 * 2]), time.monotonic() - started)
+
+
+async def _open_upstream(http: httpx.AsyncClient, gate: Optional[Gate], payload: Dict[str, Any]):
+    # слот допуска держится, пока читается стрим XTTS
+    ticket = await take(gate)
+    try:
+        resp = await open_stream(http, "POST", f"{XTTS}/tts", extensions=IDEMPOTENT, **json_content(payload))
+    except BaseException:
+        release_all(ticket)
+        raise
+    return upstream_chunks(resp, closer(resp, lambda: release_all(ticket)))
+
+
+async def synthesize(http: httpx.AsyncClient, sf: SingleFlight, cache: TTSCache | None, gate: Optional[Gate],
+                     payload: Dict[str, Any]) -> Tuple[bytes, str, str | None]:
+    """Готовый WAV целиком: (байты, content-type, попадания в кэш «hits/total» или None без кэша)."""
+    sentences = split_sentences(payload["text"]) if cache else []
+    if sentences:
+        # в работе не больше предложений, чем слотов допуска: иначе запрос упрётся в очередь своими же частями;
+        # без допуска — не больше TTS_SENTENCE_CONCURRENCY, чтобы длинный текст не завалил XTTS
+        sem = asyncio.Semaphore(gate.limit if gate else max(1, TTS_SENTENCE_CONCURRENCY))
+
+        async def one(sentence: str) -> Tuple[int, bytes, bool]:
+            async with sem:
+                return await _sentence(http, sf, cache, gate, payload, sentence)
+
+        tasks = [asyncio.create_task(one(s)) for s in sentences]
+        try:
+            parts = await asyncio.gather(*tasks)
+        finally:
+            # ошибка одного предложения отменяет остальные
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        audio = write_wav(b"".join(pcm for _, pcm, _ in parts), parts[0][0])
+        hits = sum(1 for *_, hit in parts if hit)
+        return audio, "audio/wav", f"{hits}/{len(parts)}"
+
+    async def call():
+        async with admit(gate):
+            r = await http.post(f"{XTTS}/tts", extensions=IDEMPOTENT, **json_content(payload))
+        if r.is_error:
+            raise HTTPException(r.status_code, r.text)
+        return r.content, r.headers.get("content-type", "audio/wav")
+
+    content, media = await sf.do("tts", request_key(payload), call)
+    return content, media, None
+
+
+@router.post(
+    "/tts",
+    summary="Синтез речи (XTTS v2)",
+    description="С stream=true WAV отдаётся потоком: заголовок сразу, затем PCM по мере синтеза. "
+                "Если включён кэш (TTS_CACHE_DIR), текст режется на предложения: готовые берутся "
+                "из кэша, синтезируются только новые.",
+)
+async def tts(http: HttpDep, sf: SingleFlightDep, cache: TTSCacheDep, gate: TTSGateDep,
+              body: TTSRequest = Body(...)):
+    payload = body.model_dump()
+    sentences = split_sentences(body.text) if cache else []
+    if body.stream and sentences:
+        return StreamingResponse(
+            _stream_sentences(http, sf, cache, gate, payload, sentences),
+            media_type="audio/wav", headers={**HEADERS, "X-Accel-Buffering": "no"},
+        )
+    if body.stream or (PASSTHROUGH and not sentences):
+        # без кэша собирать WAV в gateway незачем: байты XTTS уходят клиенту по мере чтения
+        async def open_source():
+            return await _open_upstream(http, gate, payload)
+
+        chunks = await sf.stream("tts", request_key(payload), open_source)
+        headers = {**HEADERS, "X-Accel-Buffering": "no"} if body.stream else HEADERS
+        return ClosingStreamingResponse(chunks, media_type="audio/wav", headers=headers, close=chunks.aclose)
+
+    content, media, cached = await synthesize(http, sf, cache, gate, payload)
+    headers = {**HEADERS, "X-Cache": cached} if cached else HEADERS
+    return Response(content=content, media_type=media, headers=headers)
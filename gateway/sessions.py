@@ -0,0 +1,143 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from gateway.balancer import estimate_tokens
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога: "
+
+
+def message_tokens(m: Dict[str, Any]) -> int:
+    return estimate_tokens({"messages": [m]}) + 4  # роль и разметка шаблона
+
+
+@dataclass
+class ChatSession:
+    id: str
+    model: str
+    system: Optional[str]
+    options: Dict[str, Any]
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None
+    context: Optional[List[int]] = None   # токены контекста Ollama /api/generate с прошлого хода
+    node: Optional[str] = None            # узел, где живёт KV-кэш сессии
+    turns: int = 0
+    trimmed: int = 0
+    created: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    @property
+    def budget(self) -> int:
+        """Токенов на промпт: num_ctx минус место под ответ."""
+        num_ctx = self.options.get("num_ctx") or 2048
+        num_predict = self.options.get("num_predict") or 0
+        return max(256, num_ctx - max(num_predict, 0))
+
+    def head(self) -> List[Dict[str, str]]:
+        head = [{"role": "system", "content": self.system}] if self.system else []
+        if self.summary:
+            head.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        return head
+
+    def fit(self, budget: Optional[int] = None) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Последние сообщения, которые вместе с system и сводкой влезают в бюджет, и сколько
+        старых не влезло. Последнее сообщение (текущий вопрос) остаётся всегда.
+        """
+        left = (budget or self.budget) - sum(message_tokens(m) for m in self.head())
+        keep = 0
+        for m in reversed(self.messages):
+            cost = message_tokens(m)
+            if keep and cost > left:
+                break
+            left -= cost
+            keep += 1
+        return self.messages[len(self.messages) - keep:], len(self.messages) - keep
+
+    def transcript(self, budget: int) -> str:
+        """Свежие ходы (без текущего вопроса) текстом — для system, когда контекст Ollama пришлось сбросить."""
+        lines: List[str] = []
+        for m in reversed(self.messages[:-1]):
+            line = f"{'Пользователь' if m['role'] == 'user' else 'Ассистент'}: {m['content']}"
+            budget -= len(line) // 3
+            if budget < 0:
+                break
+            lines.append(line)
+        return "\n".join(reversed(lines))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "model": self.model,
+            "options": self.options,
+            "turns": self.turns,
+            "messages": len(self.messages),
+            "trimmed": self.trimmed,
+            "summary": self.summary,
+            "history_tokens": sum(message_tokens(m) for m in self.head() + self.messages),
+            "budget_tokens": self.budget,
+            "context_tokens": len(self.context) if self.context else 0,
+            "node": self.node,
+            "created": self.created,
+            "last_used": self.last_used,
+        }
+
+
+class SessionStore:
+    """
+    Сессии диалога на стороне gateway: история хранится здесь, клиент присылает только новый ход.
+
+    Хранилище ограничено max_sessions (сверх — вытесняется давно не использованная) и
+    idle_ttl: простаивающие дольше удаляются при следующем обращении к хранилищу.
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 1800.0, summarize: bool = False):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.summarize = summarize
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.stats = {"created": 0, "expired": 0, "evicted": 0, "turns": 0, "trimmed_messages": 0,
+                      "summaries": 0, "context_reused": 0, "context_resets": 0, "pinned": 0, "repinned": 0}
+
+    def _prune(self) -> None:
+        deadline = time.time() - self.idle_ttl
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_used >= deadline:
+                break
+            self.sessions.popitem(last=False)
+            self.stats["expired"] += 1
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def create(self, model: str, system: Optional[str], options: Dict[str, Any]) -> ChatSession:
+        session = ChatSession(uuid.uuid4().hex, model, system, options)
+        self.sessions[session.id] = session
+        self.stats["created"] += 1
+        self._prune()
+        return session
+
+    def get(self, session_id: str) -> ChatSession:
+        self._prune()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(404, f"Session {session_id} not found or expired")
+        session.last_used = time.time()
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str) -> None:
+        if self.sessions.pop(session_id, None) is None:
+            raise HTTPException(404, f"Session {session_id} not found")
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._prune()
+        return {"sessions": len(self.sessions), "max_sessions": self.max_sessions, "idle_ttl": self.idle_ttl,
+                "summarize": self.summarize, **self.stats}
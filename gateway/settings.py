@@ -5,6 +5,106 @@ XTTS   = os.getenv("XTTS_URL",   "http://xtts:8021")
 WHISPER= os.getenv("WHISPER_URL","http://whisper:8022")
 COMFY  = os.getenv("COMFY_URL",  "http://comfyui:8188")
 
+# Ограничения загрузки аудио для /stt
+STT_MAX_BYTES   = int(os.getenv("STT_MAX_MB", 512)) * 1024 * 1024
+STT_ALLOWED_EXT = {e.strip().lower() for e in os.getenv(
+    "STT_ALLOWED_EXT", ".wav,.mp3,.m4a,.ogg,.oga,.opus,.flac,.webm,.mp4,.aac,.wma,.mkv"
+).split(",") if e.strip()}
+# ожидание ответа Whisper (и следующего сегмента в стриме), с
+STT_TIMEOUT     = float(os.getenv("STT_TIMEOUT", 1800))
+
+# Пул LLM-бэкендов через запятую; без OLLAMA_URLS работает один OLLAMA_URL
+OLLAMA_URLS = [u.strip() for u in os.getenv("OLLAMA_URLS", OLLAMA).split(",") if u.strip()]
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", 10))
+LLM_EJECT_AFTER     = int(os.getenv("LLM_EJECT_AFTER", 3))
+LLM_READMIT_AFTER   = int(os.getenv("LLM_READMIT_AFTER", 2))
+LLM_WARM_SLACK      = int(os.getenv("LLM_WARM_SLACK", 4))
+
+# Устойчивость к сбоям бэкендов. Автомат адреса размыкается после BREAKER_FAILURES неудач подряд
+# (сеть, таймаут, 502/503/504) на BREAKER_COOLDOWN секунд; повторы с jitter для идемпотентных запросов;
+# дубль LLM-запроса на второй узел, если ответа нет дольше квантиля HEDGE_QUANTILE, — не больше
+# доли HEDGE_BUDGET запросов (0 — без дублей); лимиты соединений на адрес «бэкенд=всего:keep-alive»
+BREAKER_FAILURES    = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN    = float(os.getenv("BREAKER_COOLDOWN", 30))
+RETRY_ATTEMPTS      = int(os.getenv("RETRY_ATTEMPTS", 2))
+RETRY_BACKOFF       = float(os.getenv("RETRY_BACKOFF", 0.2))
+HEDGE_QUANTILE      = float(os.getenv("HEDGE_QUANTILE", 0.95))
+HEDGE_MIN_SAMPLES   = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_BUDGET        = float(os.getenv("HEDGE_BUDGET", 0.1))
+BACKEND_POOL_LIMITS = os.getenv("BACKEND_POOL_LIMITS", "llm=64:32,llm_heavy=32:16,tts=16:8,stt=16:8,image=32:16")
+
+# Модель по умолчанию для запросов без model
+OLLAMA_DEFAULT_MODEL = os.getenv("OLLAMA_DEFAULT_MODEL", "qwen2.5:3b-instruct-q5_K_M")
+# Прогрев: какие модели загрузить на каждый узел при старте (пусто — только модель по умолчанию,
+# "-" — без прогрева), сколько Ollama держит их в памяти и как часто продлевать keep_alive
+WARMUP_MODELS    = [m.strip() for m in os.getenv("WARMUP_MODELS", OLLAMA_DEFAULT_MODEL).split(",")
+                    if m.strip() and m.strip() != "-"]
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+WARMUP_INTERVAL  = float(os.getenv("WARMUP_INTERVAL", 300))
+WARMUP_TIMEOUT   = float(os.getenv("WARMUP_TIMEOUT", 600))
+
+# Сессии диалога: сколько хранить, через сколько секунд простоя удалять, сжимать ли старые ходы в сводку
+SESSION_MAX       = int(os.getenv("SESSION_MAX", 10000))
+SESSION_IDLE_TTL  = float(os.getenv("SESSION_IDLE_TTL", 1800))
+SESSION_SUMMARIZE = os.getenv("SESSION_SUMMARIZE", "0") == "1"
+
+# Эмбеддинги /embed: модель по умолчанию, текстов в одном вызове Ollama /api/embed, сколько вызовов
+# идёт параллельно, потолок текстов на запрос и объём кэша векторов (по хэшу текста)
+EMBED_MODEL       = os.getenv("EMBED_MODEL", "nomic-embed-text")
+EMBED_BATCH       = int(os.getenv("EMBED_BATCH", 64))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+EMBED_MAX_TEXTS   = int(os.getenv("EMBED_MAX_TEXTS", 4096))
+EMBED_CACHE_MB    = int(os.getenv("EMBED_CACHE_MB", 256))
+# Коллекции векторов /collections: VECTOR_DIR — каталог memmap-файлов (пусто — только в памяти)
+VECTOR_DIR             = os.getenv("VECTOR_DIR", "")
+VECTOR_MAX_COLLECTIONS = int(os.getenv("VECTOR_MAX_COLLECTIONS", 64))
+
+# Батчи /message/batch и /chat/batch: параллельность по умолчанию, её потолок и размер батча
+BATCH_CONCURRENCY     = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 32))
+BATCH_MAX_ITEMS       = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+
+# Ответы бэкендов без преобразований отдаются клиенту как есть (байты/стрим), без разбора и
+# повторной сериализации; 0 — через pydantic-модели ответа, как раньше (для сравнения в bench)
+PASSTHROUGH = os.getenv("PASSTHROUGH", "1") == "1"
+
+# Доля запросов, которым добавляется заголовок Server-Timing (и всем с X-Debug-Timing: 1)
+METRICS_TIMING_SAMPLE = float(os.getenv("METRICS_TIMING_SAMPLE", 0))
+
+# Тяжёлый пул для большого контекста: num_ctx >= HEAVY_NUM_CTX или оценка промпта >= HEAVY_PROMPT_TOKENS
+OLLAMA_HEAVY_URLS   = [u.strip() for u in os.getenv("OLLAMA_HEAVY_URLS", "").split(",") if u.strip()]
+HEAVY_NUM_CTX       = int(os.getenv("HEAVY_NUM_CTX", 16384))
+HEAVY_PROMPT_TOKENS = int(os.getenv("HEAVY_PROMPT_TOKENS", 6000))
+
+# Контроль допуска: бэкенд=параллельность:очередь; reserve — доля слотов только для interactive
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_LIMITS  = os.getenv("ADMISSION_LIMITS", "llm=8:32,llm_heavy=2:8,image=4:0,tts=2:16,stt=4:16")
+ADMISSION_RESERVE = float(os.getenv("ADMISSION_RESERVE", 0.25))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+# класс приоритета: по API-ключу (key:batch,...) или заголовку X-Priority: interactive|batch
+PRIORITY_HEADER   = os.getenv("PRIORITY_HEADER", "X-Priority")
+PRIORITY_API_KEYS = os.getenv("PRIORITY_API_KEYS", "")
+
+# Кэш детерминированных LLM-ответов (temperature=0 или seed); CACHE_DIR включает дисковый уровень
+CACHE_ENABLED     = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+CACHE_MAX_MB      = int(os.getenv("CACHE_MAX_MB", 64))
+CACHE_TTL         = float(os.getenv("CACHE_TTL", 3600))
+CACHE_DIR         = os.getenv("CACHE_DIR", "")
+CACHE_DISK_MAX_MB = int(os.getenv("CACHE_DISK_MAX_MB", 1024))
+
+# Дисковый кэш синтезированных предложений TTS; пустой TTS_CACHE_DIR — кэш выключен
+TTS_CACHE_DIR    = os.getenv("TTS_CACHE_DIR", "")
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", 1024))
+# сколько предложений одного запроса синтезируется параллельно, если допуск к TTS выключен
+TTS_SENTENCE_CONCURRENCY = int(os.getenv("TTS_SENTENCE_CONCURRENCY", 2))
+
+# Склейка одинаковых запросов в полёте: маршруты через запятую (chat,message,image,tts,stt)
+SINGLEFLIGHT_ROUTES = [r.strip() for r in os.getenv("SINGLEFLIGHT_ROUTES", "chat,message,image,tts,stt").split(",")
+                       if r.strip()]
+# Окно общего стрима в чанках: столько отставания самого медленного клиента терпит апстрим
+SINGLEFLIGHT_STREAM_BUFFER = int(os.getenv("SINGLEFLIGHT_STREAM_BUFFER", 256))
+
 IMG_WIDTH  = int(os.getenv("IMG_WIDTH", 768))
 IMG_HEIGHT = int(os.getenv("IMG_HEIGHT", 768))
 IMG_BATCH  = int(os.getenv("IMG_BATCH", 1))
@@ -17,4 +117,42 @@ IMG_CKPT    = os.getenv("IMG_CKPT", "sd_xl_base_1.0.safetensors")
 IMG_CLIP_LAYER = int(os.getenv("IMG_CLIP_LAYER", -2))
 IMG_PREFIX  = os.getenv("IMG_PREFIX", "comfy_out")
 NEGATIVE_DEFAULT = os.getenv("NEGATIVE_DEFAULT", "")
-SERVER_URL = os.getenv("SERVER_URL", 'http://192.168.10.169:8188')
\ No newline at end of file
+# сколько секунд хранить завершённые задачи в реестре gateway
+COMFY_JOB_TTL = float(os.getenv("COMFY_JOB_TTL", 3600))
+# Дисковый кэш картинок-результатов и их WebP/JPEG/превью; пустой IMAGE_CACHE_DIR — без кэша
+IMAGE_CACHE_DIR    = os.getenv("IMAGE_CACHE_DIR", "")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", 2048))
+IMAGE_QUALITY      = int(os.getenv("IMAGE_QUALITY", 80))
+IMAGE_MAX_SIZE     = int(os.getenv("IMAGE_MAX_SIZE", 2048))
+
+# ===== Воркер брокера (асинхронный режим): WORKER_BROKER=kafka|memory, пусто — выключен =====
+WORKER_BROKER        = os.getenv("WORKER_BROKER", "")
+WORKER_KINDS         = [k.strip() for k in os.getenv("WORKER_KINDS", "llm_light,llm_heavy,stt,tts,img").split(",")
+                        if k.strip()]
+WORKER_BATCH         = int(os.getenv("WORKER_BATCH", 8))
+# сколько фоновых запросов в работе допускается на один LLM-узел сверх интерактивных
+WORKER_LLM_SLOTS     = int(os.getenv("WORKER_LLM_SLOTS", 2))
+WORKER_MAX_ATTEMPTS  = int(os.getenv("WORKER_MAX_ATTEMPTS", 3))
+WORKER_RETRY_BACKOFF = float(os.getenv("WORKER_RETRY_BACKOFF", 1.0))
+# откуда воркер может скачивать audio_url (host или host:port через запятую); пусто — только audio_b64
+WORKER_AUDIO_HOSTS   = {h.strip().lower() for h in os.getenv("WORKER_AUDIO_HOSTS", "").split(",") if h.strip()}
+# сколько ждать картинку, прежде чем ответить ошибкой
+WORKER_IMG_TIMEOUT   = float(os.getenv("WORKER_IMG_TIMEOUT", 900))
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_GROUP_ID          = os.getenv("KAFKA_GROUP_ID", "ai-gateway")
+KAFKA_SECURITY_PROTOCOL = os.getenv("KAFKA_SECURITY_PROTOCOL", "PLAINTEXT")
+KAFKA_SASL_MECHANISM    = os.getenv("KAFKA_SASL_MECHANISM", "")
+KAFKA_USERNAME          = os.getenv("KAFKA_USERNAME", "")
+KAFKA_PASSWORD          = os.getenv("KAFKA_PASSWORD", "")
+KAFKA_MAX_POLL_INTERVAL_MS = int(os.getenv("KAFKA_MAX_POLL_INTERVAL_MS", 900000))
+
+TOPIC_LLM_REQ_LIGHT = os.getenv("TOPIC_LLM_REQ_LIGHT", "llm.requests.light")
+TOPIC_LLM_REQ_HEAVY = os.getenv("TOPIC_LLM_REQ_HEAVY", "llm.requests.heavy")
+TOPIC_LLM_RESP      = os.getenv("TOPIC_LLM_RESP", "llm.responses")
+TOPIC_STT_REQ       = os.getenv("TOPIC_STT_REQ", "stt.requests")
+TOPIC_STT_RESP      = os.getenv("TOPIC_STT_RESP", "stt.responses")
+TOPIC_TTS_REQ       = os.getenv("TOPIC_TTS_REQ", "tts.requests")
+TOPIC_TTS_RESP      = os.getenv("TOPIC_TTS_RESP", "tts.responses")
+TOPIC_IMG_REQ       = os.getenv("TOPIC_IMG_REQ", "img.requests.hq")
+TOPIC_IMG_RESP      = os.getenv("TOPIC_IMG_RESP", "img.responses")
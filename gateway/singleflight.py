@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import itertools
+import json
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable
+
+
+def request_key(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class Fanout:
+    """
+    Один апстрим-стрим на нескольких клиентов.
+
+    Первые buffer чанков хранятся, поэтому подключившийся позже получает стрим с начала;
+    дальше окно сдвигается за самым медленным подписчиком, и если он отстал на buffer
+    чанков, чтение апстрима ждёт его. К стриму, начало которого уже выброшено, новые
+    клиенты не подключаются (joinable). Апстрим читается в отдельной задаче; если
+    отключились все подписчики — задача отменяется, и соединение с бэкендом закрывается.
+    """
+
+    def __init__(self, open_source: Callable[[], Awaitable[AsyncIterator[bytes]]], buffer: int = 256):
+        self.chunks: Deque[bytes] = deque()
+        self.offset = 0  # номер чанка chunks[0] от начала стрима
+        self.buffer = max(1, buffer)
+        self.done = False
+        self.positions: Dict[int, int] = {}  # подписчик -> номер следующего чанка
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._ids = itertools.count()
+        self._changed = asyncio.Event()
+        # open_source вызывается сразу, в контексте первого клиента; ждёт открытия уже задача
+        self._task = asyncio.create_task(self._pump(open_source()))
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.positions)
+
+    def joinable(self) -> bool:
+        return self.offset == 0
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _lag(self) -> int:
+        return self.offset + len(self.chunks) - min(self.positions.values(), default=self.offset + len(self.chunks))
+
+    def _trim(self) -> None:
+        # начало держим, пока окно не заполнено, потом выбрасываем прочитанное всеми
+        low = min(self.positions.values(), default=self.offset)
+        while len(self.chunks) >= self.buffer and self.offset < low:
+            self.chunks.popleft()
+            self.offset += 1
+
+    async def _pump(self, opening: Awaitable[AsyncIterator[bytes]]) -> None:
+        try:
+            source = await opening
+        except asyncio.CancelledError:
+            self.ready.cancel()
+            self.done = True
+            raise
+        except BaseException as e:
+            self.ready.set_exception(e)
+            self.ready.exception()  # помечаем как прочитанное, чтобы не было warning без подписчиков
+            self.done = True
+            return
+        self.ready.set_result(None)
+        try:
+            async for chunk in source:
+                while self._lag() >= self.buffer:
+                    await self._changed.wait()
+                self.chunks.append(chunk)
+                self._trim()
+                self._wake()
+        finally:
+            await source.aclose()
+            self.done = True
+            self._wake()
+
+    def register(self) -> int:
+        # подписчик учитывается с момента регистрации, ещё до открытия апстрима
+        sid = next(self._ids)
+        self.positions[sid] = self.offset
+        return sid
+
+    def leave(self, sid: int) -> None:
+        self.positions.pop(sid, None)
+        if not self.positions and not self.done:
+            self._task.cancel()
+        self._trim()
+        self._wake()
+
+    def subscribe(self, sid: int) -> "Subscription":
+        return Subscription(self, sid)
+
+    async def _iter(self, sid: int) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                pos = self.positions[sid]
+                if pos < self.offset + len(self.chunks):
+                    pending = list(itertools.islice(self.chunks, pos - self.offset, None))
+                    self.positions[sid] = pos + len(pending)
+                    self._trim()
+                    self._wake()
+                    for chunk in pending:
+                        yield chunk
+                elif self.done:
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.leave(sid)
+
+
+class Subscription:
+    """
+    Итератор чанков одного подписчика. aclose снимает подписку, даже если чтение так и не
+    началось (finally генератора в этом случае не выполняется) — иначе подписчик держал бы
+    апстрим и буфер до конца стрима.
+    """
+
+    def __init__(self, fanout: Fanout, sid: int):
+        self.fanout = fanout
+        self.sid = sid
+        self._it = fanout._iter(sid)
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> bytes:
+        return await self._it.__anext__()
+
+    async def aclose(self) -> None:
+        try:
+            await self._it.aclose()
+        finally:
+            self.fanout.leave(self.sid)
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых запросов, которые сейчас в полёте (single-flight).
+
+    Пока первый запрос с данным ключом не завершился, повторные ждут его результат,
+    а не отправляют дубликат на GPU. Для стримов — общий Fanout. Кэшем это не является:
+    после завершения запрос с тем же ключом снова уйдёт в апстрим.
+    """
+
+    def __init__(self, routes: Iterable[str], stream_buffer: int = 256):
+        self.routes = set(routes)
+        self.stream_buffer = stream_buffer
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, Fanout] = {}
+        self.stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"leaders": 0, "coalesced": 0})
+
+    def enabled(self, route: str) -> bool:
+        return route in self.routes
+
+    async def do(self, route: str, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled(route):
+            return await fn()
+        key = f"{route}:{key}"
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.stats[route]["leaders"] += 1
+        else:
+            self.stats[route]["coalesced"] += 1
+        call.waiters += 1
+        try:
+            # shield: отмена одного клиента не должна отменять общий запрос
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    async def stream(
+        self, route: str, key: str, open_source: Callable[[], Awaitable[AsyncIterator[bytes]]]
+    ) -> Subscription:
+        """
+        Возвращает подписку на чанки; ошибка открытия апстрима пробрасывается всем ожидающим.
+        Подписку нужно закрыть (aclose), в том числе если её так и не начали читать.
+        """
+        key = f"{route}:{key}"
+        fanout = self._streams.get(key)
+        if not self.enabled(route):
+            # без склейки — свой Fanout на каждый запрос, чтобы закрытие работало одинаково
+            fanout = Fanout(open_source, self.stream_buffer)
+        elif fanout is None or not fanout.joinable():
+            # начало летящего стрима уже выброшено из буфера — опоздавшему свой апстрим
+            fanout = Fanout(open_source, self.stream_buffer)
+            self._streams[key] = fanout
+            fanout._task.add_done_callback(lambda _, f=fanout: self._forget(key, f))
+            self.stats[route]["leaders"] += 1
+        else:
+            self.stats[route]["coalesced"] += 1
+        sid = fanout.register()
+        try:
+            await asyncio.shield(fanout.ready)
+        except BaseException:
+            fanout.leave(sid)
+            raise
+        return fanout.subscribe(sid)
+
+    def _forget(self, key: str, fanout: Fanout) -> None:
+        if self._streams.get(key) is fanout:
+            del self._streams[key]
+
+    def record(self, route: str, coalesced: bool) -> None:
+        """Учёт для маршрутов, которые склеивают запросы сами (например, по активной задаче)."""
+        self.stats[route]["coalesced" if coalesced else "leaders"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"routes": sorted(self.routes), "stats": dict(self.stats)}
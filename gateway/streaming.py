@@ -0,0 +1,123 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import httpx
+import orjson
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+SSE_MEDIA = "text/event-stream"
+NDJSON_MEDIA = "application/x-ndjson"
+JSON_MEDIA = "application/json"
+
+
+def json_content(body: Any) -> Dict[str, Any]:
+    """Аргументы httpx для JSON-тела: orjson вместо json.dumps, который httpx зовёт на json=."""
+    return {"content": orjson.dumps(body), "headers": {"Content-Type": JSON_MEDIA}}
+
+
+def wants_sse(request: Request) -> bool:
+    """Клиент выбирает формат стрима заголовком Accept: text/event-stream -> SSE, иначе NDJSON."""
+    return SSE_MEDIA in request.headers.get("accept", "")
+
+
+async def open_stream(http: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+    """Открывает стрим к апстриму; ошибки отдаём обычным HTTPException до начала ответа."""
+    resp = await http.send(http.build_request(method, url, **kwargs), stream=True)
+    if resp.is_error:
+        text = await resp.aread()
+        await resp.aclose()
+        raise HTTPException(resp.status_code, text.decode("utf-8", errors="ignore"))
+    return resp
+
+
+def _sse(data: bytes, event: str | None = None) -> bytes:
+    head = f"event: {event}\n".encode() if event else b""
+    return head + b"data: " + data + b"\n\n"
+
+
+def closer(resp: httpx.Response, on_close: Optional[Callable[[], None]] = None) -> Callable[[], Awaitable[None]]:
+    async def close() -> None:
+        await resp.aclose()
+        if on_close:
+            on_close()
+    return close
+
+
+async def upstream_chunks(resp: httpx.Response, close: Callable[[], Awaitable[None]]) -> AsyncIterator[bytes]:
+    # строки Ollama уже NDJSON — отдаём байты как есть, без парсинга
+    try:
+        async for chunk in resp.aiter_raw():
+            yield chunk
+    finally:
+        await close()
+
+
+async def ndjson_to_sse(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buf = b""
+    try:
+        async for chunk in chunks:
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for raw in lines:
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    obj = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                if "error" in obj:
+                    yield _sse(line, "error")
+                elif obj.get("done"):
+                    # финальный объект Ollama несёт статистику (eval_count, total_duration, ...)
+                    yield _sse(line, "done")
+                else:
+                    yield _sse(line)
+    finally:
+        await chunks.aclose()
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse, который вызывает close при любом исходе ответа. Фоновая задача Starlette
+    при обрыве клиента не запускается, а finally генератора, которого так и не начали читать,
+    не выполняется — поэтому апстрим, подписку и блокировки освобождаем здесь.
+    """
+
+    def __init__(self, content: Any, *args: Any, close: Optional[Callable[[], Awaitable[None]]] = None, **kwargs: Any):
+        super().__init__(content, *args, **kwargs)
+        self.close = close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.close:
+                await self.close()
+
+
+def stream_response(
+    chunks: AsyncIterator[bytes], sse: bool, close: Optional[Callable[[], Awaitable[None]]] = None
+) -> StreamingResponse:
+    async def close_all() -> None:
+        # исходный итератор закрываем сами: обёртка ndjson_to_sse могла так и не стартовать
+        try:
+            await chunks.aclose()
+        finally:
+            if close:
+                await close()
+
+    if sse:
+        return ClosingStreamingResponse(
+            ndjson_to_sse(chunks),
+            media_type=SSE_MEDIA,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            close=close_all,
+        )
+    return ClosingStreamingResponse(
+        chunks,
+        media_type=NDJSON_MEDIA,
+        headers={"X-Accel-Buffering": "no"},
+        close=close_all,
+    )
@@ -1,15 +1,16 @@
 from typing import Optional, List, Literal, Dict, Any, Union
 import random
 
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, field_validator
 from gateway.settings import (
     IMG_WIDTH, IMG_HEIGHT, IMG_BATCH, IMG_STEPS, IMG_CFG,
     IMG_SAMPLER, IMG_SCHED, IMG_DENOISE, IMG_CKPT, IMG_CLIP_LAYER,
-    IMG_PREFIX, NEGATIVE_DEFAULT
+    IMG_PREFIX, NEGATIVE_DEFAULT, BATCH_MAX_ITEMS, BATCH_MAX_CONCURRENCY, OLLAMA_DEFAULT_MODEL,
+    EMBED_MODEL, EMBED_MAX_TEXTS,
 )
 
 
-DEFAULT_MODEL  = "qwen2.5:3b-instruct-q5_K_M"
+DEFAULT_MODEL  = OLLAMA_DEFAULT_MODEL
 
 Role = Literal["system", "user", "assistant", "developer"]
 
@@ -26,6 +27,7 @@ class ChatOptions(BaseModel):
     top_p: Optional[float] = Field(None, ge=0, le=1)
     top_k: Optional[int] = Field(None, ge=0)
     repeat_penalty: Optional[float] = Field(None, ge=0)
+    seed: Optional[int] = Field(None, description="Фиксированный seed (детерминированный ответ)")
 
 
 class ChatRequest(BaseModel):
@@ -33,6 +35,9 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage] = Field(..., description="История диалога")
     stream: Optional[bool] = Field(False, description="Стриминговый ответ")
     options: ChatOptions = ChatOptions()
+    cache: Optional[bool] = Field(
+        None, description="Кэш ответа: по умолчанию только при temperature=0 или seed; true/false — принудительно"
+    )
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -67,6 +72,7 @@ class MessageOptions(BaseModel):
     temperature: Optional[float] = Field(0.2, ge=0, le=2)
     top_p: Optional[float] = Field(0.9, ge=0, le=1)
     repeat_penalty: Optional[float] = Field(1.1, ge=0)
+    seed: Optional[int] = Field(None, description="Фиксированный seed (детерминированный ответ)")
 
 
 class MessageRequest(BaseModel):
@@ -77,6 +83,9 @@ class MessageRequest(BaseModel):
     )
     options: MessageOptions = MessageOptions()
     stream: Optional[bool] = Field(False)
+    cache: Optional[bool] = Field(
+        None, description="Кэш ответа: по умолчанию только при temperature=0 или seed; true/false — принудительно"
+    )
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -92,6 +101,52 @@ class MessageRequest(BaseModel):
     )
 
 
+class MessageBatchItem(BaseModel):
+    prompt: str = Field(..., description="Текст запроса")
+    system: Optional[str] = Field(None, description="Свой system; по умолчанию — общий для батча")
+    options: Optional[MessageOptions] = Field(None, description="Заданные поля перекрывают общие options")
+
+
+class MessageBatchRequest(BaseModel):
+    items: List[MessageBatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    model: Optional[str] = Field(DEFAULT_MODEL)
+    system: Optional[str] = Field(
+        "Ты — русскоязычный ассистент. Всегда отвечай по-русски, кратко и грамотно."
+    )
+    options: MessageOptions = MessageOptions()
+    cache: Optional[bool] = Field(None, description="Кэш ответа для каждого элемента, как у /message")
+    concurrency: Optional[int] = Field(
+        None, ge=1, le=BATCH_MAX_CONCURRENCY, description="Сколько элементов обрабатывается одновременно"
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "examples": [
+                {
+                    "items": [{"prompt": "Столица Франции?"}, {"prompt": "Сколько будет 2+2?"}],
+                    "options": {"temperature": 0},
+                    "concurrency": 4,
+                }
+            ]
+        }
+    )
+
+
+class ChatBatchItem(BaseModel):
+    messages: List[ChatMessage] = Field(..., description="История диалога")
+    options: Optional[ChatOptions] = Field(None, description="Заданные поля перекрывают общие options")
+
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatBatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    model: Optional[str] = Field(DEFAULT_MODEL, description="Ollama model tag")
+    options: ChatOptions = ChatOptions()
+    cache: Optional[bool] = Field(None, description="Кэш ответа для каждого элемента, как у /chat")
+    concurrency: Optional[int] = Field(
+        None, ge=1, le=BATCH_MAX_CONCURRENCY, description="Сколько элементов обрабатывается одновременно"
+    )
+
+
 class GenerateGatewayResponse(BaseModel):
     model: Optional[str] = None
     response: Optional[str] = None
@@ -100,6 +155,58 @@ class GenerateGatewayResponse(BaseModel):
     model_config = ConfigDict(extra="allow")
 
 
+class SessionCreateRequest(BaseModel):
+    model: Optional[str] = Field(DEFAULT_MODEL, description="Ollama model tag")
+    system: Optional[str] = Field(
+        "Ты — русскоязычный ассистент. Всегда отвечай по-русски, кратко и грамотно."
+    )
+    options: ChatOptions = Field(ChatOptions(), description="num_ctx и num_predict задают бюджет истории")
+
+
+class SessionChatRequest(BaseModel):
+    content: str = Field(..., description="Новое сообщение пользователя")
+    stream: Optional[bool] = Field(False, description="Стриминговый ответ")
+
+
+class SessionMessageRequest(BaseModel):
+    prompt: str = Field(..., description="Новый запрос; контекст прошлых ходов хранит gateway")
+    stream: Optional[bool] = Field(False, description="Стриминговый ответ")
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str] = Field(..., min_length=1, max_length=EMBED_MAX_TEXTS, description="Тексты для эмбеддингов")
+    model: Optional[str] = Field(EMBED_MODEL, description="Embedding-модель Ollama")
+    dimensions: Optional[int] = Field(None, ge=1, description="Урезать вектор (если модель умеет)")
+    truncate: bool = Field(True, description="Обрезать тексты длиннее контекста модели, а не падать")
+    normalize: bool = Field(False, description="Нормировать векторы по L2")
+
+    model_config = ConfigDict(
+        json_schema_extra={"examples": [{"texts": ["Москва — столица России", "Париж — столица Франции"]}]}
+    )
+
+
+class CollectionCreateRequest(BaseModel):
+    name: str = Field(..., description="Имя коллекции: латиница, цифры, _.-")
+    model: Optional[str] = Field(EMBED_MODEL, description="Embedding-модель коллекции")
+
+
+class CollectionItem(BaseModel):
+    id: Optional[str] = Field(None, description="Существующий id заменяет запись; пусто — новый id")
+    text: str
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class CollectionAddRequest(BaseModel):
+    items: List[CollectionItem] = Field(..., min_length=1, max_length=EMBED_MAX_TEXTS)
+
+
+class CollectionSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=256, description="Запросы (по каждому свой top-k)")
+    k: int = Field(5, ge=1, le=1000)
+
+    model_config = ConfigDict(json_schema_extra={"examples": [{"queries": ["Какая столица у Франции?"], "k": 3}]})
+
+
 class ComfyNode(BaseModel):
     class_type: str
     inputs: Dict[str, Any]
@@ -151,6 +258,9 @@ def build_simple_comfy_payload(text: str, client_id: str | None) -> Dict[str, An
     }
 
 
+OPENAI_RESERVED = {"model", "messages", "temperature", "top_p", "max_tokens", "stream"}
+
+
 class OpenAIMessage(BaseModel):
     role: Role = Field(..., examples=["user"])
     content: str = Field(..., examples=["Hello! Who are you?"])
@@ -162,6 +272,16 @@ class OpenAIChatRequest(BaseModel):
     top_p: Optional[float] = Field(1.0, ge=0, le=1)
     max_tokens: Optional[int] = Field(None, description="Ограничение длины вывода")
     extra: Optional[Dict[str, Any]] = Field(None, description="Дополнительные параметры OpenAI")
+    stream: Optional[bool] = Field(False, description="Стриминговый ответ (дельты по мере генерации)")
+
+    @field_validator("extra")
+    @classmethod
+    def _no_reserved(cls, extra: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # эти параметры задаются полями запроса; в extra они дали бы повторный аргумент
+        reserved = sorted(set(extra or {}) & OPENAI_RESERVED)
+        if reserved:
+            raise ValueError(f"set {', '.join(reserved)} as request fields, not in extra")
+        return extra
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -178,23 +298,25 @@ class OpenAIChatRequest(BaseModel):
     )
 
 
-# class STTSegment(BaseModel):
-#     start: float
-#     end: float
-#     text: str
-#
-#
-# class STTResponse(BaseModel):
-#     language: Optional[str] = Field(None, description="Детектированный язык (если есть)")
-#     text: str = Field(..., description="Итоговая транскрипция")
-#     segments: Optional[List[STTSegment]] = Field(
-#         None, description="Сегменты (если возвращаются)"
-#     )
-#
-#
-# class TTSRequest(BaseModel):
-#     text: str
-#     speaker: Optional[str] = None
-#     speaker_wav: Optional[Union[str, List[str]]] = None
-#     language: Optional[str] = "ru"
-#     out_path: Optional[str] = "/tmp/out.wav"
\ No newline at end of file
+class STTSegment(BaseModel):
+    start: float
+    end: float
+    text: str
+
+
+class STTResponse(BaseModel):
+    language: Optional[str] = Field(None, description="Детектированный язык (если есть)")
+    text: str = Field(..., description="Итоговая транскрипция")
+    segments: Optional[List[STTSegment]] = Field(
+        None, description="Сегменты (если возвращаются)"
+    )
+    duration: Optional[float] = Field(None, description="Длительность аудио, с")
+    chunks: Optional[int] = Field(None, description="На сколько кусков резалось длинное аудио")
+
+
+class TTSRequest(BaseModel):
+    text: str
+    speaker: Optional[str] = None
+    speaker_wav: Optional[Union[str, List[str]]] = None
+    language: Optional[str] = "ru"
+    stream: Optional[bool] = Field(False, description="Отдавать WAV потоком по мере синтеза")
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import struct
+import tempfile
+import unicodedata
+import wave
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger("gateway.tts_cache")
+
+WAV_HEADER_SIZE = 44
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def split_sentences(text: str) -> List[str]:
+    """Режет текст по концам предложений; пустые куски отбрасываются."""
+    return [s for s in (normalize_text(p) for p in _SENTENCE_END.split(text)) if s]
+
+
+def sentence_key(sentence: str, speaker: Any, speaker_wav: Any, language: Any) -> str:
+    raw = json.dumps([normalize_text(sentence), speaker, speaker_wav, language],
+                     ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF - 36) -> bytes:
+    """Заголовок PCM16 mono; без data_size — для стрима неизвестной длины."""
+    return b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVEfmt " + struct.pack(
+        "<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16
+    ) + b"data" + struct.pack("<I", data_size)
+
+
+def header_rate(header: bytes) -> int:
+    return struct.unpack_from("<I", header, 24)[0]
+
+
+def read_wav(data: bytes) -> Tuple[int, bytes]:
+    with wave.open(io.BytesIO(data), "rb") as w:
+        return w.getframerate(), w.readframes(w.getnframes())
+
+
+def write_wav(pcm: bytes, sample_rate: int) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+
+class TTSCache:
+    """
+    Дисковое хранилище синтезированных предложений, адресуемое по содержимому.
+
+    Ключ — нормализованный текст предложения, голос и язык; значение — WAV-файл.
+    Вытеснение по суммарному размеру, самые давно использованные (mtime) — первыми.
+    Сэкономленное время оценивается по среднему real-time factor промахов.
+    """
+
+    def __init__(self, disk_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0,
+                      "audio_s_cached": 0.0, "audio_s_synthesized": 0.0, "synthesis_s": 0.0}
+        os.makedirs(disk_dir, exist_ok=True)
+        self.entries, self.bytes = self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.wav")
+
+    def _scan(self) -> Tuple[int, int]:
+        count = total = 0
+        with os.scandir(self.disk_dir) as it:
+            for e in it:
+                if e.name.endswith(".wav"):
+                    count += 1
+                    total += e.stat().st_size
+        return count, total
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # LRU по mtime
+            return data
+        except OSError:
+            return None
+
+    def _disk_put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        existed = os.path.exists(path)
+        # свой временный файл на каждую запись: одновременные записи одного ключа не пишут в общий .tmp
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if not existed:
+            self.entries += 1
+            self.bytes += len(data)
+        if self.bytes > self.max_bytes:
+            self._prune()
+
+    def _prune(self) -> None:
+        files = []
+        with os.scandir(self.disk_dir) as it:
+            for e in it:
+                if e.name.endswith(".wav"):
+                    st = e.stat()
+                    files.append((st.st_mtime, st.st_size, e.path))
+        self.entries, self.bytes = len(files), sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if self.bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.entries -= 1
+            self.bytes -= size
+            self.stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Tuple[int, bytes]]:
+        """(sample_rate, pcm) предложения или None."""
+        data = await asyncio.to_thread(self._disk_get, key)
+        if data is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            rate, pcm = read_wav(data)
+        except (wave.Error, EOFError):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["audio_s_cached"] += len(pcm) / 2 / rate
+        return rate, pcm
+
+    async def set(self, key: str, sample_rate: int, pcm: bytes, synthesis_s: float) -> None:
+        self.stats["audio_s_synthesized"] += len(pcm) / 2 / sample_rate
+        self.stats["synthesis_s"] += synthesis_s
+        try:
+            await asyncio.to_thread(self._disk_put, key, write_wav(pcm, sample_rate))
+        except OSError as e:
+            log.warning("tts cache write failed: %s", e)
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = self.stats
+        lookups = s["hits"] + s["misses"]
+        rtf = s["synthesis_s"] / s["audio_s_synthesized"] if s["audio_s_synthesized"] else None
+        return {
+            "hits": s["hits"],
+            "misses": s["misses"],
+            "hit_rate": round(s["hits"] / lookups, 3) if lookups else 0.0,
+            "evictions": s["evictions"],
+            "entries": self.entries,
+            "bytes": self.bytes,
+            "audio_s_from_cache": round(s["audio_s_cached"], 2),
+            "synthesis_s": round(s["synthesis_s"], 2),
+            "real_time_factor": round(rtf, 3) if rtf is not None else None,
+            "saved_synthesis_s": round(s["audio_s_cached"] * rtf, 2) if rtf is not None else None,
+        }
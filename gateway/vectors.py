@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+from fastapi import HTTPException
+
+from gateway.embeddings import normalize
+
+log = logging.getLogger("gateway.vectors")
+
+NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+DTYPE = np.float32
+
+
+class Collection:
+    """
+    Коллекция векторов: одна непрерывная матрица float32 со строками, нормированными по L2,
+    поэтому поиск top-k по косинусу — одно матричное умножение и argpartition.
+
+    Без каталога матрица живёт в памяти (ёмкость растёт удвоением). С каталогом строки
+    дописываются в vectors.f32, а читается он через np.memmap: открытие мгновенное при любом
+    размере, страницы подтягивает ОС по мере поиска. Рядом лежат items.jsonl (id, текст,
+    метаданные строки; последняя запись строки побеждает) и meta.json, где count фиксирует
+    завершённую запись — хвост после сбоя посреди add не читается.
+    """
+
+    def __init__(self, name: str, model: str, path: Optional[str] = None, dim: Optional[int] = None):
+        self.name = name
+        self.model = model
+        self.path = path
+        self.dim = dim
+        self.count = 0
+        self.ids: List[str] = []
+        self.texts: List[Optional[str]] = []
+        self.metadata: List[Optional[Dict[str, Any]]] = []
+        self.index: Dict[str, int] = {}
+        self.searches = 0
+        self.lock = asyncio.Lock()
+        self._matrix = np.empty((0, dim or 0), dtype=DTYPE)
+        self._buf: Optional[np.ndarray] = None
+
+    # ---------- файлы ----------
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _write_meta(self) -> None:
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps({"name": self.name, "model": self.model, "dim": self.dim, "count": self.count}))
+        os.replace(tmp, self._file("meta.json"))
+
+    def _map(self) -> None:
+        if self.count:
+            self._matrix = np.memmap(self._file("vectors.f32"), dtype=DTYPE, mode="r", shape=(self.count, self.dim))
+        else:
+            self._matrix = np.empty((0, self.dim or 0), dtype=DTYPE)
+
+    @classmethod
+    def open(cls, path: str) -> "Collection":
+        with open(os.path.join(path, "meta.json"), "rb") as f:
+            meta = orjson.loads(f.read())
+        col = cls(meta["name"], meta["model"], path, meta["dim"])
+        col.count = meta["count"]
+        col.ids = [""] * col.count
+        col.texts = [None] * col.count
+        col.metadata = [None] * col.count
+        items = col._file("items.jsonl")
+        if os.path.exists(items):
+            with open(items, "rb") as f:
+                for line in f:
+                    try:
+                        item = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue  # недописанная строка после сбоя
+                    row = item["row"]
+                    if row < col.count:
+                        col.ids[row], col.texts[row], col.metadata[row] = item["id"], item.get("text"), item.get("metadata")
+        col.index = {id_: row for row, id_ in enumerate(col.ids) if id_}
+        col._map()
+        return col
+
+    # ---------- запись ----------
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix
+
+    def add(self, ids: List[Optional[str]], vectors: np.ndarray, texts: List[Optional[str]],
+            metadata: List[Optional[Dict[str, Any]]]) -> Tuple[List[str], int]:
+        """Добавляет или заменяет (по id) строки; возвращает id строк и сколько из них новых. Блокирующий."""
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise HTTPException(422, f"Collection {self.name} stores {self.dim}-dim vectors, got {vectors.shape[1]}")
+        vectors = normalize(vectors.astype(DTYPE, copy=False))
+
+        rows: List[int] = []
+        out_ids: List[str] = []
+        fresh = 0
+        for id_ in ids:
+            id_ = id_ or uuid.uuid4().hex
+            row = self.index.get(id_)
+            if row is None:
+                row = self.index[id_] = self.count + fresh
+                fresh += 1
+            rows.append(row)
+            out_ids.append(id_)
+        self.ids += [""] * fresh
+        self.texts += [None] * fresh
+        self.metadata += [None] * fresh
+        for row, id_, text, meta in zip(rows, out_ids, texts, metadata):
+            self.ids[row], self.texts[row], self.metadata[row] = id_, text, meta
+
+        count = self.count + fresh
+        if self.path:
+            self._write_rows(rows, vectors, count)
+        else:
+            self._store_rows(rows, vectors, count)
+        self.count = count
+        if self.path:
+            self._write_meta()
+            self._map()
+        else:
+            self._matrix = self._buf[:count]
+        return out_ids, fresh
+
+    def _store_rows(self, rows: List[int], vectors: np.ndarray, count: int) -> None:
+        if self._buf is None or self._buf.shape[0] < count:
+            buf = np.empty((max(count, 2 * (self._buf.shape[0] if self._buf is not None else 0), 64), self.dim),
+                           dtype=DTYPE)
+            if self.count:
+                buf[:self.count] = self._matrix
+            self._buf = buf
+        # повторный id внутри одного add: побеждает последний, как при последовательной записи
+        self._buf[rows] = vectors
+
+    def _write_rows(self, rows: List[int], vectors: np.ndarray, count: int) -> None:
+        row_bytes = self.dim * np.dtype(DTYPE).itemsize
+        path = self._file("vectors.f32")
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            # новые строки — непрерывным куском в конец (с нулями под дыры от повторов), затем замены
+            f.truncate(self.count * row_bytes)
+            block = np.zeros((count - self.count, self.dim), dtype=DTYPE)
+            late = []
+            for i, row in enumerate(rows):
+                if row >= self.count:
+                    block[row - self.count] = vectors[i]
+                else:
+                    late.append(i)
+            f.seek(self.count * row_bytes)
+            f.write(block.tobytes())
+            for i in late:
+                f.seek(rows[i] * row_bytes)
+                f.write(vectors[i].tobytes())
+        with open(self._file("items.jsonl"), "ab") as f:
+            f.write(b"".join(orjson.dumps({"row": row, "id": self.ids[row], "text": self.texts[row],
+                                           "metadata": self.metadata[row]}, option=orjson.OPT_APPEND_NEWLINE)
+                             for row in sorted(set(rows))))
+
+    # ---------- поиск ----------
+    def search(self, queries: np.ndarray, k: int) -> List[List[Dict[str, Any]]]:
+        """top-k по косинусу для каждой строки queries. Блокирующий."""
+        matrix = self._matrix
+        n = matrix.shape[0]
+        if n == 0:
+            return [[] for _ in range(len(queries))]
+        if queries.shape[1] != self.dim:
+            raise HTTPException(422, f"Collection {self.name} stores {self.dim}-dim vectors, got {queries.shape[1]}")
+        self.searches += len(queries)
+        scores = normalize(queries.astype(DTYPE, copy=False)) @ matrix.T
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q, cand in enumerate(top):
+            order = cand[np.argsort(-scores[q, cand])]
+            results.append([{"id": self.ids[r], "score": float(scores[q, r]), "text": self.texts[r],
+                             "metadata": self.metadata[r]} for r in order])
+        return results
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"name": self.name, "model": self.model, "dim": self.dim, "count": self.count,
+                "bytes": self.count * (self.dim or 0) * np.dtype(DTYPE).itemsize,
+                "persistent": bool(self.path), "searches": self.searches}
+
+
+class VectorStore:
+    """Именованные коллекции; с disk_dir каждая — подкаталог, открывается при старте через memmap."""
+
+    def __init__(self, disk_dir: Optional[str] = None, max_collections: int = 64):
+        self.disk_dir = disk_dir
+        self.max_collections = max_collections
+        self.collections: Dict[str, Collection] = {}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            for name in sorted(os.listdir(disk_dir)):
+                path = os.path.join(disk_dir, name)
+                if not os.path.exists(os.path.join(path, "meta.json")):
+                    continue
+                try:
+                    self.collections[name] = Collection.open(path)
+                except (OSError, ValueError, KeyError) as e:
+                    log.warning("vector collection %s is not loaded: %s", name, e)
+
+    def create(self, name: str, model: str) -> Collection:
+        if not NAME_RE.match(name):
+            raise HTTPException(422, "Collection name must match [A-Za-z0-9_.-]{1,64}")
+        if name in self.collections:
+            raise HTTPException(409, f"Collection {name} already exists")
+        if len(self.collections) >= self.max_collections:
+            raise HTTPException(409, f"Too many collections (max {self.max_collections})")
+        path = None
+        if self.disk_dir:
+            path = os.path.join(self.disk_dir, name)
+            os.makedirs(path, exist_ok=True)
+        col = Collection(name, model, path)
+        if path:
+            col._write_meta()
+        self.collections[name] = col
+        return col
+
+    def get(self, name: str) -> Collection:
+        col = self.collections.get(name)
+        if col is None:
+            raise HTTPException(404, f"Collection {name} not found")
+        return col
+
+    def delete(self, name: str) -> None:
+        col = self.collections.pop(name, None)
+        if col is None:
+            raise HTTPException(404, f"Collection {name} not found")
+        if col.path:
+            shutil.rmtree(col.path, ignore_errors=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"persistent": bool(self.disk_dir), "max_collections": self.max_collections,
+                "collections": [c.snapshot() for c in self.collections.values()]}
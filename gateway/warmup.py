@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from gateway.balancer import LLMNode, LLMPool, normalize_model
+
+log = logging.getLogger("gateway.warmup")
+
+
+@dataclass
+class ModelState:
+    loaded: bool = False
+    load_s: Optional[float] = None     # последняя загрузка модели в память (load_duration Ollama)
+    loads: int = 0
+    evictions: int = 0                 # модель пропала из /api/ps между пингами и грузилась заново
+    pings: int = 0
+    last_ping: Optional[float] = None
+    error: Optional[str] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"loaded": self.loaded, "load_s": self.load_s, "loads": self.loads, "evictions": self.evictions,
+                "pings": self.pings, "last_ping": self.last_ping, "error": self.error}
+
+
+class WarmupManager:
+    """
+    Прогрев и удержание моделей на узлах Ollama.
+
+    При старте на каждый узел пулов по очереди загружаются models (запрос /api/generate без
+    prompt только загружает модель); пока узел не прогрет, он не готов (LLMNode.ready) и
+    трафик получает, только если готовых нет. Дальше раз в interval модели пингуются тем же
+    запросом с keep_alive, чтобы Ollama их не выгрузила; выпавший, восстановившийся или
+    потерявший модель узел прогревается заново на ближайшем шаге retry.
+    """
+
+    def __init__(
+        self,
+        pools: List[Tuple[str, LLMPool]],
+        models: List[str],
+        keep_alive: str = "30m",
+        interval: float = 300.0,
+        timeout: float = 600.0,
+        retry: float = 10.0,
+    ):
+        self.pools = pools
+        self.models = [normalize_model(m) for m in models]
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.timeout = timeout
+        self.retry = min(retry, interval)
+        self.states: Dict[Tuple[str, str], ModelState] = {}
+        self.started = time.time()
+        self.warmup_s: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _nodes(self):
+        for name, pool in self.pools:
+            for node in pool.nodes:
+                yield name, pool, node
+
+    @property
+    def ready(self) -> bool:
+        """Первый прогрев прошёл и в каждом пуле есть хотя бы один прогретый узел."""
+        if not self.models:
+            return True
+        return self.warmup_s is not None and all(any(n.ready for n in pool.nodes) for _, pool in self.pools)
+
+    async def _ping(self, pool: LLMPool, node: LLMNode, model: str) -> bool:
+        state = self.states.setdefault((node.url, model), ModelState())
+        if state.loaded and model not in node.models:
+            state.evictions += 1
+        body = {"model": model, "keep_alive": self.keep_alive, "stream": False}
+        try:
+            r = await pool.http.post(f"{node.url}/api/generate", json=body, timeout=self.timeout)
+            r.raise_for_status()
+            result = r.json()
+        except (httpx.HTTPError, ValueError) as e:
+            state.loaded = False
+            state.error = str(e) or type(e).__name__
+            log.warning("warm-up of %s on %s failed: %s", model, node.url, state.error)
+            return False
+        state.pings += 1
+        state.last_ping = time.time()
+        state.error = None
+        if not state.loaded or model not in node.models:
+            state.loads += 1
+            state.load_s = round(result.get("load_duration", 0) / 1e9, 3)
+            log.info("model %s loaded on %s in %.2fs", model, node.url, state.load_s)
+        state.loaded = True
+        node.models.add(model)
+        return True
+
+    async def _warm(self, pool: LLMPool, node: LLMNode) -> None:
+        # модели одного узла грузятся по очереди: параллельно они лишь делят одну GPU
+        ok = True
+        for model in self.models:
+            ok = await self._ping(pool, node, model) and ok
+        node.ready = ok
+
+    def _due(self, node: LLMNode) -> bool:
+        if not node.ready:
+            return node.healthy
+        # узел перезапустился или вытеснил модель (её нет в /api/ps) — грузим, не дожидаясь interval
+        if any(m not in node.models for m in self.models):
+            return True
+        pings = [self.states[(node.url, m)].last_ping or 0 for m in self.models if (node.url, m) in self.states]
+        return not pings or time.time() - min(pings) >= self.interval
+
+    async def _run(self) -> None:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(self._warm(pool, node) for _, pool, node in self._nodes()))
+        self.warmup_s = round(time.perf_counter() - t0, 3)
+        log.info("warm-up finished in %.2fs, ready=%s", self.warmup_s, self.ready)
+        while True:
+            await asyncio.sleep(self.retry)
+            await asyncio.gather(*(self._warm(pool, node) for _, pool, node in self._nodes() if self._due(node)))
+
+    def start(self) -> None:
+        if not self.models:
+            return
+        for _, _, node in self._nodes():
+            node.ready = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _resident(self, pool: LLMPool, node: LLMNode) -> Optional[List[Dict[str, Any]]]:
+        try:
+            r = await pool.http.get(f"{node.url}/api/ps", timeout=5.0)
+            r.raise_for_status()
+            return [{"model": m.get("model") or m.get("name"), "size_vram": m.get("size_vram"),
+                     "expires_at": m.get("expires_at")} for m in r.json().get("models", [])]
+        except (httpx.HTTPError, ValueError):
+            return None
+
+    async def report(self) -> Dict[str, Any]:
+        """Что сейчас в памяти узлов (по /api/ps) и как грузились прогреваемые модели."""
+        entries = list(self._nodes())
+        resident = await asyncio.gather(*(self._resident(pool, node) for _, pool, node in entries))
+        return {
+            "ready": self.ready,
+            "models": self.models,
+            "keep_alive": self.keep_alive,
+            "interval": self.interval,
+            "started": self.started,
+            "warmup_s": self.warmup_s,
+            "nodes": [{
+                "pool": name,
+                "url": node.url,
+                "healthy": node.healthy,
+                "ready": node.ready,
+                "resident": models,
+                "warmup": {m: self.states[(node.url, m)].snapshot()
+                           for m in self.models if (node.url, m) in self.states},
+            } for (name, _, node), models in zip(entries, resident)],
+        }
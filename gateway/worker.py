@@ -0,0 +1,342 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from fastapi import HTTPException
+from pydantic import ValidationError
+from starlette.datastructures import Headers, UploadFile
+
+from gateway.admission import BATCH, PRIORITY, gate_for
+from gateway.broker import Broker, KafkaBroker, MemoryBroker, Message
+from gateway.balancer import route_pool
+from gateway.comfy_jobs import FINAL
+from gateway.servises.ollama import chat_body, complete_cached, complete_chat, complete_message, message_body
+from gateway.servises.wisper import check_audio, transcribe
+from gateway.servises.xtts import synthesize
+from gateway.settings import (
+    KAFKA_BOOTSTRAP_SERVERS, KAFKA_GROUP_ID, KAFKA_SECURITY_PROTOCOL, KAFKA_SASL_MECHANISM,
+    KAFKA_USERNAME, KAFKA_PASSWORD, KAFKA_MAX_POLL_INTERVAL_MS, STT_MAX_BYTES,
+    WORKER_BROKER, WORKER_KINDS, WORKER_BATCH, WORKER_LLM_SLOTS, WORKER_MAX_ATTEMPTS, WORKER_RETRY_BACKOFF,
+    WORKER_AUDIO_HOSTS, WORKER_IMG_TIMEOUT,
+    TOPIC_LLM_REQ_LIGHT, TOPIC_LLM_REQ_HEAVY, TOPIC_LLM_RESP, TOPIC_STT_REQ, TOPIC_STT_RESP,
+    TOPIC_TTS_REQ, TOPIC_TTS_RESP, TOPIC_IMG_REQ, TOPIC_IMG_RESP,
+)
+from gateway.singleflight import request_key
+from gateway.swagger_models import (
+    ChatRequest, MessageRequest, SimpleTxtRequest, TTSRequest, build_simple_comfy_payload,
+)
+
+log = logging.getLogger("gateway.worker")
+
+Handler = Callable[[Any, Dict[str, Any]], Awaitable[Any]]
+
+
+def is_transient(e: BaseException) -> bool:
+    """Сбой бэкенда, который имеет смысл повторить; остальное — ошибка самого запроса."""
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, HTTPException) and e.status_code in (429, 502, 503, 504)
+
+
+def _error(e: BaseException) -> Dict[str, Any]:
+    if isinstance(e, HTTPException):
+        return {"status": e.status_code, "detail": e.detail}
+    if isinstance(e, ValidationError):
+        return {"status": 422, "detail": e.errors(include_url=False, include_context=False)}
+    if isinstance(e, ValueError):
+        return {"status": 422, "detail": str(e)}
+    return {"status": 500, "detail": f"{type(e).__name__}: {e}"}
+
+
+# ---------- обработчики: те же бэкенды и хелперы, что у HTTP-роутеров ----------
+async def _llm(state, req: Dict[str, Any], heavy: bool) -> Any:
+    kind = req.get("type") or ("chat" if "messages" in req else "message")
+    if kind == "chat":
+        payload = ChatRequest.model_validate({**req, "stream": False})
+        body, path, complete = chat_body(payload), "/api/chat", complete_chat
+    elif kind == "message":
+        payload = MessageRequest.model_validate({**req, "stream": False})
+        body, path, complete = message_body(payload), "/api/generate", complete_message
+    else:
+        raise HTTPException(422, f"Unknown LLM request type: {kind}")
+    # топик heavy всегда идёт в тяжёлый пул (если он есть), light — по размеру контекста, как HTTP
+    pool = (state.llm_heavy_pool or state.llm_pool) if heavy else route_pool(state.llm_pool, state.llm_heavy_pool, body)
+    return await complete_cached(state.cache, state.singleflight, kind, payload.cache, path, body,
+                                 lambda: complete(pool, body))
+
+
+async def handle_llm(state, req: Dict[str, Any]) -> Any:
+    return await _llm(state, req, heavy=False)
+
+
+async def handle_llm_heavy(state, req: Dict[str, Any]) -> Any:
+    return await _llm(state, req, heavy=True)
+
+
+def check_audio_url(url: str) -> None:
+    """
+    audio_url приходит из сообщения: качаем только с разрешённых хостов (WORKER_AUDIO_HOSTS),
+    иначе через воркер можно достучаться до внутренних адресов — метаданных облака, бэкендов.
+    """
+    parts = urlparse(url)
+    host = (parts.hostname or "").lower()
+    try:
+        allowed = host in WORKER_AUDIO_HOSTS or f"{host}:{parts.port}" in WORKER_AUDIO_HOSTS
+    except ValueError:
+        allowed = False  # кривой порт
+    if parts.scheme not in ("http", "https") or not allowed:
+        raise HTTPException(422, f"audio_url host is not allowed: {host or url}")
+
+
+async def _download(http: httpx.AsyncClient, url: str, out) -> None:
+    check_audio_url(url)
+    received = 0
+    # редиректы не следуем: они увели бы за пределы разрешённых хостов
+    async with http.stream("GET", url, follow_redirects=False) as r:
+        if r.is_redirect:
+            raise HTTPException(422, f"Audio download failed: redirect to {r.headers.get('location')}")
+        if r.is_error:
+            raise HTTPException(502 if r.status_code >= 500 else 422, f"Audio download failed: HTTP {r.status_code}")
+        async for chunk in r.aiter_bytes():
+            received += len(chunk)
+            if received > STT_MAX_BYTES:
+                raise HTTPException(413, f"Audio exceeds {STT_MAX_BYTES} bytes")
+            out.write(chunk)
+
+
+async def handle_stt(state, req: Dict[str, Any]) -> Any:
+    # аудио — ссылкой (audio_url) или, для коротких файлов, прямо в сообщении (audio_b64)
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    try:
+        if req.get("audio_url"):
+            await _download(state.http, req["audio_url"], spool)
+            name = os.path.basename(urlparse(req["audio_url"]).path)
+        elif req.get("audio_b64"):
+            spool.write(base64.b64decode(req["audio_b64"], validate=True))
+            name = ""
+        else:
+            raise HTTPException(422, "Field 'audio_url' or 'audio_b64' is required")
+        spool.seek(0)
+        file = UploadFile(spool, filename=req.get("filename") or name or "audio",
+                          headers=Headers({"content-type": req.get("content_type") or "application/octet-stream"}))
+        check_audio(file)
+        return await transcribe(state.http, state.singleflight, gate_for(state.admission, "stt"), file,
+                                req.get("language"), req.get("task"))
+    finally:
+        spool.close()
+
+
+async def handle_tts(state, req: Dict[str, Any]) -> Any:
+    payload = TTSRequest.model_validate({**req, "stream": False}).model_dump()
+    content, media, cached = await synthesize(state.http, state.singleflight, state.tts_cache,
+                                              gate_for(state.admission, "tts"), payload)
+    return {"content_type": media, "audio_b64": base64.b64encode(content).decode("ascii"), "cache": cached}
+
+
+async def handle_img(state, req: Dict[str, Any]) -> Any:
+    body = SimpleTxtRequest.model_validate(req)
+    registry = state.comfy
+    key = request_key(body.model_dump())
+    job = registry.find_active(key) or await registry.submit(
+        build_simple_comfy_payload(body.text, body.client_id), key=key
+    )
+    deadline = time.monotonic() + WORKER_IMG_TIMEOUT
+    while job.status not in FINAL:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            # не 504: временная ошибка вернула бы сообщение в топик, и ждали бы по кругу
+            raise HTTPException(500, f"Image generation did not finish in {WORKER_IMG_TIMEOUT:.0f}s")
+        await job.wait_change(min(60.0, left))
+    if job.status == "error":
+        raise HTTPException(500, job.error or "Image generation failed")
+    # картинки забираются по url из gateway, пока задача живёт в реестре (COMFY_JOB_TTL)
+    return registry.snapshot(job)
+
+
+ROUTES: Dict[str, Tuple[str, Handler, str]] = {
+    "llm_light": (TOPIC_LLM_REQ_LIGHT, handle_llm, TOPIC_LLM_RESP),
+    "llm_heavy": (TOPIC_LLM_REQ_HEAVY, handle_llm_heavy, TOPIC_LLM_RESP),
+    "stt": (TOPIC_STT_REQ, handle_stt, TOPIC_STT_RESP),
+    "tts": (TOPIC_TTS_REQ, handle_tts, TOPIC_TTS_RESP),
+    "img": (TOPIC_IMG_REQ, handle_img, TOPIC_IMG_RESP),
+}
+
+
+def make_broker(kind: str = WORKER_BROKER) -> Optional[Broker]:
+    if not kind:
+        return None
+    if kind == "memory":
+        return MemoryBroker()
+    if kind == "kafka":
+        return KafkaBroker(
+            KAFKA_BOOTSTRAP_SERVERS, KAFKA_GROUP_ID, security_protocol=KAFKA_SECURITY_PROTOCOL,
+            sasl_mechanism=KAFKA_SASL_MECHANISM or None, username=KAFKA_USERNAME or None,
+            password=KAFKA_PASSWORD or None, max_poll_interval_ms=KAFKA_MAX_POLL_INTERVAL_MS,
+        )
+    raise ValueError(f"Unknown WORKER_BROKER: {kind}")
+
+
+class Worker:
+    """
+    Асинхронный режим: читает топики запросов, вызывает те же бэкенды, что и HTTP-роутеры,
+    и публикует ответы в топики ответов.
+
+    Выборка из топика (до batch сообщений) обрабатывается параллельно — так её батчат сами
+    бэкенды (параллельные слоты Ollama, микробатчинг Whisper), а одинаковые запросы склеиваются
+    single-flight. LLM-топики берут столько сообщений, сколько в пуле свободных слотов
+    (llm_slots на узел минус запросы в работе), и не мешают интерактивному трафику.
+    Оффсет коммитится только до первого сообщения, упавшего на временной ошибке бэкенда;
+    с него чтение партиции начинается заново (at-least-once: ответы несут id запроса).
+    Ошибка самого запроса (4xx) публикуется как ответ с ok=false и коммитится.
+    """
+
+    def __init__(self, broker: Broker, state: Any, kinds: List[str], batch: int = 8, llm_slots: int = 2,
+                 max_attempts: int = 3, backoff: float = 1.0):
+        unknown = set(kinds) - set(ROUTES)
+        if unknown:
+            raise ValueError(f"Unknown worker kinds: {sorted(unknown)}")
+        self.broker = broker
+        self.state = state
+        self.kinds = kinds
+        self.batch = batch
+        self.llm_slots = llm_slots
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"ok": 0, "errors": 0, "retries": 0, "rewinds": 0, "inflight": 0}
+        )
+
+    def _capacity(self, kind: str) -> int:
+        if not kind.startswith("llm"):
+            return self.batch
+        pool = (self.state.llm_heavy_pool or self.state.llm_pool) if kind == "llm_heavy" else self.state.llm_pool
+        free = sum(max(0, self.llm_slots - n.inflight) for n in pool.nodes if n.healthy)
+        return min(self.batch, free)
+
+    async def _reply(self, topic: str, msg: Message, req_id: Any, envelope: Dict[str, Any]) -> None:
+        data = json.dumps({"id": req_id, **envelope}, ensure_ascii=False, default=str).encode("utf-8")
+        await self.broker.publish(topic, data, key=msg.key)
+
+    async def _process(self, kind: str, msg: Message) -> bool:
+        """True — сообщение обработано (успех или ошибка запроса), можно коммитить."""
+        _, handler, reply = ROUTES[kind]
+        stats = self.stats[kind]
+        started = time.monotonic()
+        req_id = None
+        stats["inflight"] += 1
+        try:
+            try:
+                req = json.loads(msg.value)
+                if not isinstance(req, dict):
+                    raise ValueError("Request must be a JSON object")
+                req_id = req.pop("id", None)
+                reply = req.pop("reply_to", None) or reply
+            except ValueError as e:
+                await self._reply(reply, msg, None, {"ok": False, "error": _error(e)})
+                stats["errors"] += 1
+                return True
+
+            for attempt in range(self.max_attempts):
+                try:
+                    result = await handler(self.state, req)
+                except Exception as e:
+                    if is_transient(e):
+                        if attempt + 1 < self.max_attempts:
+                            stats["retries"] += 1
+                            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                            continue
+                        log.warning("%s: backend unavailable, will redeliver %s[%d]@%d: %s",
+                                    kind, msg.topic, msg.partition, msg.offset, e)
+                        return False
+                    await self._reply(reply, msg, req_id, {"ok": False, "error": _error(e)})
+                    stats["errors"] += 1
+                    return True
+                await self._reply(reply, msg, req_id, {
+                    "ok": True, "result": result, "elapsed_s": round(time.monotonic() - started, 3)
+                })
+                stats["ok"] += 1
+                return True
+            return False
+        except Exception as e:
+            # не удалось опубликовать ответ — сообщение придёт повторно
+            log.warning("%s: reply to %s failed: %s", kind, reply, e)
+            return False
+        finally:
+            stats["inflight"] -= 1
+
+    async def _settle(self, kind: str, msgs: List[Message], done: List[bool]) -> bool:
+        """Коммитит непрерывный успешный префикс каждой партиции; возвращает, был ли откат."""
+        parts: Dict[Tuple[str, int], List[Tuple[int, bool]]] = defaultdict(list)
+        for msg, ok in zip(msgs, done):
+            parts[(msg.topic, msg.partition)].append((msg.offset, ok))
+        rewound = False
+        for (topic, partition), items in parts.items():
+            commit_to = None
+            for offset, ok in sorted(items):
+                if not ok:
+                    await self.broker.rewind(topic, partition, offset)
+                    self.stats[kind]["rewinds"] += 1
+                    rewound = True
+                    break
+                commit_to = offset + 1
+            if commit_to is not None:
+                await self.broker.commit(topic, partition, commit_to)
+        return rewound
+
+    async def _consume(self, kind: str) -> None:
+        topic = ROUTES[kind][0]
+        # всё, что делает воркер, идёт классом batch и уступает интерактивным запросам
+        PRIORITY.set(BATCH)
+        while True:
+            try:
+                n = self._capacity(kind)
+                if n <= 0:
+                    await asyncio.sleep(0.2)
+                    continue
+                msgs = await self.broker.fetch(topic, n, 1.0)
+                if not msgs:
+                    continue
+                done = await asyncio.gather(*(self._process(kind, m) for m in msgs))
+                if await self._settle(kind, msgs, done):
+                    await asyncio.sleep(self.backoff * self.max_attempts)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("%s consumer error: %s", kind, e)
+                await asyncio.sleep(self.backoff)
+
+    async def start(self) -> None:
+        await self.broker.start([ROUTES[k][0] for k in self.kinds])
+        self._tasks = [asyncio.create_task(self._consume(k)) for k in self.kinds]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.broker.stop()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "kinds": {k: ROUTES[k][0] for k in self.kinds},
+            "batch": self.batch,
+            "llm_slots": self.llm_slots,
+            "stats": dict(self.stats),
+        }
+
+
+def make_worker(state: Any) -> Optional[Worker]:
+    broker = make_broker()
+    if broker is None:
+        return None
+    return Worker(broker, state, WORKER_KINDS, batch=WORKER_BATCH, llm_slots=WORKER_LLM_SLOTS,
+                  max_attempts=WORKER_MAX_ATTEMPTS, backoff=WORKER_RETRY_BACKOFF)
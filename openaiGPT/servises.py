@@ -1,18 +1,122 @@
+import asyncio
+import logging
 import os
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import httpx
 import openai
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 120))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", 0.5))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", 30))
+
+log = logging.getLogger("openaiGPT")
+
+# 429 и 5xx, а также сетевые ошибки/таймауты — временные, их имеет смысл повторить
+RETRYABLE = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    ms = response.headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
 
 class OpenAiAPIServise:
-    def __init__(self):
-        self.apikey = OPENAI_API_KEY
-
-    def chat_complete(self, model, messages, **settings):
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **settings
+    """
+    Асинхронный клиент OpenAI, общий на всё приложение (создаётся в lifespan).
+
+    Число одновременных запросов ограничено семафором, соединения переиспользуются пулом
+    httpx. Временные ошибки повторяются с экспоненциальной задержкой и jitter; если апстрим
+    прислал Retry-After, ждём именно столько (но не больше OPENAI_BACKOFF_MAX).
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = OPENAI_API_KEY,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+        max_retries: int = OPENAI_MAX_RETRIES,
+        timeout: float = OPENAI_TIMEOUT,
+    ):
+        self.apikey = api_key
+        self.max_retries = max_retries
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,  # повторы делаем сами, чтобы учитывать Retry-After и лимит попыток
+            timeout=timeout,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_concurrency,
+                                    max_keepalive_connections=max_concurrency),
+            ),
         )
+
+    async def _with_retries(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except RETRYABLE as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = OPENAI_BACKOFF_BASE * 2 ** attempt * (0.5 + random.random())
+                delay = min(delay, OPENAI_BACKOFF_MAX)
+                attempt += 1
+                log.warning("OpenAI call failed (%s), retry %d/%d in %.1fs",
+                            type(e).__name__, attempt, self.max_retries, delay)
+                await asyncio.sleep(delay)
+
+    async def chat_complete(self, model, messages, **settings) -> Dict[str, Any]:
+        settings.pop("stream", None)  # режим задаёт метод, а не параметры
+        async with self._sem:
+            response = await self._with_retries(lambda: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **settings
+            ))
         completion = response.choices[0].message
-        return completion.model_dump()
\ No newline at end of file
+        return completion.model_dump()
+
+    async def chat_complete_stream(self, model, messages, **settings) -> AsyncIterator[Dict[str, Any]]:
+        # слот семафора держится, пока клиент читает стрим; повторяется только открытие стрима
+        settings.pop("stream", None)
+        async with self._sem:
+            stream = await self._with_retries(lambda: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **settings
+            ))
+            try:
+                async for chunk in stream:
+                    yield chunk.model_dump(exclude_none=True)
+            finally:
+                await stream.close()
+
+    async def aclose(self) -> None:
+        await self.client.close()
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from gateway.admission import BATCH, INTERACTIVE, PRIORITY, Gate, admit, parse_key_classes, parse_limits
+
+
+def test_parse_limits_and_key_classes():
+    assert parse_limits("llm=8:32, image=2") == {"llm": (8, 32), "image": (2, 0)}
+    assert parse_key_classes("k1:batch,k2:interactive,bad") == {"k1": BATCH, "k2": INTERACTIVE}
+
+
+def test_acquire_within_limit_and_release():
+    async def main():
+        gate = Gate("g", limit=2, queue=0)
+        a = await gate.acquire()
+        b = await gate.acquire()
+        assert gate.active == 2
+        a.release()
+        a.release()  # повторный release ничего не меняет
+        b.release()
+        assert gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def main():
+        gate = Gate("g", limit=1, queue=0)
+        ticket = await gate.acquire()
+        with pytest.raises(HTTPException) as e:
+            await gate.acquire()
+        assert e.value.status_code == 429
+        assert int(e.value.headers["Retry-After"]) >= 1
+        assert gate.stats["rejected"] == 1
+        ticket.release()
+
+    asyncio.run(main())
+
+
+def test_interactive_served_before_batch():
+    async def main():
+        gate = Gate("g", limit=1, queue=8)
+        held = await gate.acquire(INTERACTIVE)
+        order = []
+
+        async def wait(name, priority):
+            ticket = await gate.acquire(priority)
+            order.append(name)
+            ticket.release()
+
+        tasks = [asyncio.create_task(wait("batch-1", BATCH)), asyncio.create_task(wait("batch-2", BATCH))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(wait("inter-1", INTERACTIVE)), asyncio.create_task(wait("inter-2", INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert gate.waiting == {INTERACTIVE: 2, BATCH: 2}
+        held.release()
+        await asyncio.gather(*tasks)
+        # внутри класса — FIFO, interactive обгоняет batch
+        assert order == ["inter-1", "inter-2", "batch-1", "batch-2"]
+
+    asyncio.run(main())
+
+
+def test_reserve_keeps_slots_for_interactive():
+    async def main():
+        gate = Gate("g", limit=3, queue=4, reserve=1, timeout=0.05)
+        batch = [await gate.acquire(BATCH), await gate.acquire(BATCH)]
+        # третий слот batch не достаётся, interactive проходит сразу
+        with pytest.raises(HTTPException) as e:
+            await gate.acquire(BATCH)
+        assert e.value.status_code == 429
+        assert gate.stats["timeouts"] == 1
+        inter = await asyncio.wait_for(gate.acquire(INTERACTIVE), 0.01)
+        for t in [*batch, inter]:
+            t.release()
+        assert gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_releases_waiting_place():
+    async def main():
+        gate = Gate("g", limit=1, queue=1, timeout=0.02)
+        held = await gate.acquire()
+        with pytest.raises(HTTPException):
+            await gate.acquire()
+        assert gate.waiting[INTERACTIVE] == 0
+        held.release()
+        assert gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def main():
+        gate = Gate("g", limit=1, queue=4)
+        held = await gate.acquire()
+        waiter = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        held.release()
+        assert gate.active == 0
+        assert gate.waiting[INTERACTIVE] == 0
+
+    asyncio.run(main())
+
+
+def test_try_acquire_rejects_when_full():
+    async def main():
+        gate = Gate("g", limit=1, queue=4)
+        held = gate.try_acquire()
+        with pytest.raises(HTTPException):
+            gate.try_acquire()
+        held.release()
+        assert gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_try_acquire_does_not_jump_queue():
+    async def main():
+        gate = Gate("g", limit=2, queue=4, reserve=1)
+        held = gate.try_acquire(INTERACTIVE)
+        # batch упирается в резерв и встаёт в очередь, хотя один слот свободен
+        waiter = asyncio.create_task(gate.acquire(BATCH))
+        await asyncio.sleep(0)
+        assert gate.waiting[BATCH] == 1
+        # свободный слот есть, но в очереди ждут — try_acquire их не обгоняет
+        with pytest.raises(HTTPException):
+            gate.try_acquire(INTERACTIVE)
+        held.release()
+        (await waiter).release()
+        assert gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_priority_from_context_and_admit_helper():
+    async def main():
+        gate = Gate("g", limit=2, queue=4, reserve=1)
+        token = PRIORITY.set(BATCH)
+        try:
+            async with admit(gate):
+                assert gate.active == 1
+                # контекст — batch: последний слот зарезервирован, try_acquire отказывает
+                with pytest.raises(HTTPException):
+                    gate.try_acquire()
+        finally:
+            PRIORITY.reset(token)
+        assert gate.active == 0
+        async with admit(None) as ticket:
+            assert ticket is None
+
+    asyncio.run(main())
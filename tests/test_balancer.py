@@ -0,0 +1,177 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from gateway.balancer import LLMPool, open_node_stream, post_json
+from gateway.resilience import Breakers, HedgePolicy, ResilientTransport
+from gateway.servises.sessions import _post
+from gateway.sessions import SessionStore
+
+A, B = "http://node-a:11434", "http://node-b:11434"
+BODY = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "stream": False}
+
+
+def pool(behaviour, hedge_delay=None, breakers=None):
+    """
+    Пул из двух узлов поверх MockTransport. behaviour: url узла -> (задержка, статус)
+    или исключение. hedge_delay — порог дубля (политика заранее набрана замерами).
+    """
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        url = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+        calls.append(url)
+        action = behaviour[url]
+        if isinstance(action, Exception):
+            raise action
+        delay, status = action
+        await asyncio.sleep(delay)
+        return httpx.Response(status, json={"node": url, "message": {"content": "ok"}})
+
+    transport = httpx.MockTransport(handler)
+    if breakers is not None:
+        transport = ResilientTransport(transport, breakers, {}, retries=0)
+    hedge = None
+    if hedge_delay is not None:
+        hedge = HedgePolicy(quantile=0.5, min_samples=1, budget=1.0, min_delay=hedge_delay)
+        hedge.observe(f"/api/chat:full:{BODY['model']}", hedge_delay)
+        hedge.observe(f"/api/chat:stream:{BODY['model']}", hedge_delay)
+    p = LLMPool([A, B], httpx.AsyncClient(transport=transport), breakers=breakers, hedge=hedge)
+    return p, calls
+
+
+def lease_on(p: LLMPool, url: str):
+    return p.acquire("m", prefer=url)
+
+
+def test_send_returns_first_node_when_fast():
+    async def main():
+        p, calls = pool({A: (0.0, 200), B: (0.0, 200)}, hedge_delay=0.2)
+        lease = lease_on(p, A)
+        r = await post_json(p, lease, "/api/chat", BODY)
+        assert orjson.loads(r.content)["node"] == A
+        assert calls == [A]
+        lease.release()
+        assert [n.inflight for n in p.nodes] == [0, 0]
+
+    asyncio.run(main())
+
+
+def test_send_hedges_slow_request_and_moves_lease():
+    async def main():
+        p, calls = pool({A: (1.0, 200), B: (0.0, 200)}, hedge_delay=0.02)
+        lease = lease_on(p, A)
+        r = await post_json(p, lease, "/api/chat", BODY)
+        assert orjson.loads(r.content)["node"] == B
+        assert calls == [A, B]
+        assert lease.url == B
+        assert p.hedge.stats["hedged"] == 1
+        assert p.hedge.stats["hedge_wins"] == 1
+        lease.release()
+        assert [n.inflight for n in p.nodes] == [0, 0]
+
+    asyncio.run(main())
+
+
+def test_send_without_hedge_waits_for_pinned_node():
+    async def main():
+        p, calls = pool({A: (0.1, 200), B: (0.0, 200)}, hedge_delay=0.01)
+        lease = lease_on(p, A)
+        r = await post_json(p, lease, "/api/chat", BODY, hedge=False)
+        assert orjson.loads(r.content)["node"] == A
+        assert calls == [A]
+        assert p.hedge.stats["hedged"] == 0
+        lease.release()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("failure", [(0.0, 503), httpx.ConnectError("refused")])
+def test_send_fails_over_to_second_node(failure):
+    async def main():
+        p, calls = pool({A: failure, B: (0.0, 200)}, hedge_delay=10.0)
+        lease = lease_on(p, A)
+        r = await post_json(p, lease, "/api/chat", BODY, hedge=False)
+        assert r.status_code == 200
+        assert calls == [A, B]
+        assert lease.url == B
+        assert p.hedge.stats["failovers"] == 1
+        lease.release()
+        assert [n.inflight for n in p.nodes] == [0, 0]
+
+    asyncio.run(main())
+
+
+def test_send_returns_500_without_failover():
+    async def main():
+        p, calls = pool({A: (0.0, 500), B: (0.0, 200)}, hedge_delay=10.0)
+        lease = lease_on(p, A)
+        r = await post_json(p, lease, "/api/chat", BODY, hedge=False)
+        assert r.status_code == 500
+        assert calls == [A]
+        assert p.hedge.stats["failovers"] == 0
+        lease.release()
+        assert [n.inflight for n in p.nodes] == [0, 0]
+
+    asyncio.run(main())
+
+
+def test_send_reports_last_failure_when_all_nodes_fail():
+    async def main():
+        p, _ = pool({A: httpx.ConnectError("refused"), B: httpx.ConnectError("refused")}, hedge_delay=10.0)
+        lease = lease_on(p, A)
+        with pytest.raises(HTTPException) as e:
+            await post_json(p, lease, "/api/chat", BODY)
+        assert e.value.status_code == 502
+        lease.release()
+        assert [n.inflight for n in p.nodes] == [0, 0]
+
+    asyncio.run(main())
+
+
+def test_send_open_breaker_is_503_with_retry_after():
+    async def main():
+        breakers = Breakers(failures=1, cooldown=30)
+        breakers.get(A).failure()
+        breakers.get(B).failure()
+        p, calls = pool({A: (0.0, 200), B: (0.0, 200)}, breakers=breakers)
+        lease = p.acquire("m")
+        with pytest.raises(HTTPException) as e:
+            await post_json(p, lease, "/api/chat", BODY)
+        assert e.value.status_code == 503
+        assert "Retry-After" in e.value.headers
+        assert calls == []
+        lease.release()
+
+    asyncio.run(main())
+
+
+def test_open_node_stream_hedges_on_headers():
+    async def main():
+        p, _ = pool({A: (1.0, 200), B: (0.0, 200)}, hedge_delay=0.02)
+        lease = lease_on(p, A)
+        resp = await open_node_stream(p, lease, "/api/chat", {**BODY, "stream": True})
+        assert orjson.loads(await resp.aread())["node"] == B
+        await resp.aclose()
+        lease.release()
+
+    asyncio.run(main())
+
+
+def test_session_is_pinned_to_node_that_served_the_turn():
+    async def main():
+        p, calls = pool({A: (0.0, 503), B: (0.0, 200)}, hedge_delay=0.01)
+        store = SessionStore()
+        session = store.create("m", None, {})
+        session.node = A
+        result, _ = await _post(store, p, session, "/api/chat", BODY)
+        assert result["node"] == B
+        assert session.node == B
+        assert store.stats["repinned"] == 1
+        assert p.hedge.stats["hedged"] == 0
+        assert [n.inflight for n in p.nodes] == [0, 0]
+
+    asyncio.run(main())
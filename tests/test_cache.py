@@ -0,0 +1,56 @@
+import asyncio
+import os
+
+from gateway.cache import ResponseCache, cache_key, is_cacheable
+
+
+def test_cache_key_ignores_stream_flag():
+    body = {"model": "m", "prompt": "p", "options": {"seed": 1}}
+    assert cache_key("/api/generate", {**body, "stream": True}) == cache_key("/api/generate", body)
+    assert is_cacheable(None, {"temperature": 0})
+    assert not is_cacheable(None, {"temperature": 0.7})
+    assert is_cacheable(True, {})
+
+
+def test_memory_lru_limits():
+    async def main():
+        cache = ResponseCache(max_entries=2)
+        for key in ("a", "b", "c"):
+            await cache.set(key, {"k": key})
+        assert await cache.get("a") is None
+        assert await cache.get("c") == b'{"k":"c"}'
+        assert cache.stats["evictions"] == 1
+
+    asyncio.run(main())
+
+
+def test_disk_tier_keeps_running_total_and_prunes_oldest(tmp_path):
+    async def main():
+        cache = ResponseCache(max_entries=1, disk_dir=str(tmp_path), disk_max_bytes=1000)
+        for i in range(30):
+            await cache.set(f"k{i}", b"x" * 100)
+            os.utime(tmp_path / f"k{i}.json", (i, i))  # порядок по mtime детерминирован
+        files = sorted(os.listdir(tmp_path))
+        assert cache._disk_bytes == sum(os.path.getsize(tmp_path / f) for f in files) <= 1000
+        assert "k29.json" in files and "k0.json" not in files
+        # перезапись того же ключа не раздувает счётчик
+        before = cache._disk_bytes
+        await cache.set("k29", b"y" * 100)
+        assert cache._disk_bytes == before
+        # после рестарта счётчик восстанавливается обходом каталога
+        assert ResponseCache(disk_dir=str(tmp_path), disk_max_bytes=1000)._disk_bytes == before
+        # запись с диска возвращается и поднимается в память
+        assert await ResponseCache(disk_dir=str(tmp_path)).get("k29") == b"y" * 100
+
+    asyncio.run(main())
+
+
+def test_disk_concurrent_writes_of_one_key_do_not_collide(tmp_path):
+    async def main():
+        cache = ResponseCache(max_entries=1, disk_dir=str(tmp_path))
+        values = [bytes([65 + i]) * 100_000 for i in range(16)]
+        await asyncio.gather(*(asyncio.to_thread(cache._disk_put, "k", v) for v in values))
+        assert os.listdir(tmp_path) == ["k.json"]
+        assert (tmp_path / "k.json").read_bytes() in values
+
+    asyncio.run(main())
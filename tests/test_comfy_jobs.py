@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from gateway.admission import Gate
+from gateway.comfy_jobs import ComfyJobRegistry
+
+
+def registry(queue=(), history=None, ttl=3600.0):
+    """Реестр с фейковым ComfyUI: очередь и история задаются аргументами."""
+    ids = iter(range(1000))
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/prompt":
+            return httpx.Response(200, json={"prompt_id": f"p{next(ids)}", "number": 1})
+        if path == "/queue":
+            return httpx.Response(200, json={"queue_running": [[0, pid] for pid in queue], "queue_pending": []})
+        if path.startswith("/history/"):
+            pid = path.rsplit("/", 1)[1]
+            return httpx.Response(200, json={pid: history[pid]} if history and pid in history else {})
+        return httpx.Response(404)
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return ComfyJobRegistry("http://comfy", http, ttl=ttl, gate=Gate("image", 1, 0))
+
+
+def test_slot_is_held_until_job_finishes():
+    async def main():
+        reg = registry()
+        job = await reg.submit({"prompt": {}})
+        with pytest.raises(HTTPException) as e:
+            await reg.submit({"prompt": {}})
+        assert e.value.status_code == 429
+        reg.handle({"type": "execution_success", "data": {"prompt_id": job.id}})
+        assert job.status == "done"
+        assert reg.gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_reconcile_fails_job_missing_from_history_and_queue():
+    async def main():
+        reg = registry()
+        job = await reg.submit({"prompt": {}})
+        await reg._reconcile()
+        assert job.status == "error"
+        assert reg.gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_reconcile_keeps_queued_job_and_finishes_completed_one():
+    async def main():
+        reg = registry(queue=["p0"], history={"p1": {"outputs": {"9": {"images": [{"filename": "a.png"}]}},
+                                                     "status": {"status_str": "success", "completed": True}}})
+        reg.gate = Gate("image", 2, 0)
+        queued = await reg.submit({"prompt": {}})
+        finished = await reg.submit({"prompt": {}})
+        await reg._reconcile()
+        assert queued.status == "queued"
+        assert finished.status == "done"
+        assert finished.images == [{"filename": "a.png"}]
+        assert reg.gate.active == 1
+
+    asyncio.run(main())
+
+
+def test_stuck_job_times_out_and_frees_slot_for_next_submit():
+    async def main():
+        reg = registry(queue=["p0"], ttl=60.0)
+        stuck = await reg.submit({"prompt": {}})
+        stuck.created -= 120
+        nxt = await reg.submit({"prompt": {}})
+        assert stuck.status == "error"
+        assert stuck.error == "timed out"
+        assert nxt.status == "queued"
+
+    asyncio.run(main())
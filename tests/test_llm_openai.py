@@ -0,0 +1,68 @@
+import asyncio
+
+import openai
+from starlette.requests import Request
+
+from gateway.servises.llm_openai import chat_complete
+from gateway.swagger_models import OpenAIChatRequest
+
+PAYLOAD = OpenAIChatRequest(model="m", messages=[{"role": "user", "content": "hi"}], stream=True)
+SSE = Request({"type": "http", "headers": [(b"accept", b"text/event-stream")]})
+
+
+class Service:
+    """Фейковый сервис OpenAI: стрим из заданных чанков, опционально с ошибкой в конце."""
+
+    def __init__(self, chunks, fail=False):
+        self.chunks = chunks
+        self.fail = fail
+        self.closed = False
+
+    async def chat_complete_stream(self, **kwargs):
+        try:
+            for chunk in self.chunks:
+                yield chunk
+            if self.fail:
+                raise openai.APIConnectionError(request=None)
+        finally:
+            self.closed = True
+
+
+async def run(response, send):
+    async def receive():
+        await asyncio.sleep(10)
+
+    try:
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    except Exception:
+        pass
+
+
+def test_sse_error_is_not_followed_by_done():
+    async def main():
+        service = Service([{"id": 1}], fail=True)
+        body = []
+
+        async def send(message):
+            body.append(message.get("body", b""))
+
+        await run(await chat_complete(SSE, service, PAYLOAD), send)
+        text = b"".join(body)
+        assert b"event: error" in text
+        assert b"[DONE]" not in text
+        assert service.closed
+
+    asyncio.run(main())
+
+
+def test_stream_is_closed_when_client_leaves_before_body():
+    async def main():
+        service = Service([{"id": 1}, {"id": 2}])
+
+        async def send(message):
+            raise OSError("client gone")
+
+        await run(await chat_complete(SSE, service, PAYLOAD), send)
+        assert service.closed
+
+    asyncio.run(main())
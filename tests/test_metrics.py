@@ -0,0 +1,25 @@
+import asyncio
+
+import httpx
+import pytest
+
+from gateway.metrics import UPSTREAM_INFLIGHT, InstrumentedTransport
+
+
+def test_upstream_inflight_returns_to_zero_when_request_is_cancelled():
+    async def main():
+        async def handler(request):
+            await asyncio.sleep(10)
+
+        transport = InstrumentedTransport({"http://slow:1": "slow"}, httpx.MockTransport(handler))
+        gauge = UPSTREAM_INFLIGHT.labels("slow")
+        async with httpx.AsyncClient(transport=transport) as client:
+            task = asyncio.create_task(client.get("http://slow:1/x"))
+            await asyncio.sleep(0.01)
+            assert gauge._value.get() == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        assert gauge._value.get() == 0
+
+    asyncio.run(main())
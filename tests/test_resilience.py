@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from gateway.resilience import BackendUnavailable, Breaker, Breakers, HedgePolicy, ResilientTransport, origin
+
+
+def test_breaker_opens_after_consecutive_failures():
+    b = Breaker(failures=3, cooldown=30)
+    assert not b.failure()
+    b.success()  # успех сбрасывает счётчик
+    assert not b.failure()
+    assert not b.failure()
+    assert b.failure()
+    assert b.state == "open"
+    assert not b.allow()
+    assert b.stats == {"opened": 1, "rejected": 1}
+    assert 0 < b.retry_after() <= 30
+
+
+def test_breaker_half_open_lets_one_probe_through():
+    b = Breaker(failures=1, cooldown=30)
+    b.failure()
+    b.opened_at = time.monotonic() - 31
+    assert not b.is_open()
+    assert b.allow()
+    assert b.state == "half_open"
+    assert not b.allow()  # пока проба не вернулась, остальные отклоняются
+    b.success()
+    assert b.state == "closed"
+    assert b.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    b = Breaker(failures=5, cooldown=30)
+    for _ in range(5):
+        b.failure()
+    b.opened_at = time.monotonic() - 31
+    assert b.allow()
+    assert b.failure()  # одна неудачная проба размыкает снова
+    assert b.state == "open"
+    assert b.stats["opened"] == 2
+
+
+def test_breaker_abandoned_probe_frees_probe_slot():
+    b = Breaker(failures=1, cooldown=30)
+    b.failure()
+    b.opened_at = time.monotonic() - 31
+    assert b.allow()
+    b.abandon()
+    assert b.allow()
+
+
+def test_breakers_are_per_origin():
+    breakers = Breakers(failures=1)
+    breakers.get("http://a:1/x").failure()
+    assert breakers.is_open("http://a:1/other")
+    assert not breakers.is_open("http://b:1/x")
+    assert origin("https://a/x") == "a:443"
+
+
+def transport(statuses, breakers, retries=2):
+    """ResilientTransport поверх MockTransport, отвечающего статусами по очереди."""
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status)
+
+    rt = ResilientTransport(httpx.MockTransport(handler), breakers, {}, retries=retries, backoff=0.001)
+    return httpx.AsyncClient(transport=rt), calls
+
+
+def test_transport_retries_idempotent_and_counts_failures():
+    async def main():
+        breakers = Breakers(failures=5)
+        client, calls = transport([503, 502, 200], breakers)
+        r = await client.get("http://a:1/x")
+        assert r.status_code == 200
+        assert len(calls) == 3
+        assert breakers.get("http://a:1").fails == 0
+
+        # POST без пометки IDEMPOTENT не повторяется
+        client, calls = transport([503, 200], breakers)
+        r = await client.post("http://a:1/x")
+        assert r.status_code == 503
+        assert len(calls) == 1
+
+    asyncio.run(main())
+
+
+def test_transport_500_is_not_a_breaker_failure():
+    async def main():
+        breakers = Breakers(failures=1)
+        client, _ = transport([500], breakers)
+        r = await client.post("http://a:1/x")
+        assert r.status_code == 500
+        assert breakers.get("http://a:1").state == "closed"
+
+    asyncio.run(main())
+
+
+def test_transport_open_breaker_fails_fast():
+    async def main():
+        breakers = Breakers(failures=1, cooldown=30)
+        client, calls = transport([httpx.ConnectError("refused")], breakers, retries=0)
+        with pytest.raises(httpx.ConnectError):
+            await client.get("http://a:1/x")
+        with pytest.raises(BackendUnavailable) as e:
+            await client.get("http://a:1/x")
+        assert e.value.retry_after > 0
+        assert len(calls) == 1
+
+    asyncio.run(main())
+
+
+def test_hedge_policy_delay_needs_samples_and_respects_budget():
+    policy = HedgePolicy(quantile=0.5, min_samples=3, budget=0.5, min_delay=0.01)
+    assert policy.delay("k") is None
+    for s in (0.1, 0.2, 0.3):
+        policy.observe("k", s)
+    assert policy.delay("k") == pytest.approx(0.2)
+    policy.stats["hedged"] = policy.stats["requests"]  # бюджет исчерпан
+    assert policy.delay("k") is None
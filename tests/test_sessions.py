@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+from starlette.requests import Request
+
+from gateway.balancer import LLMPool
+from gateway.servises.sessions import _chat_done, _turn
+from gateway.sessions import SessionStore
+
+NODE = "http://node-a:11434"
+
+
+def test_stream_turn_unlocks_and_rolls_back_when_client_leaves_before_body():
+    async def main():
+        closed = []
+
+        class Body(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                yield b'{"message": {"content": "hi"}, "done": true}\n'
+
+            async def aclose(self):
+                closed.append(True)
+
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=Body()))
+        pool = LLMPool([NODE], httpx.AsyncClient(transport=transport))
+        store = SessionStore()
+        session = store.create("m", None, {})
+        await session.lock.acquire()
+        session.messages.append({"role": "user", "content": "q"})
+        body = {"model": "m", "messages": session.messages, "stream": True}
+        request = Request({"type": "http", "headers": []})
+        response = await _turn(request, store, pool, session, "/api/chat", body, _chat_done(store, session), "message")
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            raise OSError("client gone")
+
+        try:
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        except Exception:
+            pass
+        assert not session.lock.locked()
+        assert session.messages == []
+        assert closed == [True]
+        assert [n.inflight for n in pool.nodes] == [0]
+
+    asyncio.run(main())
@@ -0,0 +1,245 @@
+import asyncio
+
+import pytest
+
+from gateway.singleflight import SingleFlight
+
+
+def source(chunks, produced=None, closed=None, open_delay=0.0):
+    """open_source для SingleFlight.stream: отдаёт chunks, отмечает прочитанное и закрытие."""
+    async def open_source():
+        async def gen():
+            try:
+                for chunk in chunks:
+                    if produced is not None:
+                        produced.append(chunk)
+                    yield chunk
+                    await asyncio.sleep(0)
+            finally:
+                if closed is not None:
+                    closed.append(True)
+
+        await asyncio.sleep(open_delay)
+        return gen()
+
+    return open_source
+
+
+async def read(it, pause=0.0):
+    out = []
+    async for chunk in it:
+        out.append(chunk)
+        if pause:
+            await asyncio.sleep(pause)
+    return out
+
+
+def test_do_coalesces_identical_calls():
+    async def main():
+        sf = SingleFlight(["r"])
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(sf.do("r", "k", fn) for _ in range(5)))
+        assert results == [1] * 5
+        assert calls == 1
+        assert sf.stats["r"] == {"leaders": 1, "coalesced": 4}
+        # после завершения ключ свободен: это не кэш
+        assert await sf.do("r", "k", fn) == 2
+
+    asyncio.run(main())
+
+
+def test_do_disabled_route_calls_every_time():
+    async def main():
+        sf = SingleFlight([])
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            return len(calls)
+
+        await asyncio.gather(sf.do("r", "k", fn), sf.do("r", "k", fn))
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_do_cancels_shared_call_when_last_waiter_leaves():
+    async def main():
+        sf = SingleFlight(["r"])
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def fn():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        a = asyncio.create_task(sf.do("r", "k", fn))
+        b = asyncio.create_task(sf.do("r", "k", fn))
+        await started.wait()
+        a.cancel()
+        await asyncio.sleep(0)
+        assert not cancelled.is_set()  # второй клиент ещё ждёт
+        b.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(main())
+
+
+def test_do_propagates_errors_to_all_waiters():
+    async def main():
+        sf = SingleFlight(["r"])
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(sf.do("r", "k", fn), sf.do("r", "k", fn), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+    asyncio.run(main())
+
+
+def test_stream_shares_one_upstream():
+    async def main():
+        sf = SingleFlight(["r"])
+        chunks = [b"%d" % i for i in range(50)]
+        produced = []
+        a = await sf.stream("r", "k", source(chunks, produced, open_delay=0.01))
+        b = await sf.stream("r", "k", source(chunks, produced))
+        ra, rb = await asyncio.gather(read(a), read(b))
+        assert ra == rb == chunks
+        assert produced == chunks
+        assert sf.stats["r"] == {"leaders": 1, "coalesced": 1}
+
+    asyncio.run(main())
+
+
+def test_stream_pump_waits_for_slowest_subscriber():
+    async def main():
+        sf = SingleFlight(["r"], stream_buffer=4)
+        chunks = [b"%d" % i for i in range(20)]
+        produced = []
+        fast = await sf.stream("r", "k", source(chunks, produced))
+        slow = await sf.stream("r", "k", source(chunks))
+        fast_task = asyncio.create_task(read(fast))
+        await asyncio.sleep(0.05)
+        # второй подписчик ничего не читал: апстрим встал, прочитав не больше окна
+        assert len(produced) <= 4 + 1
+        assert not fast_task.done()
+        assert await read(slow) == chunks
+        assert await fast_task == chunks
+
+    asyncio.run(main())
+
+
+def test_stream_late_joiner_past_buffer_gets_own_upstream():
+    async def main():
+        sf = SingleFlight(["r"], stream_buffer=4)
+        chunks = [b"%d" % i for i in range(20)]
+        produced = []
+        first = await sf.stream("r", "k", source(chunks, produced))
+        first_task = asyncio.create_task(read(first, pause=0.001))
+        await asyncio.sleep(0.02)
+        late = await sf.stream("r", "k", source(chunks, produced))
+        assert await read(late) == chunks
+        assert await first_task == chunks
+        assert sf.stats["r"] == {"leaders": 2, "coalesced": 0}
+        assert len(produced) == 2 * len(chunks)
+
+    asyncio.run(main())
+
+
+def test_stream_closes_upstream_when_all_subscribers_leave():
+    async def main():
+        sf = SingleFlight(["r"])
+        closed = []
+        a = await sf.stream("r", "k", source([b"x"] * 1000, closed=closed))
+        async for _ in a:
+            break
+        await a.aclose()
+        await asyncio.sleep(0.01)
+        assert closed == [True]
+        assert not sf._streams
+
+    asyncio.run(main())
+
+
+def test_stream_cancelled_waiters_cancel_opening_upstream():
+    async def main():
+        sf = SingleFlight(["r"])
+        opening = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def open_source():
+            opening.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        a = asyncio.create_task(sf.stream("r", "k", open_source))
+        b = asyncio.create_task(sf.stream("r", "k", open_source))
+        await opening.wait()
+        a.cancel()
+        b.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        assert not sf._streams
+
+    asyncio.run(main())
+
+
+def test_stream_open_error_reaches_every_waiter():
+    async def main():
+        sf = SingleFlight(["r"])
+
+        async def open_source():
+            await asyncio.sleep(0.01)
+            raise ConnectionError("down")
+
+        results = await asyncio.gather(sf.stream("r", "k", open_source), sf.stream("r", "k", open_source),
+                                       return_exceptions=True)
+        assert all(isinstance(r, ConnectionError) for r in results)
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("buffer", [1, 3, 256])
+def test_stream_buffer_sizes_deliver_everything(buffer):
+    async def main():
+        sf = SingleFlight(["r"], stream_buffer=buffer)
+        chunks = [b"%d" % i for i in range(30)]
+        its = [await sf.stream("r", "k", source(chunks, open_delay=0.01)) for _ in range(3)]
+        results = await asyncio.gather(*(read(it, pause=0.0005 * i) for i, it in enumerate(its)))
+        assert all(r == chunks for r in results)
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("routes", [["r"], []])
+def test_stream_unread_subscription_releases_upstream_on_close(routes):
+    async def main():
+        sf = SingleFlight(routes, stream_buffer=2)
+        closed = []
+        a = await sf.stream("r", "k", source([b"x"] * 1000, closed=closed))
+        await asyncio.sleep(0.01)
+        # клиент ушёл, не прочитав ни чанка: finally итератора не выполнялся бы
+        await a.aclose()
+        await asyncio.sleep(0.01)
+        assert a.fanout.subscribers == 0
+        assert closed == [True]
+        assert not sf._streams
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from gateway.streaming import stream_response
+
+
+async def disconnect_before_body(response):
+    """Прогоняет ответ как ASGI-приложение; клиент отваливается на отправке заголовков."""
+    async def receive():
+        await asyncio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client gone")
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}, "method": "GET", "path": "/"}
+    try:
+        await response(scope, receive, send)
+    except Exception:
+        pass
+
+
+@pytest.mark.parametrize("sse", [False, True])
+def test_stream_response_closes_unstarted_chunks_on_disconnect(sse):
+    async def main():
+        events = []
+
+        class Chunks:
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                events.append("read")
+                return b'{"done": true}\n'
+
+            async def aclose(self):
+                events.append("chunks closed")
+
+        async def close():
+            events.append("close")
+
+        await disconnect_before_body(stream_response(Chunks(), sse, close=close))
+        assert events == ["chunks closed", "close"]
+
+    asyncio.run(main())
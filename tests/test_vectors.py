@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from gateway.vectors import Collection, VectorStore
+
+RNG = np.random.default_rng(0)
+
+
+def vectors(n, dim=8):
+    return RNG.standard_normal((n, dim)).astype(np.float32)
+
+
+@pytest.fixture(params=["memory", "disk"])
+def collection(request, tmp_path):
+    if request.param == "memory":
+        return Collection("c", "m")
+    return VectorStore(str(tmp_path)).create("c", "m")
+
+
+def test_add_and_search_finds_exact_vector(collection):
+    vecs = vectors(100)
+    ids, fresh = collection.add([f"id{i}" for i in range(100)], vecs, [f"t{i}" for i in range(100)], [None] * 100)
+    assert fresh == 100
+    assert collection.count == 100
+    hits = collection.search(vecs[[7, 42]], k=3)
+    assert [h[0]["id"] for h in hits] == ["id7", "id42"]
+    assert hits[0][0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert hits[0][0]["text"] == "t7"
+
+
+def test_add_replaces_by_id_and_generates_missing_ids(collection):
+    collection.add(["a", "b"], vectors(2), ["a", "b"], [None, None])
+    new = vectors(1)
+    ids, fresh = collection.add(["b", None], np.vstack([new, vectors(1)]), ["b2", "x"], [{"v": 2}, None])
+    assert fresh == 1
+    assert ids[0] == "b" and ids[1]
+    assert collection.count == 3
+    hit = collection.search(new, k=1)[0][0]
+    assert (hit["id"], hit["text"], hit["metadata"]) == ("b", "b2", {"v": 2})
+
+
+def test_dimension_mismatch_is_422(collection):
+    collection.add(["a"], vectors(1, dim=8), [None], [None])
+    with pytest.raises(HTTPException) as e:
+        collection.add(["b"], vectors(1, dim=4), [None], [None])
+    assert e.value.status_code == 422
+
+
+def test_open_round_trips_rows_and_metadata(tmp_path):
+    store = VectorStore(str(tmp_path))
+    col = store.create("docs", "embed-model")
+    first, second = vectors(50), vectors(30)
+    col.add([f"id{i}" for i in range(50)], first, [f"t{i}" for i in range(50)], [{"i": i} for i in range(50)])
+    col.add([f"id{i}" for i in range(40, 70)], second, [f"u{i}" for i in range(40, 70)], [None] * 30)
+
+    reopened = VectorStore(str(tmp_path)).get("docs")
+    assert (reopened.model, reopened.dim, reopened.count) == ("embed-model", 8, 70)
+    assert reopened.ids == col.ids
+    assert reopened.texts == col.texts
+    assert reopened.metadata == col.metadata
+    np.testing.assert_allclose(np.asarray(reopened.matrix), np.asarray(col.matrix), rtol=1e-6)
+    # замена из второго add пережила перезапуск
+    assert reopened.search(second[:1], k=1)[0][0]["id"] == "id40"
+
+
+def test_open_ignores_unfinished_tail(tmp_path):
+    store = VectorStore(str(tmp_path))
+    col = store.create("docs", "m")
+    col.add(["a", "b"], vectors(2), [None, None], [None, None])
+    # сбой посреди add: строки и items дописаны, meta.json не обновлён
+    with open(col._file("vectors.f32"), "ab") as f:
+        f.write(vectors(1).tobytes())
+    with open(col._file("items.jsonl"), "ab") as f:
+        f.write(b'{"row": 2, "id": "c"}\n{"row": 3, "id"')
+
+    reopened = Collection.open(col.path)
+    assert reopened.count == 2
+    assert reopened.ids == ["a", "b"]
+    assert "c" not in reopened.index
+
+
+def test_store_names_and_delete(tmp_path):
+    store = VectorStore(str(tmp_path), max_collections=1)
+    with pytest.raises(HTTPException) as e:
+        store.create("bad name", "m")
+    assert e.value.status_code == 422
+    store.create("one", "m")
+    with pytest.raises(HTTPException) as e:
+        store.create("two", "m")
+    assert e.value.status_code == 409
+    store.delete("one")
+    assert not (tmp_path / "one").exists()
+    assert VectorStore(str(tmp_path)).collections == {}
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from gateway import worker
+
+
+@pytest.mark.parametrize("url, allowed", [
+    ("https://files.example.com/a.wav", True),
+    ("http://minio:9000/bucket/a.wav", True),
+    ("http://minio:9001/bucket/a.wav", False),
+    ("http://169.254.169.254/latest/meta-data", False),
+    ("file:///etc/passwd", False),
+    ("ftp://files.example.com/a.wav", False),
+])
+def test_audio_url_must_be_on_allowed_host(monkeypatch, url, allowed):
+    monkeypatch.setattr(worker, "WORKER_AUDIO_HOSTS", {"files.example.com", "minio:9000"})
+    if allowed:
+        worker.check_audio_url(url)
+    else:
+        with pytest.raises(HTTPException) as e:
+            worker.check_audio_url(url)
+        assert e.value.status_code == 422
+
+
+def test_img_gives_up_after_timeout_with_non_transient_error(monkeypatch):
+    async def main():
+        job = SimpleNamespace(status="running")
+
+        async def wait_change(timeout):
+            await asyncio.sleep(timeout)
+            return False
+
+        job.wait_change = wait_change
+        registry = SimpleNamespace(find_active=lambda key: job)
+        monkeypatch.setattr(worker, "WORKER_IMG_TIMEOUT", 0.05)
+        with pytest.raises(HTTPException) as e:
+            await asyncio.wait_for(worker.handle_img(SimpleNamespace(comfy=registry), {"text": "cat"}), 1)
+        assert not worker.is_transient(e.value)
+
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from gateway.admission import Gate, admit
+from gateway.servises import xtts
+
+
+@pytest.fixture
+def sentences(monkeypatch):
+    """Подменяет синтез предложения: держит слот gate, «bad» падает; возвращает счётчики."""
+    seen = {"active": 0, "peak": 0, "started": 0}
+
+    async def fake_sentence(http, sf, cache, gate, payload, sentence):
+        seen["started"] += 1
+        async with admit(gate):
+            seen["active"] += 1
+            seen["peak"] = max(seen["peak"], seen["active"])
+            try:
+                await asyncio.sleep(0.05 if sentence == "slow" else 0.005)
+            finally:
+                seen["active"] -= 1
+        if sentence == "bad":
+            raise RuntimeError("synthesis failed")
+        return 24000, b"\x00\x00", False
+
+    monkeypatch.setattr(xtts, "_sentence", fake_sentence)
+    monkeypatch.setattr(xtts, "split_sentences", lambda text: text.split("|"))
+    return seen
+
+
+def test_sentence_fan_out_is_bounded_by_gate(sentences):
+    async def main():
+        gate = Gate("tts", limit=2, queue=16)
+        audio, media, hits = await xtts.synthesize(None, None, object(), gate, {"text": "|".join(["s"] * 40)})
+        assert media == "audio/wav"
+        assert hits == "0/40"
+        assert sentences["peak"] <= 2
+        assert gate.stats["rejected"] == 0
+
+    asyncio.run(main())
+
+
+def test_failed_sentence_cancels_the_rest(sentences):
+    async def main():
+        gate = Gate("tts", limit=2, queue=16)
+        with pytest.raises(RuntimeError):
+            await xtts.synthesize(None, None, object(), gate, {"text": "|".join(["bad"] + ["slow"] * 20)})
+        assert sentences["started"] < 21
+        assert gate.active == 0
+
+    asyncio.run(main())
+
+
+def test_sentence_fan_out_without_gate_uses_setting(sentences, monkeypatch):
+    async def main():
+        monkeypatch.setattr(xtts, "TTS_SENTENCE_CONCURRENCY", 3)
+        audio, media, hits = await xtts.synthesize(None, None, object(), None, {"text": "|".join(["s"] * 40)})
+        assert hits == "0/40"
+        assert sentences["peak"] <= 3
+
+    asyncio.run(main())
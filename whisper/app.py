@@ -1,28 +1,96 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import UploadFile
 from faster_whisper import WhisperModel
-import tempfile, os, logging
+import asyncio, json, logging, os, threading, time
+import av
+import numpy as np
+
+from batching import SAMPLE_RATE, BatchTranscriber, Scheduler
+from chunking import Chunk, collect, detect_language, plan_chunks, transcribe_chunks
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("whisper")
 
-app = FastAPI()
 _model = None
+_model_lock = threading.Lock()
 _model_name = os.getenv("WHISPER_MODEL", "small")
 _compute = os.getenv("WHISPER_COMPUTE", "int8_float16")
+# параллельные инференсы (потоки пула = num_workers CTranslate2) и окно микробатчинга
+_workers = int(os.getenv("WHISPER_WORKERS", 2))
+_batch_max = int(os.getenv("WHISPER_BATCH_MAX", 8))
+_batch_wait = float(os.getenv("WHISPER_BATCH_WAIT_MS", 50)) / 1000
+_batch_size = int(os.getenv("WHISPER_BATCH_SIZE", 8))
+# длинное аудио режется по паузам на куски с перекрытием, куски распознаются параллельно
+_long_min = float(os.getenv("WHISPER_LONG_MIN_S", 120))
+_chunk_s = float(os.getenv("WHISPER_CHUNK_S", 60))
+_chunk_overlap = float(os.getenv("WHISPER_CHUNK_OVERLAP_S", 1.0))
+_chunk_search = float(os.getenv("WHISPER_CHUNK_SEARCH_S", 10))
+_chunk_parallel = int(os.getenv("WHISPER_CHUNK_PARALLEL", _workers * _batch_max))
+_max_bytes = int(os.getenv("WHISPER_MAX_MB", 512)) * 1024 * 1024
+# дорожка декодируется в память целиком (float32, ~230 МБ на час): длиннее — 413
+_max_duration = float(os.getenv("WHISPER_MAX_DURATION_S", 4 * 3600))
+_allowed_ext = {e.strip().lower() for e in os.getenv(
+    "WHISPER_ALLOWED_EXT", ".wav,.mp3,.m4a,.ogg,.oga,.opus,.flac,.webm,.mp4,.aac,.wma,.mkv"
+).split(",") if e.strip()}
+
+# прогрев при старте: загрузка модели и пробная расшифровка секунды тишины
+_warmup = os.getenv("WHISPER_WARMUP", "1") == "1"
+_ready = {"ready": False, "load_s": None, "warmup_s": None, "error": None}
 
 def get_model():
     global _model
-    if _model is not None:
+    with _model_lock:
+        if _model is not None:
+            return _model
+        try:
+            log.info(f"Loading Whisper model={_model_name} device=cuda compute={_compute}")
+            _model = WhisperModel(_model_name, device="cuda", compute_type=_compute, num_workers=_workers)
+            log.info("Whisper loaded on CUDA")
+        except Exception as e:
+            log.warning(f"CUDA load failed: {e}. Falling back to CPU (compute=int8).")
+            _model = WhisperModel(_model_name, device="cpu", compute_type="int8", num_workers=_workers)
         return _model
+
+def _load():
+    t0 = time.perf_counter()
+    model = get_model()
+    _ready["load_s"] = round(time.perf_counter() - t0, 3)
+    if _warmup:
+        t0 = time.perf_counter()
+        segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), language="ru", beam_size=1)
+        list(segments)
+        _ready["warmup_s"] = round(time.perf_counter() - t0, 3)
+
+async def _warm_up():
     try:
-        log.info(f"Loading Whisper model={_model_name} device=cuda compute={_compute}")
-        _model = WhisperModel(_model_name, device="cuda", compute_type=_compute)
-        log.info("Whisper loaded on CUDA")
+        await asyncio.to_thread(_load)
     except Exception as e:
-        log.warning(f"CUDA load failed: {e}. Falling back to CPU (compute=int8).")
-        _model = WhisperModel(_model_name, device="cpu", compute_type="int8")
-    return _model
+        _ready["error"] = str(e)
+        log.exception("Whisper warm-up failed")
+        return
+    _ready["ready"] = True
+    log.info("Whisper ready: load %ss, warm-up %ss", _ready["load_s"], _ready["warmup_s"])
+
+_scheduler: Scheduler | None = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _scheduler
+    transcriber = BatchTranscriber(get_model, batch_size=_batch_size)
+    _scheduler = Scheduler(transcriber, transcriber.group_key,
+                           workers=_workers, max_batch=_batch_max, max_wait=_batch_wait)
+    _scheduler.start()
+    # сервер принимает /health сразу, а /ready отвечает 200 только после прогрева
+    warm = asyncio.create_task(_warm_up())
+    try:
+        yield
+    finally:
+        warm.cancel()
+        await _scheduler.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 def health():
@@ -30,19 +98,117 @@ def health():
         m = get_model()
         # простая проверка входного устройства
         dev = getattr(getattr(m, "model", None), "device", "unknown")
-        return {"status": "ok", "model": _model_name, "compute": _compute, "device": str(dev)}
+        return {"status": "ok", "model": _model_name, "compute": _compute, "device": str(dev),
+                "scheduler": _scheduler.snapshot() if _scheduler else None}
     except Exception as e:
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
+@app.get("/ready")
+def ready():
+    return JSONResponse(_ready, status_code=200 if _ready["ready"] else 503)
+
+def _check_length(request: Request) -> None:
+    # размер проверяем до чтения тела, по Content-Length (gateway шлёт его всегда, сервер не даст
+    # прислать больше заявленного). Обрыв посреди разбора multipart оставил бы открытыми
+    # временные файлы, в которые парсер уже спулит загрузку
+    length = request.headers.get("content-length")
+    if not (length and length.isdigit()):
+        raise HTTPException(411, "Content-Length is required")
+    if int(length) > _max_bytes:
+        raise HTTPException(413, f"Upload exceeds {_max_bytes} bytes")
+
+
+def _decode(file) -> np.ndarray:
+    """
+    Как decode_audio из faster-whisper (моно 16 кГц), но с пределом длительности: файл, у которого
+    в заголовке длиннее _max_duration, отклоняется сразу, без заголовка — как только декодировано больше.
+    Кадры пишутся сразу в один float32-буфер под длительность из заголовка (4 байта на отсчёт),
+    а не копятся списком для склейки в конце.
+    """
+    limit = int(_max_duration * SAMPLE_RATE)
+    too_long = HTTPException(413, f"Audio is longer than {_max_duration:.0f}s")
+    resampler = av.audio.resampler.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+    with av.open(file, mode="r", metadata_errors="ignore") as container:
+        duration = container.duration / av.time_base if container.duration else None
+        if duration and duration > _max_duration:
+            raise too_long
+        # длительность в заголовке приблизительная: небольшой запас, дальше буфер растёт
+        audio = np.empty(min(limit, int((duration or 60) * SAMPLE_RATE * 1.01) + SAMPLE_RATE), dtype=np.float32)
+        total = 0
+        frames = container.decode(audio=0)
+        while True:
+            try:
+                frame = next(frames)
+            except StopIteration:
+                frame = None
+            except av.error.InvalidDataError:
+                continue  # битый кадр пропускаем, как faster-whisper
+            for out in resampler.resample(frame):
+                pcm = out.to_ndarray().reshape(-1)
+                if total + len(pcm) > limit:
+                    raise too_long
+                if total + len(pcm) > len(audio):
+                    audio.resize(min(limit, max(total + len(pcm), len(audio) * 2)), refcheck=False)
+                audio[total:total + len(pcm)] = pcm
+                total += len(pcm)
+            if frame is None:
+                break
+    audio.resize(total, refcheck=False)
+    audio *= 1 / 32768.0
+    return audio
+
+def _plan(audio: np.ndarray) -> list[Chunk]:
+    if len(audio) < _long_min * SAMPLE_RATE:
+        return [Chunk(0, 0, len(audio), 0, len(audio))]
+    return plan_chunks(audio, _chunk_s, _chunk_overlap, _chunk_search)
+
+async def _ndjson(events):
+    try:
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False).encode() + b"\n"
+    except Exception as e:
+        # заголовки уже ушли — ошибку отдаём последней строкой стрима; ключ error gateway
+        # отдаёт в SSE событием error
+        log.exception("chunked transcription failed")
+        yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False).encode() + b"\n"
+
 @app.post("/transcribe")
-async def transcribe(file: UploadFile = File(...), language: str = Form(None)):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file.filename) as tmp:
-        tmp.write(await file.read())
-        path = tmp.name
+async def transcribe(request: Request):
+    # multipart парсер Starlette спулит файл на диск (в памяти не больше 1 МБ),
+    # оттуда дорожка декодируется в потоке, не блокируя event loop
+    _check_length(request)
+    form = await request.form(max_files=1, max_fields=8)
     try:
-        segments, info = get_model().transcribe(path, language=language)
-        text = "".join(s.text for s in segments)
-        return {"text": text, "language": getattr(info, "language", language)}
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(422, "Field 'file' is required")
+        ext = os.path.splitext(file.filename or "")[1].lower()
+        ctype = (file.content_type or "").split(";")[0]
+        if ext not in _allowed_ext and not ctype.startswith(("audio/", "video/")):
+            raise HTTPException(415, f"Unsupported file type: {file.filename}")
+        task = form.get("task") or "transcribe"
+        if task not in ("transcribe", "translate"):
+            raise HTTPException(422, "Field 'task' must be 'transcribe' or 'translate'")
+        language = form.get("language") or None
+        stream = (form.get("stream") or "").lower() in ("1", "true", "yes")
+        try:
+            audio = await asyncio.to_thread(_decode, file.file)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(422, f"Cannot decode audio: {e}")
     finally:
-        try: os.remove(path)
-        except: pass
+        await form.close()
+
+    chunks = await asyncio.to_thread(_plan, audio)
+    if len(chunks) == 1 and not stream:
+        return await _scheduler.submit(audio, language, task)
+    if len(chunks) > 1 and not language:
+        # язык определяется один раз на весь файл: куски с известным языком склеиваются в батчи
+        language = await asyncio.to_thread(detect_language, get_model(), audio)
+    log.info("transcribing %.1fs of audio in %d chunks", len(audio) / SAMPLE_RATE, len(chunks))
+    events = transcribe_chunks(_scheduler.submit, audio, chunks, language, task, _chunk_parallel)
+    if stream:
+        return StreamingResponse(_ndjson(events), media_type="application/x-ndjson",
+                                 headers={"X-Accel-Buffering": "no"})
+    return await collect(events)
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+try:  # faster-whisper >= 1.1
+    from faster_whisper import BatchedInferencePipeline
+    from faster_whisper.vad import VadOptions, get_speech_timestamps, merge_segments
+except ImportError:
+    BatchedInferencePipeline = None
+
+log = logging.getLogger("whisper.batching")
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class Job:
+    audio: np.ndarray  # дорожка 16 кГц
+    language: Optional[str]
+    task: str
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+def _result(segments, language: Optional[str], duration: float, offset: float = 0.0) -> Dict[str, Any]:
+    segs = [{"start": round(s.start - offset, 3), "end": round(s.end - offset, 3), "text": s.text} for s in segments]
+    return {
+        "text": "".join(s["text"] for s in segs),
+        "language": language,
+        "duration": round(duration, 3),
+        "segments": segs,
+    }
+
+
+class BatchTranscriber:
+    """
+    Выполняет группу совместимых задач (один язык и task) одним батчевым проходом.
+
+    Аудио всех задач группы склеивается в одну дорожку, для каждого файла отдельно
+    считается VAD и нарезка на окна до 30 с (clip_timestamps), и все окна уходят в
+    BatchedInferencePipeline вместе — батч набирается из окон разных файлов. Сегменты
+    раскладываются обратно по файлам по смещению. Без языка (нужна детекция по файлу)
+    и на faster-whisper без батчевого пайплайна задачи идут по одной.
+    """
+
+    def __init__(self, get_model: Callable[[], Any], batch_size: int = 8):
+        self.get_model = get_model
+        self.batch_size = batch_size
+        self._pipeline = None
+
+    def group_key(self, job: Job) -> Any:
+        # склеивать в один проход можно только задачи с известным языком и при наличии пайплайна
+        if job.language and BatchedInferencePipeline is not None and self.batch_size > 1:
+            return job.language, job.task
+        return id(job)
+
+    def pipeline(self):
+        if self._pipeline is None and BatchedInferencePipeline is not None and self.batch_size > 1:
+            self._pipeline = BatchedInferencePipeline(model=self.get_model())
+        return self._pipeline
+
+    def _single(self, job: Job) -> Dict[str, Any]:
+        pipe = self.pipeline()
+        if pipe is not None:
+            segments, info = pipe.transcribe(job.audio, language=job.language, task=job.task,
+                                             batch_size=self.batch_size)
+        else:
+            segments, info = self.get_model().transcribe(job.audio, language=job.language, task=job.task)
+        segments = list(segments)  # генератор ленивый — декодирование идёт здесь, в воркере
+        return _result(segments, getattr(info, "language", job.language), getattr(info, "duration", 0.0))
+
+    def _batched(self, jobs: List[Job]) -> List[Any]:
+        pipe = self.pipeline()
+        vad = VadOptions(max_speech_duration_s=30, min_silence_duration_ms=160)
+        audios, clips, bounds = [], [], []
+        offset = 0
+        for job in jobs:
+            audio = job.audio
+            for clip in merge_segments(get_speech_timestamps(audio, vad), vad):
+                clips.append({"start": clip["start"] + offset, "end": clip["end"] + offset})
+            audios.append(audio)
+            bounds.append((offset, offset + len(audio)))
+            offset += len(audio)
+        if not clips:
+            return [_result([], jobs[0].language, (end - start) / SAMPLE_RATE) for start, end in bounds]
+
+        segments, _ = pipe.transcribe(np.concatenate(audios), language=jobs[0].language, task=jobs[0].task,
+                                      clip_timestamps=clips, batch_size=self.batch_size)
+        per_job: List[list] = [[] for _ in jobs]
+        starts = [start / SAMPLE_RATE for start, _ in bounds]
+        for seg in segments:
+            # окно никогда не пересекает границу файла, так что достаточно начала сегмента
+            idx = max(i for i, s in enumerate(starts) if s <= seg.start + 1e-6)
+            per_job[idx].append(seg)
+        return [
+            _result(per_job[i], jobs[0].language, (end - start) / SAMPLE_RATE, offset=starts[i])
+            for i, (start, end) in enumerate(bounds)
+        ]
+
+    def __call__(self, jobs: List[Job]) -> List[Any]:
+        """Возвращает по результату (dict) или исключению на каждую задачу; вызывается в воркере."""
+        if len(jobs) > 1 and jobs[0].language and self.pipeline() is not None:
+            try:
+                return self._batched(jobs)
+            except Exception as e:
+                log.warning("batched transcription failed (%s), falling back to per-file", e)
+        results: List[Any] = []
+        for job in jobs:
+            try:
+                results.append(self._single(job))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class Scheduler:
+    """
+    Очередь задач распознавания с микробатчингом.
+
+    Первая задача открывает окно max_wait; всё, что пришло за это время (до max_batch),
+    группируется по group_key (язык и task), и каждая группа выполняется в пуле воркеров вне
+    event loop. Одновременно выполняется не больше workers групп.
+    """
+
+    def __init__(self, run_group: Callable[[List[Job]], List[Any]], group_key: Callable[[Job], Any],
+                 workers: int = 1, max_batch: int = 8, max_wait: float = 0.05):
+        self.run_group = run_group
+        self.group_key = group_key
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: "asyncio.Queue[Job]" = asyncio.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self._slots = asyncio.Semaphore(workers)
+        self._task: Optional[asyncio.Task] = None
+        # ссылки на задачи групп: без них event loop держит задачу слабо, и её может собрать GC
+        self._groups: Set[asyncio.Task] = set()
+        self.running = 0
+        self.stats = {"jobs": 0, "batches": 0, "max_batch": 0, "failed": 0, "queue_wait_s": 0.0}
+
+    async def submit(self, audio: np.ndarray, language: Optional[str], task: str = "transcribe") -> Dict[str, Any]:
+        """Ставит задачу в очередь и ждёт результата."""
+        job = Job(audio, language, task, asyncio.get_running_loop().create_future())
+        await self.queue.put(job)
+        return await job.future
+
+    async def _collect(self) -> List[Job]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            left = deadline - loop.time()
+            if left <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), left))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self) -> None:
+        while True:
+            await self._slots.acquire()
+            batch = await self._collect()
+            groups: Dict[Any, List[Job]] = defaultdict(list)
+            for job in batch:
+                groups[self.group_key(job)].append(job)
+            for i, jobs in enumerate(groups.values()):
+                if i:
+                    await self._slots.acquire()
+                task = asyncio.create_task(self._execute(jobs))
+                self._groups.add(task)
+                task.add_done_callback(self._groups.discard)
+
+    async def _execute(self, jobs: List[Job]) -> None:
+        try:
+            # клиент мог отключиться, пока задача стояла в очереди
+            live = [j for j in jobs if not j.future.done()]
+            if not live:
+                return
+            now = time.monotonic()
+            self.stats["jobs"] += len(live)
+            self.stats["batches"] += 1
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(live))
+            self.stats["queue_wait_s"] += sum(now - j.queued_at for j in live)
+            self.running += len(live)
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(self.pool, self.run_group, live)
+            except Exception as e:
+                results = [e] * len(live)
+            finally:
+                self.running -= len(live)
+            for job, res in zip(live, results):
+                if job.future.done():
+                    continue
+                if isinstance(res, Exception):
+                    self.stats["failed"] += 1
+                    job.future.set_exception(res)
+                else:
+                    job.future.set_result(res)
+        finally:
+            self._slots.release()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        tasks = [self._task, *self._groups] if self._task else list(self._groups)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            "queue_depth": self.queue.qsize(),
+            "running": self.running,
+            "workers": self.workers,
+            **{k: v for k, v in self.stats.items() if k != "queue_wait_s"},
+            "avg_batch": round(self.stats["jobs"] / batches, 2) if batches else 0.0,
+            "avg_queue_wait_s": round(self.stats["queue_wait_s"] / self.stats["jobs"], 3) if self.stats["jobs"] else 0.0,
+        }
@@ -0,0 +1,146 @@
+import asyncio
+import re
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+except ImportError:
+    get_speech_timestamps = None
+
+SAMPLE_RATE = 16000
+FRAME = SAMPLE_RATE // 50  # 20 мс
+
+
+@dataclass
+class Chunk:
+    index: int
+    start: int      # отрезок, который уходит в модель (с перекрытием), в сэмплах
+    end: int
+    own_start: int  # часть, за сегменты которой отвечает кусок: между соседними разрезами
+    own_end: int
+
+
+def _silences(window: np.ndarray) -> List[Tuple[int, int]]:
+    if get_speech_timestamps is None:
+        return []
+    speech = get_speech_timestamps(window, VadOptions(min_silence_duration_ms=300))
+    gaps, prev = [], 0
+    for s in speech:
+        if s["start"] > prev:
+            gaps.append((prev, s["start"]))
+        prev = s["end"]
+    if prev < len(window):
+        gaps.append((prev, len(window)))
+    return gaps
+
+
+def _cut(audio: np.ndarray, lo: int, hi: int) -> int:
+    """Точка разреза в [lo, hi): середина самой длинной паузы по VAD, иначе самое тихое место."""
+    window = audio[lo:hi]
+    gaps = _silences(window)
+    if gaps:
+        a, b = max(gaps, key=lambda g: g[1] - g[0])
+        return lo + (a + b) // 2
+    # VAD нет или пауз не нашлось — минимум энергии, сглаженной по 200 мс
+    k = len(window) // FRAME
+    energy = np.square(window[:k * FRAME].reshape(k, FRAME)).mean(axis=1)
+    smooth = np.convolve(energy, np.ones(10) / 10, mode="same")
+    return lo + int(np.argmin(smooth)) * FRAME + FRAME // 2
+
+
+def plan_chunks(audio: np.ndarray, chunk_s: float = 60.0, overlap_s: float = 1.0,
+                search_s: float = 10.0) -> List[Chunk]:
+    """
+    Режет дорожку на куски около chunk_s: разрез ищется в окне ±search_s вокруг цели
+    (VAD смотрит только окно, а не весь файл), каждый кусок расширяется на overlap_s
+    в обе стороны, чтобы слово на разрезе целиком попало хотя бы в один из них. Блокирующий.
+    """
+    n = len(audio)
+    size = int(chunk_s * SAMPLE_RATE)
+    search = min(int(search_s * SAMPLE_RATE), size // 2)
+    overlap = int(overlap_s * SAMPLE_RATE)
+    cuts = [0]
+    while n - cuts[-1] > size + search:
+        target = cuts[-1] + size
+        cuts.append(_cut(audio, target - search, target + search))
+    cuts.append(n)
+    return [Chunk(i, max(0, a - overlap), min(n, b + overlap), a, b) for i, (a, b) in enumerate(zip(cuts, cuts[1:]))]
+
+
+def detect_language(model: Any, audio: np.ndarray) -> Optional[str]:
+    """Язык по первым 30 с: transcribe определяет его сразу, а ленивые сегменты не декодируются. Блокирующий."""
+    _, info = model.transcribe(audio[:30 * SAMPLE_RATE], beam_size=1)
+    return info.language
+
+
+def _own(chunk: Chunk, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # сегмент принадлежит куску, в чью собственную часть попала его середина: дубли из перекрытий отпадают
+    offset = chunk.start / SAMPLE_RATE
+    lo, hi = chunk.own_start / SAMPLE_RATE, chunk.own_end / SAMPLE_RATE
+    out = []
+    for s in result["segments"]:
+        start, end = s["start"] + offset, s["end"] + offset
+        if lo <= (start + end) / 2 < hi:
+            out.append({"start": round(start, 3), "end": round(end, 3), "text": s["text"]})
+    return out
+
+
+def _words(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+async def transcribe_chunks(
+    submit: Callable[[np.ndarray, Optional[str], str], Awaitable[Dict[str, Any]]],
+    audio: np.ndarray,
+    chunks: List[Chunk],
+    language: Optional[str],
+    task: str = "transcribe",
+    parallel: int = 8,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Распознаёт куски параллельно (до parallel в очереди планировщика) и отдаёт события по порядку:
+    {"type": "segment", ...} с абсолютными временами, как только готовы все куски до текущего,
+    затем {"type": "done", "done": true, ...} — ключ done, как у финального объекта Ollama, gateway
+    по нему помечает событие в SSE. При закрытии генератора невыполненные куски отменяются.
+    """
+    sem = asyncio.Semaphore(parallel)
+
+    async def run(chunk: Chunk) -> Dict[str, Any]:
+        async with sem:
+            return await submit(audio[chunk.start:chunk.end], language, task)
+
+    tasks = [asyncio.create_task(run(c)) for c in chunks]
+    prev: Optional[Dict[str, Any]] = None
+    texts: List[str] = []
+    try:
+        for chunk, pending in zip(chunks, tasks):
+            result = await pending
+            language = language or result.get("language")
+            for seg in _own(chunk, result):
+                # тот же текст по обе стороны разреза с наложением по времени — один сегмент
+                if prev and seg["start"] < prev["end"] and _words(seg["text"]) == _words(prev["text"]):
+                    continue
+                prev = seg
+                texts.append(seg["text"])
+                yield {"type": "segment", "index": len(texts) - 1, "chunk": chunk.index, **seg}
+        yield {"type": "done", "done": True, "text": "".join(texts), "language": language,
+               "duration": round(len(audio) / SAMPLE_RATE, 3), "chunks": len(chunks), "segments": len(texts)}
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def collect(events: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Собирает события transcribe_chunks в ответ того же вида, что у обычного /transcribe."""
+    segments = []
+    async for event in events:
+        if event["type"] == "segment":
+            segments.append({"start": event["start"], "end": event["end"], "text": event["text"]})
+        else:
+            return {"text": event["text"], "language": event["language"], "duration": event["duration"],
+                    "segments": segments, "chunks": event["chunks"]}
+    raise RuntimeError("transcription ended without result")
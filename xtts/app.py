@@ -1,41 +1,209 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from TTS.api import TTS
-import tempfile, os
+from collections import OrderedDict
+from typing import List, Optional, Union
+import asyncio, hashlib, io, logging, os, struct, threading, time, wave
+import numpy as np
 import torch
 
-app = FastAPI()
+log = logging.getLogger("xtts")
+
 _model = None
+_model_lock = threading.Lock()
+# прогрев при старте: загрузка модели и пробный синтез (первый инференс компилирует ядра CUDA)
+_warmup = os.getenv("XTTS_WARMUP", "1") == "1"
+_ready = {"ready": False, "load_s": None, "warmup_s": None, "error": None}
+# сколько голосов держим в кэше латентов и какой встроенный спикер берём, если голос не задан
+_latent_cache_size = int(os.getenv("XTTS_LATENT_CACHE", 64))
+_default_speaker = os.getenv("XTTS_DEFAULT_SPEAKER", "Claribel Dervla")
+# размер чанка стрима в токенах GPT: меньше — раньше первый звук, но больше накладных расходов
+_stream_chunk = int(os.getenv("XTTS_STREAM_CHUNK", 20))
+
+_latents: "OrderedDict[str, tuple]" = OrderedDict()
+_latent_stats = {"hits": 0, "misses": 0}
+# одна модель на GPU — синтезы идут по очереди, стрим держит её до конца фразы
+_gpu_lock = asyncio.Lock()
 
 def get_model():
     global _model
-    if _model is None:
-        use_gpu = torch.cuda.is_available()
-        _model = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", gpu=use_gpu)
+    with _model_lock:
+        if _model is None:
+            use_gpu = torch.cuda.is_available()
+            _model = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", gpu=use_gpu)
     return _model
 
+def xtts():
+    return get_model().synthesizer.tts_model
+
 class TTSIn(BaseModel):
     text: str
-    speaker_wav: str | None = None
+    speaker: Optional[str] = None
+    speaker_wav: Optional[Union[str, List[str]]] = None
     language: str = "ru"
+    stream: bool = False
+
+def _load():
+    t0 = time.perf_counter()
+    get_model()
+    _ready["load_s"] = round(time.perf_counter() - t0, 3)
+    if _warmup:
+        t0 = time.perf_counter()
+        inp = TTSIn(text="Проверка синтеза речи.")
+        _synthesize(inp, *conditioning(inp))
+        _ready["warmup_s"] = round(time.perf_counter() - t0, 3)
+
+async def _warm_up():
+    try:
+        async with _gpu_lock:
+            await run_in_threadpool(_load)
+    except Exception as e:
+        _ready["error"] = str(e)
+        log.exception("XTTS warm-up failed")
+        return
+    _ready["ready"] = True
+    log.info("XTTS ready: load %ss, warm-up %ss", _ready["load_s"], _ready["warmup_s"])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # сервер принимает /health сразу, а /ready отвечает 200 только после прогрева
+    task = asyncio.create_task(_warm_up())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/health")
 def health():
     try:
         m = get_model()
-        return {"status": "ok", "cuda": torch.cuda.is_available(), "cuda_version": torch.version.cuda}
+        return {"status": "ok", "cuda": torch.cuda.is_available(), "cuda_version": torch.version.cuda,
+                "latent_cache": {"size": len(_latents), "max": _latent_cache_size, **_latent_stats}}
     except Exception as e:
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
+@app.get("/ready")
+def ready():
+    return JSONResponse(_ready, status_code=200 if _ready["ready"] else 503)
+
+def _audio_digest(paths: List[str]) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        if not os.path.isfile(path):
+            raise HTTPException(404, f"speaker_wav not found: {path}")
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+        h.update(b"\0")
+    return h.hexdigest()
+
+def conditioning(inp: TTSIn):
+    """Латенты голоса: из кэша по хэшу содержимого референсов, иначе считаем и кладём в LRU."""
+    model = xtts()
+    if not inp.speaker_wav:
+        name = inp.speaker or _default_speaker
+        speakers = getattr(model.speaker_manager, "speakers", None) or {}
+        if name not in speakers:
+            raise HTTPException(404, f"Unknown speaker: {name}")
+        return speakers[name]["gpt_cond_latent"], speakers[name]["speaker_embedding"]
+
+    paths = [inp.speaker_wav] if isinstance(inp.speaker_wav, str) else list(inp.speaker_wav)
+    key = _audio_digest(paths)
+    if key in _latents:
+        _latents.move_to_end(key)
+        _latent_stats["hits"] += 1
+        return _latents[key]
+    _latent_stats["misses"] += 1
+    with torch.inference_mode():
+        value = model.get_conditioning_latents(audio_path=paths)
+    _latents[key] = value
+    while len(_latents) > _latent_cache_size:
+        _latents.popitem(last=False)
+    return value
+
+def _pcm16(chunk) -> bytes:
+    if isinstance(chunk, torch.Tensor):
+        chunk = chunk.squeeze().float().cpu().numpy()
+    return (np.clip(np.asarray(chunk, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def _wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF - 36) -> bytes:
+    # для стрима длина неизвестна: ставим максимум, плееры читают до конца потока
+    return b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVEfmt " + struct.pack(
+        "<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16
+    ) + b"data" + struct.pack("<I", data_size)
+
+def _wav(pcm: bytes, sample_rate: int) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+def _synthesize(inp: TTSIn, latent, embedding) -> bytes:
+    model = xtts()
+    with torch.inference_mode():
+        out = model.inference(inp.text, inp.language, latent, embedding, enable_text_splitting=True)
+    return _wav(_pcm16(out["wav"]), model.config.audio.output_sample_rate)
+
+def _produce(inp: TTSIn, latent, embedding, cancel: threading.Event, emit) -> None:
+    """Весь стрим в одном потоке: генератор XTTS создаётся, читается и закрывается здесь же."""
+    model = xtts()
+    with torch.inference_mode():
+        chunks = model.inference_stream(inp.text, inp.language, latent, embedding,
+                                        stream_chunk_size=_stream_chunk, enable_text_splitting=True)
+        try:
+            for chunk in chunks:
+                if cancel.is_set():
+                    break
+                emit(_pcm16(chunk))
+        finally:
+            chunks.close()
+
+async def _stream(inp: TTSIn, latent, embedding):
+    # заголовок отдаём сразу, дальше PCM по мере генерации (по предложениям, внутри — по чанкам GPT)
+    model = xtts()
+    yield _wav_header(model.config.audio.output_sample_rate)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancel = threading.Event()
+    done = object()
+
+    def finished(_):
+        # GPU свободна, только когда поток синтеза завершился, как бы ни закрылся ответ
+        _gpu_lock.release()
+        queue.put_nowait(done)
+
+    await _gpu_lock.acquire()
+    try:
+        worker = loop.run_in_executor(None, _produce, inp, latent, embedding, cancel,
+                                      lambda pcm: loop.call_soon_threadsafe(queue.put_nowait, pcm))
+    except BaseException:
+        _gpu_lock.release()
+        raise
+    worker.add_done_callback(finished)
+    try:
+        while (item := await queue.get()) is not done:
+            yield item
+        worker.result()
+    finally:
+        # клиент отключился — поток бросит генерацию на следующем чанке
+        cancel.set()
+
 @app.post("/tts")
-def tts(inp: TTSIn):
-    tts = get_model()
-    wav_path = tempfile.mktemp(suffix=".wav")
-    tts.tts_to_file(
-        text=inp.text,
-        file_path=wav_path,
-        speaker_wav=inp.speaker_wav,
-        language=inp.language,
-    )
-    return FileResponse(wav_path, media_type="audio/wav", filename="speech.wav")
+async def tts(inp: TTSIn):
+    headers = {"Content-Disposition": 'inline; filename="speech.wav"'}
+    # латенты считаем до начала ответа, чтобы ошибка голоса пришла обычным статусом
+    async with _gpu_lock:
+        latent, embedding = await run_in_threadpool(conditioning, inp)
+        if not inp.stream:
+            audio = await run_in_threadpool(_synthesize, inp, latent, embedding)
+            return Response(audio, media_type="audio/wav", headers=headers)
+    return StreamingResponse(_stream(inp, latent, embedding), media_type="audio/wav",
+                             headers={**headers, "X-Accel-Buffering": "no"})